@@ -0,0 +1,1180 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process bootstrap API
+
+Example::
+
+    from rhos_bootstrap import api
+
+    result = api.bootstrap("16.2", api.BootstrapOptions(update_packages=True))
+    if not result.success:
+        raise result.exception
+    print(result.to_dict())
+
+The distribution information, dnf manager and subscription manager are
+loaded once and reused by the following calls in the same process. This
+module never configures logging, callers attach their own handlers.
+"""
+
+# pylint: disable=too-many-lines
+
+import contextlib
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+
+from rhos_bootstrap import constants
+from rhos_bootstrap import distribution
+from rhos_bootstrap.journal import CheckpointJournal
+from rhos_bootstrap.journal import plan_key
+from rhos_bootstrap.state import BootstrapState
+from rhos_bootstrap.delta import VersionDelta
+from rhos_bootstrap.events import EventStream
+from rhos_bootstrap.history import RunHistory
+from rhos_bootstrap.constants import DEFAULT_GOVERNOR_NICE
+from rhos_bootstrap.constants import DEFAULT_GOVERNOR_WEIGHT
+from rhos_bootstrap.constants import DEFAULT_PREFETCH_WORKERS
+from rhos_bootstrap.constants import DEFAULT_SHARED_CACHE_MAX_MB
+from rhos_bootstrap.constants import HISTORY_DB
+from rhos_bootstrap.constants import JOURNAL_FILE
+from rhos_bootstrap.constants import STAGED_TRANSACTION_FILE
+from rhos_bootstrap.exceptions import DistroNotSupported
+from rhos_bootstrap.exceptions import StagedTransactionInvalid
+from rhos_bootstrap.utils import counters
+from rhos_bootstrap.utils.cache import SharedCache
+from rhos_bootstrap.utils.dnf import DnfManager
+from rhos_bootstrap.utils.dnf import DnfMetadataPrefetcher
+from rhos_bootstrap.utils.dnf import DryRunResolver
+from rhos_bootstrap.utils.dnf import PackageManifest
+from rhos_bootstrap.utils.dnf import installroot_path
+from rhos_bootstrap.utils.governor import GOVERNORS
+from rhos_bootstrap.utils.governor import ResourceGovernor
+from rhos_bootstrap.utils.governor import parse_rate
+from rhos_bootstrap.utils.pins import DeloreanPins
+from rhos_bootstrap.utils.repos import render_repos
+from rhos_bootstrap.utils.plugins import PluginPolicy
+from rhos_bootstrap.utils.plugins import PluginProfiler
+from rhos_bootstrap.utils.profiling import PhaseProfiler
+from rhos_bootstrap.utils.rhsm import BACKENDS as RHSM_BACKENDS
+from rhos_bootstrap.utils.rhsm import SubscriptionManager
+from rhos_bootstrap.utils.transaction import ResolvedTransaction
+
+LOG = logging.getLogger(__name__)
+
+CLIENT_PACKAGE = "python3-tripleoclient"
+
+# options that do not change what a run does, ignored by the journal key
+JOURNAL_IGNORED_OPTIONS = (
+    "resume",
+    "prefetch_workers",
+    "shared_cache",
+    "shared_cache_max_mb",
+    "events_fd",
+    "events_file",
+    "skip_history",
+    "rhsm_backend",
+    "governor",
+    "governor_nice",
+    "governor_weight",
+    "throttle_bandwidth",
+    "profile_dir",
+)
+
+# phases downloading packages and running rpm transactions
+GOVERNED_PHASES = ("update", "client_install", "apply_staged")
+
+
+class BootstrapOptions:  # pylint: disable=too-many-instance-attributes
+    """Bootstrap run options
+
+    The options match the rhos-bootstrap command line arguments.
+    """
+
+    DEFAULTS = {
+        "skip_validation": False,
+        "skip_repos": False,
+        "skip_ceph_install": False,
+        "skip_modules": False,
+        "update_packages": False,
+        "skip_client_install": False,
+        "prefetch_workers": DEFAULT_PREFETCH_WORKERS,
+        "packages_file": None,
+        "from_version": None,
+        "download_only": False,
+        "apply_staged": False,
+        "export_transaction": None,
+        "replay_transaction": None,
+        "shared_cache": None,
+        "shared_cache_max_mb": DEFAULT_SHARED_CACHE_MAX_MB,
+        "update_memory_budget_mb": None,
+        "resume": False,
+        "delorean_pins": None,
+        "plugin_allow": None,
+        "plugin_deny": None,
+        "events_fd": None,
+        "events_file": None,
+        "installroot": None,
+        "scoped_sack": False,
+        "skip_filelists": False,
+        "skip_history": False,
+        "rhsm_backend": "auto",
+        "governor": None,
+        "governor_nice": DEFAULT_GOVERNOR_NICE,
+        "governor_weight": DEFAULT_GOVERNOR_WEIGHT,
+        "throttle_bandwidth": None,
+        "profile_dir": None,
+    }
+
+    def __init__(self, **kwargs):
+        unknown = set(kwargs) - set(self.DEFAULTS)
+        if unknown:
+            raise TypeError(f"Unknown bootstrap options: {', '.join(sorted(unknown))}")
+        values = dict(self.DEFAULTS, **kwargs)
+        self.skip_validation = values["skip_validation"]
+        self.skip_repos = values["skip_repos"]
+        self.skip_ceph_install = values["skip_ceph_install"]
+        self.skip_modules = values["skip_modules"]
+        self.update_packages = values["update_packages"]
+        self.skip_client_install = values["skip_client_install"]
+        self.prefetch_workers = values["prefetch_workers"]
+        self.packages_file = values["packages_file"]
+        self.from_version = values["from_version"]
+        self.download_only = values["download_only"]
+        self.apply_staged = values["apply_staged"]
+        self.export_transaction = values["export_transaction"]
+        self.replay_transaction = values["replay_transaction"]
+        self.shared_cache = values["shared_cache"]
+        self.shared_cache_max_mb = values["shared_cache_max_mb"]
+        self.update_memory_budget_mb = values["update_memory_budget_mb"]
+        self.resume = values["resume"]
+        self.delorean_pins = values["delorean_pins"]
+        self.plugin_allow = list(values["plugin_allow"] or [])
+        self.plugin_deny = list(values["plugin_deny"] or [])
+        self.events_fd = values["events_fd"]
+        self.events_file = values["events_file"]
+        self.installroot = values["installroot"]
+        self.scoped_sack = values["scoped_sack"]
+        self.skip_filelists = values["skip_filelists"]
+        self.skip_history = values["skip_history"]
+        self.rhsm_backend = values["rhsm_backend"]
+        self.governor = values["governor"]
+        self.governor_nice = values["governor_nice"]
+        self.governor_weight = values["governor_weight"]
+        self.throttle_bandwidth = values["throttle_bandwidth"]
+        self.profile_dir = values["profile_dir"]
+        self._validate()
+
+    def _validate(self):
+        """Raise ValueError on invalid or conflicting options"""
+        if self.rhsm_backend not in RHSM_BACKENDS:
+            raise ValueError(f"Unknown rhsm backend {self.rhsm_backend}")
+        if self.governor is not None and self.governor not in GOVERNORS:
+            raise ValueError(f"Unknown governor {self.governor}")
+        if not 0 <= self.governor_nice <= 19:
+            raise ValueError("governor_nice must be between 0 and 19")
+        if not 1 <= self.governor_weight <= 10000:
+            raise ValueError("governor_weight must be between 1 and 10000")
+        # raises ValueError on an invalid rate
+        self.throttle_bytes = parse_rate(self.throttle_bandwidth)
+        # raises ValueError on invalid rules
+        self.plugin_policy = PluginPolicy(self.plugin_allow, self.plugin_deny)
+        modes = [self.download_only, self.apply_staged, self.replay_transaction]
+        if len([mode for mode in modes if mode]) > 1:
+            raise ValueError(
+                "download_only, apply_staged and replay_transaction can not "
+                "be combined"
+            )
+        if self.installroot and (
+            self.download_only or self.apply_staged or self.export_transaction
+        ):
+            raise ValueError(
+                "installroot can not be combined with download_only, "
+                "apply_staged or export_transaction"
+            )
+        if self.apply_staged and self.export_transaction:
+            raise ValueError("apply_staged and export_transaction can not be combined")
+        if self.update_memory_budget_mb and (
+            self.single_transaction or self.apply_staged
+        ):
+            raise ValueError(
+                "update_memory_budget_mb needs the update in its own transactions"
+            )
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Build options from a dictionary, ignoring unrelated keys"""
+        return cls(**{k: v for k, v in data.items() if k in cls.DEFAULTS})
+
+    @classmethod
+    def from_args(cls, args):
+        return cls.from_dict(vars(args))
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.DEFAULTS}
+
+    @property
+    def single_transaction(self) -> bool:
+        """Whether the update and the packages are resolved together"""
+        return bool(
+            self.download_only or self.export_transaction or self.replay_transaction
+        )
+
+    @property
+    def use_dnf(self) -> bool:
+        return not (
+            self.skip_modules
+            and not self.update_packages
+            and self.skip_client_install
+            and not self.packages_file
+            and not self.apply_staged
+        )
+
+
+class BootstrapResult:  # pylint: disable=too-many-instance-attributes
+    """Bootstrap run result"""
+
+    def __init__(self, version: str, distro: str = None, events: EventStream = None):
+        self._events = events or EventStream()
+        self.version = version
+        self.distro = distro
+        self.success = False
+        self.exception = None
+        self.duration = 0.0
+        # {"name": ..., "status": done|skipped|resumed|failed,
+        #  "duration": seconds}
+        self.phases = []
+        # {"type": repo|module|package, "name": ..., "action": ...}
+        self.changed = []
+        # {"phase": ..., "install": [...], "upgrade": [...], "remove": [...]}
+        self.transactions = []
+        # package manifest outcomes, {name: installed|upgraded|...}
+        self.packages = {}
+        # transaction recorded by a download-only run
+        self.staged = None
+        # whether a resolved transaction was replayed
+        self.replayed = False
+        # shared cache hits, misses and evictions
+        self.cache = None
+        # {"repo": ..., "packages": count, "peak_rss_mb": ...} per update batch
+        self.batches = []
+        # {"<distro>-<version>/<repo>": hash} of the pinned delorean repos
+        self.pins = {}
+        # dnf plugin init time, hook timings and skipped hooks
+        self.plugins = None
+        # repositories, solvables and load time of the dnf sack
+        self.sack = None
+        # commands run, http requests and downloaded bytes
+        self.counters = None
+        # {backend: {method: {"calls": ..., "seconds": ...}}} of the rhsm calls
+        self.rhsm = None
+        # priority, bandwidth cap and CPU and IO waits of the package phases
+        self.governor = None
+
+    @property
+    def error(self):
+        return str(self.exception) if self.exception else None
+
+    def add_change(self, change_type: str, name: str, action: str):
+        self.changed.append({"type": change_type, "name": name, "action": action})
+        self._events.emit("change", type=change_type, name=name, action=action)
+
+    def start_phase(self, name: str) -> dict:
+        phase = {"name": name, "status": "done", "duration": 0.0}
+        self.phases.append(phase)
+        self._events.emit("phase_start", phase=name)
+        return phase
+
+    def add_phase(self, name: str, status: str):
+        """Record a phase that did not run, e.g. skipped"""
+        phase = {"name": name, "status": status, "duration": 0.0}
+        self.phases.append(phase)
+        self.end_phase(phase)
+
+    def end_phase(self, phase: dict):
+        self._events.emit(
+            "phase_end",
+            phase=phase["name"],
+            status=phase["status"],
+            duration=phase["duration"],
+        )
+
+    def add_transaction(self, phase: str, summary: dict):
+        if not summary:
+            return
+        self.transactions.append(dict(summary, phase=phase))
+        self._events.emit(
+            "transaction",
+            phase=phase,
+            **{
+                action: len(summary.get(action, []))
+                for action in ("install", "upgrade", "remove")
+            },
+        )
+        for action in ("install", "upgrade", "remove"):
+            for nevra in summary.get(action, []):
+                self.changed.append(
+                    {"type": "package", "name": nevra, "action": action}
+                )
+
+    def to_dict(self) -> dict:
+        return {
+            "version": self.version,
+            "distro": self.distro,
+            "success": self.success,
+            "error": self.error,
+            "duration": self.duration,
+            "phases": self.phases,
+            "changed": self.changed,
+            "transactions": self.transactions,
+            "packages": self.packages,
+            "staged": self.staged,
+            "replayed": self.replayed,
+            "cache": self.cache,
+            "batches": self.batches,
+            "pins": self.pins,
+            "plugins": self.plugins,
+            "sack": self.sack,
+            "counters": self.counters,
+            "rhsm": self.rhsm,
+            "governor": self.governor,
+        }
+
+
+def build_plan(distro, version: str, options, manager: DnfManager = None) -> dict:
+    """Describe what a bootstrap run would do with the given options
+
+    When a loaded DnfManager is provided, the module actions are computed
+    against the current module state.
+    """
+    data = {
+        "version": version,
+        "distro": distro.distro_normalized_id,
+        "repos": [],
+        "modules": [],
+        "update_packages": options.update_packages,
+        "client_install": not options.skip_client_install,
+    }
+    if not options.skip_repos:
+        data["repos"] = [
+            {"type": repo_type, "name": name}
+            for repo_type, name in distro.get_repo_specs(
+                version, enable_ceph=not options.skip_ceph_install
+            )
+        ]
+    delta = _delta(distro, version, options)
+    if delta:
+        data["delta"] = delta.to_dict()
+    if _use_modules(distro, options):
+        for mod in distro.get_modules(version):
+            action = "enable"
+            if manager and mod.name in manager.enabled_modules:
+                action = "switch"
+                if mod.stream in manager.enabled_modules[mod.name]["stream"]:
+                    action = "none"
+            data["modules"].append(
+                {
+                    "name": mod.name,
+                    "stream": mod.stream,
+                    "profile": mod.profile,
+                    "action": action,
+                }
+            )
+    return data
+
+
+def _use_modules(distro, options) -> bool:
+    # modules are only an 8 thing
+    return not options.skip_modules and int(distro.distro_major_version_id) < 9
+
+
+def _delta(distro, version: str, options) -> VersionDelta:
+    if not options.from_version:
+        return None
+    return VersionDelta(
+        distro,
+        options.from_version,
+        version,
+        enable_ceph=not options.skip_ceph_install,
+        use_modules=_use_modules(distro, options),
+    )
+
+
+class Bootstrapper:  # pylint: disable=too-many-instance-attributes
+    """Reusable bootstrap runner"""
+
+    def __init__(self, distro: distribution.DistributionInfo = None):
+        self._distro = distro
+        self._shared_cache = None
+        self._journal = None
+        self._plugin_profiler = None
+        # manifests of the current run by version
+        self._manifests = {}
+        self._events = None
+        self._governor = None
+        self._phase_profiler = None
+
+    @property
+    def distro(self) -> distribution.DistributionInfo:
+        if self._distro is None:
+            self._distro = distribution.DistributionInfo()
+        return self._distro
+
+    def plan(self, version: str, options: BootstrapOptions = None) -> dict:
+        options = options or BootstrapOptions()
+        # the module state of a manager loaded for another root is not used
+        manager = (
+            DnfManager.instance()
+            if DnfManager.loaded_for(options.installroot)
+            else None
+        )
+        return build_plan(self.distro, version, options, manager)
+
+    def _manifest(self, version: str, options: BootstrapOptions) -> PackageManifest:
+        """The version and file package manifests, empty if neither exist"""
+        if version in self._manifests:
+            return self._manifests[version]
+        manifest = self.distro.get_packages(version)
+        if options.packages_file:
+            manifest = manifest.merge(PackageManifest.from_file(options.packages_file))
+        if manifest and not options.skip_client_install:
+            # install tripleoclient in the same transaction
+            manifest = manifest.merge(PackageManifest(install=[CLIENT_PACKAGE]))
+        self._manifests[version] = manifest
+        return manifest
+
+    @contextlib.contextmanager
+    def _phase(self, result: BootstrapResult, name: str):
+        phase = result.start_phase(name)
+        if self._plugin_profiler:
+            self._plugin_profiler.phase = name
+        start = time.monotonic()
+        try:
+            with self._governed(name), self._profiled(name):
+                yield phase
+        except Exception:
+            phase["status"] = "failed"
+            raise
+        else:
+            self._complete(name)
+        finally:
+            phase["duration"] = round(time.monotonic() - start, 3)
+            result.end_phase(phase)
+
+    def _governed(self, name: str):
+        if self._governor and name in GOVERNED_PHASES:
+            return self._governor.throttled(name)
+        return contextlib.ExitStack()
+
+    def _profiled(self, name: str):
+        if self._phase_profiler:
+            return self._phase_profiler.profile(name)
+        return contextlib.ExitStack()
+
+    @staticmethod
+    def _get_phase_profiler(options: BootstrapOptions) -> PhaseProfiler:
+        if not options.profile_dir:
+            return None
+        directory = options.profile_dir
+        if options.installroot:
+            # the installroots of a batch are profiled side by side
+            name = options.installroot.strip(os.sep).replace(os.sep, "_")
+            directory = os.path.join(directory, name)
+        return PhaseProfiler(directory)
+
+    @staticmethod
+    def _skip(result: BootstrapResult, name: str, message: str = None):
+        if message:
+            LOG.info(message)
+        result.add_phase(name, "skipped")
+
+    def _open_journal(self, version: str, options: BootstrapOptions):
+        key = plan_key(
+            build_plan(self.distro, version, options),
+            {
+                k: v
+                for k, v in options.to_dict().items()
+                if k not in JOURNAL_IGNORED_OPTIONS
+            },
+        )
+        journal_file = installroot_path(options.installroot, JOURNAL_FILE)
+        if options.resume:
+            self._journal = CheckpointJournal.load(key, journal_file)
+            LOG.info("Resuming with %d completed steps", len(self._journal.steps))
+        else:
+            self._journal = CheckpointJournal(key, journal_file)
+            self._journal.save()
+
+    def _step_done(self, step: str, verify=None) -> bool:
+        """Whether a previous run completed the step and it still holds"""
+        if self._journal is None or not self._journal.done(step):
+            return False
+        if verify is not None and not verify():
+            LOG.warning("%s was completed but changed since, running it again", step)
+            return False
+        return True
+
+    def _complete(self, step: str):
+        if self._journal is not None:
+            self._journal.complete(step)
+
+    def _resumed(self, result: BootstrapResult, name: str, verify=None) -> bool:
+        if not self._step_done(name, verify):
+            return False
+        LOG.info("=== Resuming, %s was already completed...", name)
+        result.add_phase(name, "resumed")
+        return True
+
+    def _target_repos(self, version: str, options: BootstrapOptions, delta) -> list:
+        if delta:
+            return [
+                self.distro.construct_repo(repo_type, version, name)
+                for repo_type, name in delta.repos_added
+            ]
+        return self.distro.get_repos(version, enable_ceph=not options.skip_ceph_install)
+
+    def _repo_scope(self, version: str, options: BootstrapOptions, repos, delta):
+        """Ids of the repositories the version uses"""
+        if not repos or delta:
+            # a delta only configured the added repos
+            repos = self.distro.get_repos(
+                version, enable_ceph=not options.skip_ceph_install
+            )
+        return sorted({i for repo in repos for i in repo.repo_ids})
+
+    def _needs_filelists(self, version: str, options: BootstrapOptions) -> bool:
+        """Whether a requested package is a file path"""
+        for _, name in self._manifest(version, options).intents():
+            if "/" in name:
+                LOG.info("Loading filelists, %s is a file path", name)
+                return True
+        return False
+
+    @staticmethod
+    def _module_enabled(manager, mod) -> bool:
+        enabled = manager.enabled_modules.get(mod.name)
+        return bool(enabled) and mod.stream in enabled["stream"]
+
+    def dry_run(self, version: str, options: BootstrapOptions = None) -> dict:
+        """Predict what a run would do without changing the system
+
+        The repositories are rendered in a temporary reposdir, the module
+        streams are switched in memory and the update and the packages are
+        resolved in a single transaction that is not downloaded or
+        committed. Returns the plan with the predicted transaction, its
+        download size and the problems a run would run into.
+        """
+        options = options or BootstrapOptions()
+        distro = self.distro
+        start = time.monotonic()
+        report = build_plan(distro, version, options)
+        report.update(transaction=None, packages={}, download_size=0, problems=[])
+        problems = report["problems"]
+        if not options.skip_validation and not distro.validate_distro(version):
+            problems.append(str(DistroNotSupported(distro.distro_normalized_id)))
+        delta = _delta(distro, version, options)
+        with tempfile.TemporaryDirectory(prefix="rhos-bootstrap-") as reposdir:
+            added_repo_ids = None
+            if options.skip_repos:
+                # the current configuration, unchanged
+                problems.extend(render_repos(reposdir, []))
+            else:
+                repos = self._target_repos(version, options, delta)
+                if options.delorean_pins:
+                    report["pins"] = DeloreanPins.load(options.delorean_pins).apply(
+                        repos, save=False
+                    )
+                removed = []
+                if delta:
+                    removed = [
+                        distro.construct_repo(repo_type, delta.from_version, name)
+                        for repo_type, name in delta.repos_removed
+                    ]
+                    added_repo_ids = [i for repo in repos for i in repo.repo_ids]
+                problems.extend(
+                    render_repos(
+                        reposdir,
+                        repos,
+                        removed=removed,
+                        reset_rhsm=not delta and "rhel" in distro.distro_id,
+                    )
+                )
+            if options.use_dnf:
+                resolver = DryRunResolver(reposdir, self._get_shared_cache(options))
+                try:
+                    if resolver.setup():
+                        if _use_modules(distro, options):
+                            resolver.switch_modules(
+                                distro.get_modules(version),
+                                disable=delta.modules_removed if delta else None,
+                            )
+                        update_names = []
+                        if options.update_packages:
+                            update_names = self._update_names(
+                                resolver, delta, added_repo_ids
+                            )
+                        report.update(
+                            resolver.resolve(
+                                self._single_manifest(version, options, update_names)
+                            )
+                        )
+                finally:
+                    resolver.close()
+                problems.extend(resolver.problems)
+        report["success"] = not problems
+        report["duration"] = round(time.monotonic() - start, 3)
+        return report
+
+    def run(self, version: str, options: BootstrapOptions = None) -> BootstrapResult:
+        """Configure the system for an OpenStack version
+
+        Errors are not raised, they are reported in the result.
+        """
+        options = options or BootstrapOptions()
+        try:
+            events = EventStream.open(
+                options.events_fd,
+                options.events_file,
+                fields=(
+                    {"installroot": options.installroot}
+                    if options.installroot
+                    else None
+                ),
+            )
+        except OSError as e:
+            LOG.warning("Unable to open the event stream: %s", e)
+            events = EventStream()
+        self._events = events
+        result = BootstrapResult(version, events=events)
+        started = time.time()
+        start = time.monotonic()
+        counters.reset()
+        SubscriptionManager.use_backend(options.rhsm_backend)
+        self._governor = None
+        self._phase_profiler = self._get_phase_profiler(options)
+        if options.governor or options.throttle_bytes:
+            self._governor = ResourceGovernor(
+                options.governor,
+                nice=options.governor_nice,
+                weight=options.governor_weight,
+                bandwidth=options.throttle_bytes,
+            )
+        events.emit("run_start", version=version)
+        shared_cache = self._get_shared_cache(options)
+        self._journal = None
+        self._plugin_profiler = PluginProfiler(options.plugin_policy)
+        self._manifests = {}
+        try:
+            result.distro = self.distro.distro_normalized_id
+            self._open_journal(version, options)
+            self._run(version, options, result)
+            result.success = True
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.error("Bootstrap of %s failed: %s", version, e)
+            result.exception = e
+        if shared_cache:
+            result.cache = shared_cache.stats()
+            LOG.info(
+                "Shared cache: metadata %(hits)d hits, %(misses)d misses",
+                result.cache["metadata"],
+            )
+            LOG.info(
+                "Shared cache: packages %(hits)d hits, %(misses)d misses",
+                result.cache["packages"],
+            )
+        result.rhsm = SubscriptionManager.call_stats() or None
+        if options.use_dnf and DnfManager.loaded():
+            result.plugins = self._plugin_profiler.report()
+            for name, seconds in self._plugin_profiler.costliest():
+                LOG.info("dnf plugin %s: %.3fs", name, seconds)
+        result.counters = counters.snapshot()
+        if self._phase_profiler:
+            LOG.info("Phase profiles written to %s", self._phase_profiler.directory)
+        if self._governor:
+            result.governor = self._governor.report(
+                result.counters[counters.DOWNLOAD_BYTES]
+            )
+        result.duration = round(time.monotonic() - start, 3)
+        if not options.skip_history:
+            self._record_history(options, result, started)
+        events.emit(
+            "run_end",
+            version=version,
+            success=result.success,
+            error=result.error,
+            duration=result.duration,
+        )
+        events.close()
+        self._events = None
+        return result
+
+    def _record_history(
+        self, options: BootstrapOptions, result: BootstrapResult, started: float
+    ):
+        history = RunHistory(installroot_path(options.installroot, HISTORY_DB))
+        try:
+            history.record(
+                result.to_dict(),
+                plan_hash=self._journal.key if self._journal else None,
+                started=started,
+            )
+        except (OSError, sqlite3.Error) as e:
+            LOG.warning("Unable to record the run in %s: %s", history.path, e)
+
+    def _get_shared_cache(self, options: BootstrapOptions) -> SharedCache:
+        if not options.shared_cache:
+            return None
+        cache = self._shared_cache
+        if (
+            cache is None
+            or cache.path != options.shared_cache
+            or cache.max_size != options.shared_cache_max_mb * 1024 * 1024
+        ):
+            cache = SharedCache(options.shared_cache, options.shared_cache_max_mb)
+            self._shared_cache = cache
+        cache.reset_stats()
+        return cache
+
+    @staticmethod
+    def _update_names(manager, delta, added_repo_ids) -> list:
+        """Packages to update, ["*"] for the whole system"""
+        if not delta or not delta.scoped_update or added_repo_ids is None:
+            return ["*"]
+        return manager.upgradable_packages(added_repo_ids)
+
+    def _update(
+        self, options, manager, delta, added_repo_ids, result: BootstrapResult
+    ):  # pylint: disable=too-many-arguments
+        names = self._update_names(manager, delta, added_repo_ids)
+        if not names:
+            LOG.info("No installed package is updated by the new repositories")
+            return
+        if options.update_memory_budget_mb:
+            LOG.info(
+                "Updating in batches with a %sMB memory budget",
+                options.update_memory_budget_mb,
+            )
+            batches = manager.update_batched(
+                options.update_memory_budget_mb, None if names == ["*"] else names
+            )
+            for batch in batches:
+                result.add_transaction("update", batch["transaction"])
+                result.batches.append(
+                    {
+                        "repo": batch["repo"],
+                        "packages": len(batch["packages"]),
+                        "peak_rss_mb": batch["peak_rss_mb"],
+                    }
+                )
+            return
+        if names == ["*"]:
+            result.add_transaction("update", manager.update_package("*"))
+            return
+        LOG.info("Updating %d packages from the new repositories", len(names))
+        outcome = manager.apply_manifest(PackageManifest(upgrade=names))
+        result.add_transaction("update", outcome["transaction"])
+
+    def _install(self, version, options, manager, result: BootstrapResult):
+        manifest = self._manifest(version, options)
+        if manifest:
+            if self._resumed(result, "client_install"):
+                return
+            with self._phase(result, "client_install"):
+                LOG.info("=== Processing package manifest...")
+                for intent, name in manifest.intents():
+                    LOG.info("%s %s", intent.capitalize(), name)
+                outcome = manager.apply_manifest(manifest)
+                result.packages = outcome["packages"]
+                result.add_transaction("client_install", outcome["transaction"])
+        elif not options.skip_client_install:
+            if self._resumed(
+                result,
+                "client_install",
+                lambda: manager.is_installed(CLIENT_PACKAGE),
+            ):
+                return
+            with self._phase(result, "client_install"):
+                LOG.info("=== Installing tripleoclient...")
+                result.add_transaction(
+                    "client_install", manager.install_update_package(CLIENT_PACKAGE)
+                )
+        else:
+            self._skip(
+                result, "client_install", "=== Skipping tripleoclient installation..."
+            )
+
+    def _replay(self, path, version, manager, state) -> dict:
+        """Replay a resolved transaction, None if it can not be used"""
+        resolved = ResolvedTransaction.load(path)
+        reasons = resolved.incompatibilities(
+            version, self.distro.distro_normalized_id, state
+        )
+        if reasons:
+            LOG.warning(
+                "Not replaying %s, resolving normally: %s", path, "; ".join(reasons)
+            )
+            return None
+        LOG.info("Replaying the transaction from %s", path)
+        try:
+            summary = manager.apply_resolved(resolved.transaction)
+        except StagedTransactionInvalid as e:
+            LOG.warning("Replaying %s failed, resolving normally: %s", path, e)
+            return None
+        return {"packages": {}, "transaction": summary}
+
+    def _single_manifest(
+        self, version: str, options: BootstrapOptions, update_names: list
+    ) -> PackageManifest:
+        # the update and the packages are resolved as a single transaction
+        manifest = PackageManifest(upgrade=update_names).merge(
+            self._manifest(version, options)
+        )
+        if not options.skip_client_install:
+            manifest = manifest.merge(PackageManifest(install=[CLIENT_PACKAGE]))
+        return manifest
+
+    def _resolve_packages(
+        self, version, options, manager, update_names, result: BootstrapResult
+    ):
+        manifest = self._single_manifest(version, options, update_names)
+        # captured before anything is committed
+        state = manager.system_state()
+        outcome = None
+        if options.replay_transaction:
+            outcome = self._replay(options.replay_transaction, version, manager, state)
+            result.replayed = outcome is not None
+        if outcome is None:
+            if options.download_only:
+                LOG.info("=== Downloading packages...")
+            else:
+                LOG.info("=== Processing packages...")
+            outcome = manager.apply_manifest(
+                manifest, download_only=options.download_only
+            )
+        result.packages = outcome["packages"]
+        resolved = ResolvedTransaction(
+            version,
+            self.distro.distro_normalized_id,
+            manifest.to_dict(),
+            outcome["transaction"],
+            state=state,
+        )
+        if options.download_only:
+            resolved.save()
+            result.staged = resolved.to_dict()
+            LOG.info(
+                "Staged %d packages, apply them with --apply-staged",
+                sum(len(v) for v in outcome["transaction"].values()),
+            )
+        else:
+            result.add_transaction("packages", outcome["transaction"])
+        if options.export_transaction:
+            LOG.info("Exporting the transaction to %s", options.export_transaction)
+            resolved.save(options.export_transaction)
+
+    def _apply_staged(self, version, manager, result: BootstrapResult):
+        staged = ResolvedTransaction.load()
+        if staged.version != version:
+            raise StagedTransactionInvalid(f"packages were staged for {staged.version}")
+        LOG.info("=== Applying staged packages...")
+        outcome = manager.apply_manifest(
+            PackageManifest.from_dict(staged.manifest), expected=staged.transaction
+        )
+        result.packages = outcome["packages"]
+        result.add_transaction("apply_staged", outcome["transaction"])
+        staged.remove()
+
+    def _record_state(
+        self, version, options, repos, modules, delta, result: BootstrapResult
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+        """Record what is configured for the status command"""
+        distro = self.distro
+        configure_repos = not options.skip_repos and not options.apply_staged
+        packages = None
+        if not options.skip_client_install or options.packages_file:
+            packages = list(self._manifest(version, options).install)
+            if not options.skip_client_install and CLIENT_PACKAGE not in packages:
+                packages.append(CLIENT_PACKAGE)
+        state = BootstrapState.from_system(
+            version,
+            distro.distro_normalized_id,
+            repos=repos if configure_repos else None,
+            modules=modules if _use_modules(distro, options) else None,
+            packages=packages,
+        )
+        # the default state file is looked up when it is used
+        state_file = None
+        if options.installroot:
+            state_file = installroot_path(options.installroot, constants.STATE_FILE)
+        previous = BootstrapState.load(state_file)
+        if previous and previous.version not in (
+            version,
+            delta.from_version if delta else version,
+        ):
+            previous = None
+        if previous:
+            # keep what this run did not configure
+            repos_state = state.repos
+            if (delta or repos_state is None) and previous.repos is not None:
+                removed = {
+                    c["name"]
+                    for c in result.changed
+                    if c["type"] == "repo" and c["action"] == "remove"
+                }
+                repos_state = {
+                    name: repo
+                    for name, repo in previous.repos.items()
+                    if name not in removed
+                }
+                # a delta only configured the added repos
+                repos_state.update(state.repos or {})
+            state = BootstrapState(
+                version,
+                state.distro,
+                repos=repos_state,
+                modules=previous.modules if state.modules is None else state.modules,
+                packages=(
+                    previous.packages if state.packages is None else state.packages
+                ),
+            )
+        try:
+            state.save(state_file)
+        except OSError as e:
+            LOG.warning("Unable to record the bootstrap state: %s", e)
+
+    def _run(
+        self, version: str, options: BootstrapOptions, result: BootstrapResult
+    ):  # pylint: disable=too-many-branches,too-many-statements,too-many-locals
+        distro = self.distro
+        LOG.info("=" * 40)
+        LOG.info("=== OpenStack Version: %s", version)
+        LOG.info("=== Distribution: %s", distro.distro_normalized_id)
+        LOG.info("=" * 40)
+        if options.skip_validation:
+            self._skip(
+                result, "validation", "=== Skipping validation of version for distro..."
+            )
+        elif not self._resumed(result, "validation"):
+            with self._phase(result, "validation"):
+                LOG.info("=== Validating version for distro...")
+                if not distro.validate_distro(version):
+                    raise DistroNotSupported(distro.distro_normalized_id)
+                LOG.info("OK! %s on %s", version, distro.distro_normalized_id)
+
+        # the download-only run already configured the repositories
+        configure_repos = not options.skip_repos and not options.apply_staged
+        shared_cache = self._shared_cache if options.shared_cache else None
+        prefetcher = None
+        if options.use_dnf and configure_repos and options.prefetch_workers > 0:
+            prefetcher = DnfMetadataPrefetcher(
+                options.prefetch_workers,
+                shared_cache=shared_cache,
+                installroot=options.installroot,
+                throttle=options.throttle_bytes,
+            )
+
+        # the prefetch threads are stopped even when a phase fails
+        try:
+            delta = _delta(distro, version, options)
+            # repository ids the delta upgrade is scoped to, None for everything
+            added_repo_ids = None
+            repos = (
+                self._target_repos(version, options, delta) if configure_repos else []
+            )
+            if repos and options.delorean_pins:
+                result.pins = DeloreanPins.load(options.delorean_pins).apply(repos)
+            if not configure_repos:
+                self._skip(result, "repos", "=== Skipping repository configuration...")
+            elif self._resumed(
+                result, "repos", lambda: all(repo.is_configured() for repo in repos)
+            ):
+                if delta:
+                    added_repo_ids = [i for repo in repos for i in repo.repo_ids]
+            else:
+                with self._phase(result, "repos"):
+                    LOG.info("=== Configuring repositories...")
+                    if delta:
+                        LOG.info(
+                            "Only applying repository changes from %s",
+                            delta.from_version,
+                        )
+                        # removed first, delorean repos reuse the same file name
+                        for repo_type, name in delta.repos_removed:
+                            repo = distro.construct_repo(
+                                repo_type, delta.from_version, name
+                            )
+                            if self._step_done(f"repo-remove:{repo.name}"):
+                                continue
+                            LOG.info("Removing %s", repo.name)
+                            repo.remove()
+                            result.add_change("repo", repo.name, "remove")
+                            self._complete(f"repo-remove:{repo.name}")
+                        added_repo_ids = []
+                    elif "rhel" in distro.distro_id and not self._step_done(
+                        "repos:reset"
+                    ):
+                        LOG.info("Disabling all existing configured repositories...")
+                        rhsm = SubscriptionManager.instance()
+                        rhsm.repos(disable=["*"])
+                        self._complete("repos:reset")
+
+                    for repo in repos:
+                        if self._step_done(f"repo:{repo.name}", repo.is_configured):
+                            LOG.info("%s is already configured", repo.name)
+                        else:
+                            LOG.info("Configuring %s", repo.name)
+                            repo.save()
+                            result.add_change("repo", repo.name, "configure")
+                            self._complete(f"repo:{repo.name}")
+                        if added_repo_ids is not None:
+                            added_repo_ids.extend(repo.repo_ids)
+                        if prefetcher:
+                            prefetcher.submit(repo.repo_ids)
+
+            manager = None
+            if options.use_dnf:
+                with self._phase(result, "dnf_setup"):
+                    LOG.info("=== Configuring dnf...")
+                    # an already loaded manager needs to pick up the new
+                    # repositories, one loaded for another root is replaced
+                    reload_repos = (
+                        DnfManager.loaded_for(options.installroot) and configure_repos
+                    )
+                    # we don't need a manager if we're not calling it
+                    repo_scope = None
+                    if options.scoped_sack:
+                        repo_scope = self._repo_scope(version, options, repos, delta)
+                    skip_filelists = (
+                        options.skip_filelists
+                        and not self._needs_filelists(version, options)
+                    )
+                    manager = DnfManager.instance(
+                        prefetcher=prefetcher,
+                        cacheonly=options.apply_staged,
+                        shared_cache=shared_cache,
+                        plugin_profiler=self._plugin_profiler,
+                        installroot=options.installroot,
+                        repo_scope=repo_scope,
+                        skip_filelists=skip_filelists,
+                    )
+                    manager.events = self._events
+                    if manager.throttle != options.throttle_bytes:
+                        manager.use_throttle(options.throttle_bytes)
+                    if self._governor and options.throttle_bytes:
+                        self._governor.use_download_rate(manager.download_rate)
+                    if manager.plugin_profiler is not self._plugin_profiler:
+                        manager.use_plugin_profiler(self._plugin_profiler)
+                    if manager.shared_cache is not shared_cache:
+                        manager.use_shared_cache(shared_cache)
+                        reload_repos = True
+                    scope = None if repo_scope is None else set(repo_scope)
+                    if (
+                        manager.repo_scope != scope
+                        or manager.skip_filelists != skip_filelists
+                    ):
+                        manager.use_repo_scope(repo_scope, skip_filelists)
+                        reload_repos = True
+                    if reload_repos or manager.cacheonly != options.apply_staged:
+                        manager.refresh(
+                            prefetcher=prefetcher, cacheonly=options.apply_staged
+                        )
+                    result.sack = manager.sack_stats
+            else:
+                self._skip(result, "dnf_setup", "=== Skipping dnf configuration...")
+        finally:
+            if prefetcher:
+                prefetcher.close()
+
+        modules = distro.get_modules(version) if _use_modules(distro, options) else []
+        if not _use_modules(distro, options):
+            self._skip(result, "modules", "=== Skipping module configuration...")
+        elif not self._resumed(
+            result,
+            "modules",
+            lambda: all(self._module_enabled(manager, mod) for mod in modules),
+        ):
+            with self._phase(result, "modules"):
+                LOG.info("=== Configuring modules...")
+                for mod in delta.modules_removed if delta else []:
+                    step = f"module-disable:{mod.name}:{mod.stream}"
+                    if self._step_done(step):
+                        continue
+                    LOG.info("Disabling %s:%s", mod.name, mod.stream)
+                    manager.disable_module(mod.name, mod.stream)
+                    result.add_change("module", f"{mod.name}:{mod.stream}", "disable")
+                    self._complete(step)
+                for mod in modules:
+                    LOG.info("Enabling %s:%s", mod.name, mod.stream)
+                    if manager.enable_module(mod.name, mod.stream, mod.profile):
+                        result.add_change(
+                            "module", f"{mod.name}:{mod.stream}", "enable"
+                        )
+                    self._complete(f"module:{mod.name}:{mod.stream}")
+
+        if options.single_transaction:
+            phase = "download" if options.download_only else "packages"
+            if not self._resumed(
+                result,
+                phase,
+                lambda: not options.download_only
+                or os.path.exists(STAGED_TRANSACTION_FILE),
+            ):
+                with self._phase(result, phase):
+                    update_names = []
+                    if options.update_packages:
+                        update_names = self._update_names(
+                            manager, delta, added_repo_ids
+                        )
+                    self._resolve_packages(
+                        version, options, manager, update_names, result
+                    )
+        elif options.apply_staged:
+            if not self._resumed(result, "apply_staged"):
+                with self._phase(result, "apply_staged"):
+                    self._apply_staged(version, manager, result)
+        else:
+            if options.update_packages and self._resumed(result, "update"):
+                pass
+            elif options.update_packages:
+                with self._phase(result, "update"):
+                    LOG.info("=== Performing update...")
+                    self._update(options, manager, delta, added_repo_ids, result)
+                    LOG.info("NOTE: A manual reboot may be required")
+            else:
+                self._skip(result, "update")
+            self._install(version, options, manager, result)
+        if not options.download_only:
+            self._record_state(version, options, repos, modules, delta, result)
+        LOG.info("=== Done!")
+
+
+_BOOTSTRAPPER = None
+
+
+def get_bootstrapper() -> Bootstrapper:
+    """The process wide Bootstrapper used by bootstrap() and plan()"""
+    global _BOOTSTRAPPER  # pylint: disable=global-statement
+    if _BOOTSTRAPPER is None:
+        _BOOTSTRAPPER = Bootstrapper()
+    return _BOOTSTRAPPER
+
+
+def bootstrap(version: str, options: BootstrapOptions = None) -> BootstrapResult:
+    return get_bootstrapper().run(version, options)
+
+
+def plan(version: str, options: BootstrapOptions = None) -> dict:
+    return get_bootstrapper().plan(version, options)
@@ -0,0 +1,184 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bootstrap of several installroots
+
+Image builds bootstrap several chroots with the same version. The version
+is validated and the repositories are configured once, on the host. Every
+installroot is then bootstrapped in its own worker process with dnf using
+the host repositories and a shared cache. The shared cache lock lets the
+first worker download the metadata and the packages while the others wait
+and reuse them, the rpm transactions of the installroots run in parallel.
+"""
+
+import logging
+import multiprocessing
+import os
+import time
+
+from rhos_bootstrap import api
+from rhos_bootstrap.constants import DEFAULT_INSTALLROOT_WORKERS
+from rhos_bootstrap.constants import INSTALLROOT_CACHE_DIR
+from rhos_bootstrap.utils.dnf import DnfManager
+
+LOG = logging.getLogger(__name__)
+
+# the bootstrapper of the worker processes
+_WORKER_BOOTSTRAPPER = None
+
+
+def _init_worker(distro):
+    global _WORKER_BOOTSTRAPPER  # pylint: disable=global-statement
+    # a forked worker must not reuse a dnf base loaded by the parent
+    DnfManager.reset()
+    _WORKER_BOOTSTRAPPER = api.Bootstrapper(distro)
+
+
+def _bootstrap_root(version: str, options: dict) -> dict:
+    """Bootstrap one installroot, run in a worker process"""
+    options = api.BootstrapOptions.from_dict(options)
+    return _WORKER_BOOTSTRAPPER.run(version, options).to_dict()
+
+
+def host_options(options: api.BootstrapOptions) -> api.BootstrapOptions:
+    """Validation and repository configuration only, without dnf"""
+    data = options.to_dict()
+    data.update(
+        skip_modules=True,
+        update_packages=False,
+        skip_client_install=True,
+        packages_file=None,
+        replay_transaction=None,
+        update_memory_budget_mb=None,
+        installroot=None,
+        prefetch_workers=0,
+    )
+    return api.BootstrapOptions(**data)
+
+
+def installroot_options(
+    options: api.BootstrapOptions, installroot: str, shared_cache: str
+) -> dict:
+    """The options of an installroot, the host did the rest"""
+    data = options.to_dict()
+    data.update(
+        installroot=installroot,
+        skip_validation=True,
+        skip_repos=True,
+        delorean_pins=None,
+        shared_cache=shared_cache,
+        prefetch_workers=0,
+    )
+    # validated before they are sent to the workers
+    return api.BootstrapOptions(**data).to_dict()
+
+
+def _unique_roots(installroots: list) -> list:
+    roots = []
+    for root in installroots:
+        root = os.path.abspath(root)
+        if root == os.sep:
+            raise ValueError("The host can not be an installroot")
+        if root not in roots:
+            roots.append(root)
+    if not roots:
+        raise ValueError("No installroot to bootstrap")
+    return roots
+
+
+class BatchResult:
+    """Result of the bootstrap of several installroots"""
+
+    def __init__(self, version: str):
+        self.version = version
+        # result of the host validation and repository configuration
+        self.host = None
+        # {installroot: BootstrapResult.to_dict()}
+        self.installroots = {}
+        self.duration = 0.0
+
+    @property
+    def failed(self) -> list:
+        return [
+            root for root, result in self.installroots.items() if not result["success"]
+        ]
+
+    @property
+    def success(self) -> bool:
+        return bool(
+            self.host and self.host.success and self.installroots and not self.failed
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "version": self.version,
+            "success": self.success,
+            "duration": self.duration,
+            "host": self.host.to_dict() if self.host else None,
+            "installroots": self.installroots,
+        }
+
+
+def run_batch(
+    version: str,
+    installroots: list,
+    options: api.BootstrapOptions = None,
+    workers: int = DEFAULT_INSTALLROOT_WORKERS,
+    bootstrapper: api.Bootstrapper = None,
+) -> BatchResult:
+    """Bootstrap the installroots for an OpenStack version
+
+    Invalid installroots or options raise ValueError, errors of the runs
+    are reported in the result.
+    """
+    options = options or api.BootstrapOptions()
+    bootstrapper = bootstrapper or api.Bootstrapper()
+    roots = _unique_roots(installroots)
+    per_root = {
+        root: installroot_options(
+            options, root, options.shared_cache or INSTALLROOT_CACHE_DIR
+        )
+        for root in roots
+    }
+
+    result = BatchResult(version)
+    start = time.monotonic()
+    LOG.info("=== Preparing the host for %d installroots...", len(roots))
+    result.host = bootstrapper.run(version, host_options(options))
+    if not result.host.success:
+        result.duration = round(time.monotonic() - start, 3)
+        return result
+
+    workers = max(1, min(workers, len(roots)))
+    LOG.info("=== Bootstrapping installroots with %d workers...", workers)
+    # forked workers inherit the loaded distribution and the logging setup
+    with multiprocessing.get_context("fork").Pool(
+        workers, initializer=_init_worker, initargs=(bootstrapper.distro,)
+    ) as pool:
+        pending = {
+            root: pool.apply_async(_bootstrap_root, (version, per_root[root]))
+            for root in roots
+        }
+        for root, async_result in pending.items():
+            try:
+                root_result = async_result.get()
+            except Exception as e:  # pylint: disable=broad-except
+                root_result = {"version": version, "success": False, "error": str(e)}
+            if root_result["success"]:
+                LOG.info("%s bootstrapped", root)
+            else:
+                LOG.error("%s failed: %s", root, root_result["error"])
+            result.installroots[root] = root_result
+    result.duration = round(time.monotonic() - start, 3)
+    return result
@@ -0,0 +1,271 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sharded version catalog support
+
+A sharded catalog is a directory named after the distribution id (e.g.
+``rhel/``) living next to where ``<distro>.yaml`` would be. It contains
+one ``<version>.yaml`` file per OpenStack version holding the same data as
+``versions[<version>]`` in the single file layout, and an ``index.yaml``
+with the ``distros`` information plus an index of normalized distro id to
+the versions supporting it::
+
+    distros:
+      redhat:
+        versions:
+          - 8.4
+    index:
+      rhel8.4:
+        - "16.2"
+
+The index can be (re)generated with ``python -m rhos_bootstrap.catalog``.
+
+Version data can also be layered. Every ``<distro>.yaml`` found in the
+search paths and every ``<distro>.yaml``/``<distro>-*.yaml`` fragment in
+the overrides directory is deep merged, from the lowest precedence (the
+last search path) to the highest (the overrides, in file name order).
+Dictionaries are merged recursively, new list items are appended, other
+values are replaced and a ``null`` value removes the key. When a sharded
+catalog is available, the merged data is applied on top of it.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections.abc
+import json
+import logging
+import os
+import tempfile
+import yaml
+
+LOG = logging.getLogger(__name__)
+
+INDEX_FILE = "index.yaml"
+
+
+def _shard_path(catalog_dir: str, version: str) -> str:
+    return os.path.join(catalog_dir, f"{version}.yaml")
+
+
+def _load_yaml(path: str):
+    with open(path, "r", encoding="utf-8") as data:
+        return yaml.safe_load(data.read())
+
+
+def _write_yaml(path: str, data):
+    with open(path, "w", encoding="utf-8") as out:
+        yaml.safe_dump(data, out, default_flow_style=False)
+
+
+def deep_merge(base: dict, overlay: dict) -> dict:
+    """Merge overlay on top of base without modifying either"""
+    result = dict(base)
+    for key, value in overlay.items():
+        current = result.get(key)
+        if value is None:
+            result.pop(key, None)
+        elif isinstance(value, dict) and isinstance(current, dict):
+            result[key] = deep_merge(current, value)
+        elif isinstance(value, list) and isinstance(current, list):
+            result[key] = current + [i for i in value if i not in current]
+        else:
+            result[key] = value
+    return result
+
+
+def find_overrides(overrides_dir: str, distro_id: str) -> list:
+    try:
+        names = sorted(os.listdir(overrides_dir))
+    except OSError:
+        LOG.debug("%s does not exist", overrides_dir)
+        return []
+    return [
+        os.path.join(overrides_dir, name)
+        for name in names
+        if name == f"{distro_id}.yaml"
+        or (name.startswith(f"{distro_id}-") and name.endswith(".yaml"))
+    ]
+
+
+def _layers_key(paths: list) -> list:
+    key = []
+    for path in paths:
+        stat = os.stat(path)
+        key.append([path, stat.st_mtime_ns, stat.st_size])
+    return key
+
+
+def _write_cache(cache_file: str, key: list, data: dict):
+    # only cache data that survives a json round trip unchanged
+    if json.loads(json.dumps(data)) != data:
+        LOG.debug("Merged version data can not be cached as json")
+        return
+    cache_dir = os.path.dirname(cache_file)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=cache_dir, delete=False, encoding="utf-8"
+        ) as cache:
+            json.dump({"key": key, "data": data}, cache)
+        os.replace(cache.name, cache_file)
+    except OSError as e:
+        LOG.debug("Unable to write %s: %s", cache_file, e)
+
+
+def load_layers(paths: list, cache_file: str = None) -> dict:
+    """Deep merge the yaml files in paths, lowest precedence first
+
+    When cache_file is provided, the merged result is stored in it keyed by
+    the mtime and size of every layer and reused while they are unchanged.
+    """
+    key = None
+    if cache_file:
+        try:
+            key = _layers_key(paths)
+            with open(cache_file, "r", encoding="utf-8") as cache:
+                cached = json.load(cache)
+            if cached.get("key") == key:
+                LOG.debug("Using merged version data from %s", cache_file)
+                return cached["data"]
+        except (OSError, ValueError, AttributeError) as e:
+            LOG.debug("Merged version data cache not used: %s", e)
+    data = {}
+    for path in paths:
+        LOG.debug("Merging distro data from %s", path)
+        data = deep_merge(data, _load_yaml(path) or {})
+    if key is not None:
+        _write_cache(cache_file, key, data)
+    return data
+
+
+def is_sharded(catalog_dir: str) -> bool:
+    return os.path.isfile(os.path.join(catalog_dir, INDEX_FILE))
+
+
+def load_index(catalog_dir: str) -> dict:
+    return _load_yaml(os.path.join(catalog_dir, INDEX_FILE)) or {}
+
+
+def build_index(versions: dict, distros: dict = None) -> dict:
+    index = {}
+    for version, data in versions.items():
+        for dist in (data or {}).get("distros", []):
+            index.setdefault(dist, []).append(str(version))
+    return {"distros": distros or {}, "index": index}
+
+
+def write_catalog(distro_data: dict, catalog_dir: str):
+    """Split a single file catalog into a sharded catalog"""
+    os.makedirs(catalog_dir, exist_ok=True)
+    versions = distro_data.get("versions", {})
+    for version, data in versions.items():
+        _write_yaml(_shard_path(catalog_dir, version), data)
+    write_index(catalog_dir, distro_data.get("distros", {}))
+
+
+def write_index(catalog_dir: str, distros: dict = None):
+    """Regenerate index.yaml from the version shards in catalog_dir"""
+    if distros is None and is_sharded(catalog_dir):
+        distros = load_index(catalog_dir).get("distros", {})
+    versions = {}
+    for shard in sorted(os.listdir(catalog_dir)):
+        if not shard.endswith(".yaml") or shard == INDEX_FILE:
+            continue
+        versions[shard[: -len(".yaml")]] = _load_yaml(os.path.join(catalog_dir, shard))
+    _write_yaml(os.path.join(catalog_dir, INDEX_FILE), build_index(versions, distros))
+
+
+class ShardedVersions(collections.abc.Mapping):
+    """Lazily loaded versions of a sharded catalog
+
+    This behaves like the ``versions`` dictionary of a single file catalog
+    but a version's data is only read from disk the first time it is
+    accessed. Membership and distro support are answered from the index.
+    The overlay contains layered version data merged on top of the shards.
+    """
+
+    def __init__(self, catalog_dir: str, index: dict, overlay: dict = None):
+        self._catalog_dir = catalog_dir
+        self._overlay = {str(k): v for k, v in (overlay or {}).items()}
+        self._index = {d: list(v) for d, v in (index or {}).items()}
+        self._sharded = set()
+        for dist_versions in self._index.values():
+            self._sharded.update(dist_versions)
+        for dist, versions in build_index(self._overlay)["index"].items():
+            known = self._index.setdefault(dist, [])
+            known.extend(v for v in versions if v not in known)
+        self._versions = []
+        for dist_versions in self._index.values():
+            for version in dist_versions:
+                if version not in self._versions:
+                    self._versions.append(version)
+        for version in self._overlay:
+            if version not in self._versions:
+                self._versions.append(version)
+        self._loaded = {}
+
+    @property
+    def catalog_dir(self):
+        return self._catalog_dir
+
+    def __getitem__(self, version):
+        if version not in self._versions:
+            raise KeyError(version)
+        if version not in self._loaded:
+            data = {}
+            if version in self._sharded:
+                path = _shard_path(self._catalog_dir, version)
+                LOG.debug("Loading version data from %s", path)
+                data = _load_yaml(path) or {}
+            self._loaded[version] = deep_merge(data, self._overlay.get(version) or {})
+        return self._loaded[version]
+
+    def __contains__(self, version):
+        return version in self._versions
+
+    def __iter__(self):
+        return iter(self._versions)
+
+    def __len__(self):
+        return len(self._versions)
+
+    def distros(self, version) -> list:
+        return [d for d, versions in self._index.items() if version in versions]
+
+    def supported_versions(self, distro: str) -> list:
+        return list(self._index.get(distro, []))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Create or re-index a sharded version catalog"
+    )
+    parser.add_argument(
+        "catalog_dir", help="Sharded catalog directory, e.g. /usr/share/.../rhel"
+    )
+    parser.add_argument(
+        "--from-file",
+        help="Single file catalog (e.g. rhel.yaml) to split into catalog_dir",
+    )
+    args = parser.parse_args()
+    if args.from_file:
+        write_catalog(_load_yaml(args.from_file), args.catalog_dir)
+    else:
+        write_index(args.catalog_dir)
+    print(os.path.join(args.catalog_dir, INDEX_FILE))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,15 +14,30 @@
 
 from __future__ import print_function
 import argparse
+import json
 import logging
 import logging.config
 import os
 import sys
 
+from . import api
+from . import batch
+from . import daemon
 from . import distribution
-from .exceptions import DistroNotSupported
-from .utils.dnf import DnfManager
-from .utils.rhsm import SubscriptionManager
+from . import history
+from . import state
+from .constants import DAEMON_SOCKET
+from .constants import DEFAULT_GOVERNOR_NICE
+from .constants import DEFAULT_GOVERNOR_WEIGHT
+from .constants import DEFAULT_INSTALLROOT_WORKERS
+from .constants import DEFAULT_PREFETCH_WORKERS
+from .constants import DEFAULT_SHARED_CACHE_MAX_MB
+from .constants import DELOREAN_PINS_FILE
+from .constants import HISTORY_DB
+from .exceptions import InstallrootsFailed
+from .utils import profiling
+from .utils.governor import GOVERNORS
+from .utils.rhsm import BACKENDS as RHSM_BACKENDS
 
 LOG = logging.getLogger(__name__)
 LOG_FORMAT = "[%(asctime)s] [%(levelname)s]: %(message)s"
@@ -47,7 +62,8 @@ class BootstrapCli:
     def parser(self):
         return self._parser
 
-    def parse_args(self):
+    def parse_args(self, argv: list = None):
+        self.parser.epilog = "additional commands: " + ", ".join(sorted(COMMANDS))
         self.parser.add_argument(
             "version",
             help=(
@@ -86,12 +102,284 @@ class BootstrapCli:
                 "repositories and modules configuration."
             ),
         )
+        self.parser.add_argument(
+            "--update-memory-budget",
+            dest="update_memory_budget_mb",
+            type=int,
+            default=None,
+            metavar="MB",
+            help=(
+                "Perform the --update-packages update in batches of packages "
+                "from the same repository, each committed in turn. Batches "
+                "are made smaller when one peaks over MB of memory."
+            ),
+        )
         self.parser.add_argument(
             "--skip-client-install",
             action="store_true",
             default=False,
             help="Skip tripleoclient installation",
         )
+        self.parser.add_argument(
+            "--from-version",
+            default=None,
+            help=(
+                "The OpenStack version this system is currently configured "
+                "for. Only the repositories and modules that differ from it "
+                "are changed and --update-packages is limited to the packages "
+                "updated by the new repositories when no module changes."
+            ),
+        )
+        self.parser.add_argument(
+            "--packages-file",
+            default=None,
+            help=(
+                "YAML file listing packages to install, upgrade or remove "
+                "(install:, upgrade: and remove: lists). These are processed "
+                "together with the version's packages and tripleoclient in "
+                "a single transaction."
+            ),
+        )
+        staging = self.parser.add_mutually_exclusive_group()
+        staging.add_argument(
+            "--download-only",
+            action="store_true",
+            default=False,
+            help=(
+                "Configure the repositories and modules, then resolve, "
+                "download and verify the packages of the update and "
+                "tripleoclient installation without installing them."
+            ),
+        )
+        staging.add_argument(
+            "--apply-staged",
+            action="store_true",
+            default=False,
+            help=(
+                "Install the packages staged by a previous --download-only "
+                "run using only the dnf cache. Fails if the transaction no "
+                "longer resolves to the staged packages."
+            ),
+        )
+        self.parser.add_argument(
+            "--export-transaction",
+            default=None,
+            metavar="FILE",
+            help=(
+                "Write the resolved update and package transaction to FILE "
+                "so identical systems can replay it with "
+                "--replay-transaction."
+            ),
+        )
+        self.parser.add_argument(
+            "--replay-transaction",
+            default=None,
+            metavar="FILE",
+            help=(
+                "Install the exact packages of a transaction exported with "
+                "--export-transaction when the installed packages, "
+                "repositories and module streams match. Falls back to a "
+                "normal resolve otherwise."
+            ),
+        )
+        self.parser.add_argument(
+            "--shared-cache",
+            default=None,
+            metavar="DIR",
+            help=(
+                "Use DIR, e.g. an NFS mount shared by the systems of a rack, "
+                "as the dnf cache for metadata and packages."
+            ),
+        )
+        self.parser.add_argument(
+            "--shared-cache-max-mb",
+            type=int,
+            default=DEFAULT_SHARED_CACHE_MAX_MB,
+            help=(
+                "Size limit of the shared cache. The least recently used "
+                "packages are evicted when it is exceeded."
+            ),
+        )
+        self.parser.add_argument(
+            "--scoped-sack",
+            action="store_true",
+            default=False,
+            help=(
+                "Only load the repositories used by the version, and the "
+                "installed packages, in the dnf sack."
+            ),
+        )
+        self.parser.add_argument(
+            "--skip-filelists",
+            action="store_true",
+            default=False,
+            help=(
+                "Do not load the filelists metadata unless a requested "
+                "package is a file path."
+            ),
+        )
+        self.parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            default=False,
+            help=(
+                "Predict the run without changing the system. The "
+                "repositories are rendered in a temporary directory and "
+                "the modules and packages resolved without committing. "
+                "Prints the predicted transaction and the problems found "
+                "and exits with 1 when there are any."
+            ),
+        )
+        self.parser.add_argument(
+            "--installroot",
+            dest="installroots",
+            action="append",
+            default=None,
+            metavar="DIR",
+            help=(
+                "Bootstrap the installroot DIR, e.g. an image build chroot, "
+                "instead of the host. Can be given multiple times, the "
+                "installroots share the metadata and the packages."
+            ),
+        )
+        self.parser.add_argument(
+            "--installroot-workers",
+            type=int,
+            default=DEFAULT_INSTALLROOT_WORKERS,
+            metavar="N",
+            help="Number of installroots bootstrapped concurrently.",
+        )
+        self.parser.add_argument(
+            "--pin-delorean",
+            dest="delorean_pins",
+            nargs="?",
+            const=DELOREAN_PINS_FILE,
+            default=None,
+            metavar="FILE",
+            help=(
+                "Pin symlinked delorean repos, e.g. current-tripleo, to the "
+                "hash they point to. New pins are recorded in FILE "
+                f"(default: {DELOREAN_PINS_FILE}) and the pins it already "
+                "has are used as is."
+            ),
+        )
+        self.parser.add_argument(
+            "--plugin-allow",
+            action="append",
+            default=None,
+            metavar="[PHASE:]GLOB",
+            help=(
+                "Only run the dnf plugins matching GLOB, in PHASE (e.g. "
+                "update) or in every phase. Can be given multiple times."
+            ),
+        )
+        self.parser.add_argument(
+            "--plugin-deny",
+            action="append",
+            default=None,
+            metavar="[PHASE:]GLOB",
+            help=(
+                "Do not run the dnf plugins matching GLOB, in PHASE (e.g. "
+                "dnf_setup:product-id) or in every phase. Can be given "
+                "multiple times."
+            ),
+        )
+        self.parser.add_argument(
+            "--resume",
+            action="store_true",
+            default=False,
+            help=(
+                "Continue a failed run with the same arguments, skipping "
+                "the steps it completed that still check out."
+            ),
+        )
+        self.parser.add_argument(
+            "--events-fd",
+            type=int,
+            default=None,
+            metavar="N",
+            help=(
+                "Write progress events as json lines to the already open "
+                "file descriptor N."
+            ),
+        )
+        self.parser.add_argument(
+            "--events-file",
+            default=None,
+            metavar="PATH",
+            help="Append progress events as json lines to PATH.",
+        )
+        self.parser.add_argument(
+            "--governor",
+            choices=GOVERNORS,
+            default=None,
+            help=(
+                "Lower the priority of the package downloads and "
+                "transactions, e.g. on running controllers. priority uses "
+                "nice and ionice, scope moves the process to a transient "
+                "systemd scope with lower CPU and IO weights."
+            ),
+        )
+        self.parser.add_argument(
+            "--governor-nice",
+            type=int,
+            default=DEFAULT_GOVERNOR_NICE,
+            metavar="N",
+            help="Nice level of the package phases with --governor priority.",
+        )
+        self.parser.add_argument(
+            "--governor-weight",
+            type=int,
+            default=DEFAULT_GOVERNOR_WEIGHT,
+            metavar="W",
+            help=(
+                "CPU and IO weight of the package phases with --governor "
+                "scope, the default weight of the other units is 100."
+            ),
+        )
+        self.parser.add_argument(
+            "--throttle-bandwidth",
+            default=None,
+            metavar="RATE",
+            help="Cap the package downloads to RATE per second, e.g. 10M.",
+        )
+        self.parser.add_argument(
+            "--profile-dir",
+            default=None,
+            metavar="DIR",
+            help=(
+                "Write a cProfile and a tracemalloc profile of every phase "
+                "to DIR. Use 'rhos-bootstrap profile-summary DIR' to show "
+                "the hotspots."
+            ),
+        )
+        self.parser.add_argument(
+            "--rhsm-backend",
+            choices=RHSM_BACKENDS,
+            default="auto",
+            help=(
+                "How to talk to subscription-manager. dbus reads the "
+                "subscription status from the rhsm D-Bus API, cli runs the "
+                "subscription-manager command and auto uses the D-Bus API "
+                "when it is available."
+            ),
+        )
+        self.parser.add_argument(
+            "--skip-history",
+            action="store_true",
+            default=False,
+            help=f"Do not record the run in {HISTORY_DB}",
+        )
+        self.parser.add_argument(
+            "--prefetch-workers",
+            type=int,
+            default=DEFAULT_PREFETCH_WORKERS,
+            help=(
+                "Number of repositories to download metadata for "
+                "concurrently while the system is being configured. "
+                "Set to 0 to disable metadata prefetching."
+            ),
+        )
         self.parser.add_argument(
             "--debug", action="store_true", default=False, help="Enable debug logging"
         )
@@ -102,7 +390,7 @@ class BootstrapCli:
             help=f"Disable logging to {LOG_FILE}",
         )
 
-        args = self.parser.parse_args()
+        args = self.parser.parse_args(argv)
         return args
 
     def configure_logger(self, log_file=True, debug=False):
@@ -142,74 +430,218 @@ class BootstrapCli:
         logging.config.dictConfig(conf)
 
 
-def main():  # pylint: disable=too-many-branches,too-many-statements
-    cli = BootstrapCli()
-    args = cli.parse_args()
-    cli.configure_logger(log_file=args.skip_log_file, debug=args.debug)
+def list_versions(argv: list):
+    parser = argparse.ArgumentParser(
+        prog="rhos-bootstrap list-versions",
+        description="List the OpenStack versions supported on this system's "
+        "distribution. This only reads the version index and does not "
+        "require root.",
+    )
+    parser.parse_args(argv)
+    distro = distribution.DistributionInfo()
+    for version in distro.list_versions():
+        print(version)
+
+
+def check_status(argv: list):
+    parser = argparse.ArgumentParser(
+        prog="rhos-bootstrap status",
+        description="Check whether this system is still bootstrapped for a "
+        "version. This compares the repository files, module streams and "
+        "installed packages with what the last successful run recorded, "
+        "without loading dnf or using the network, and does not require "
+        "root. Exits with 1 when anything drifted.",
+    )
+    parser.add_argument("version", help="The expected OpenStack version")
+    args = parser.parse_args(argv)
+    report = state.status(args.version)
+    print(json.dumps(report, indent=2))
+    if not report["ok"]:
+        sys.exit(1)
+
+
+def show_history(argv: list):
+    parser = argparse.ArgumentParser(
+        prog="rhos-bootstrap history",
+        description="Show the recent runs and the trend of their phases. The "
+        "phases of the last run are compared with the median of the "
+        "previous successful runs. Exits with 1 when any regressed.",
+    )
+    parser.add_argument(
+        "--version", default=None, help="Only show the runs of this version"
+    )
+    parser.add_argument("--limit", type=int, default=20, help="Number of runs to show")
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=history.DEFAULT_WINDOW,
+        help="Number of previous successful runs the baseline is taken from",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=history.DEFAULT_THRESHOLD,
+        help="A phase regressed when it took this many times its baseline",
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=history.DEFAULT_MIN_DELTA,
+        help="Minimum increase in seconds for a phase to regress",
+    )
+    parser.add_argument(
+        "--textfile",
+        default=None,
+        metavar="PATH",
+        help="Also write the report to PATH in the node_exporter textfile "
+        "format, e.g. in the textfile collector directory.",
+    )
+    parser.add_argument("--db", default=HISTORY_DB, help="Path of the history")
+    args = parser.parse_args(argv)
+    report = history.RunHistory(args.db).report(
+        args.version,
+        limit=args.limit,
+        window=args.window,
+        threshold=args.threshold,
+        min_delta=args.min_delta,
+    )
+    if args.textfile:
+        history.write_textfile(args.textfile, report)
+    print(json.dumps(report, indent=2))
+    if report["regressions"]:
+        sys.exit(1)
+
 
+def profile_summary(argv: list):
+    parser = argparse.ArgumentParser(
+        prog="rhos-bootstrap profile-summary",
+        description="Show the functions with the most own time and the "
+        "largest allocations of every phase profiled by a run with "
+        "--profile-dir.",
+    )
+    parser.add_argument("directory", help="The --profile-dir of the run")
+    parser.add_argument(
+        "--top", type=int, default=10, help="Number of hotspots per phase"
+    )
+    args = parser.parse_args(argv)
+    phases = profiling.summarize(args.directory, args.top)
+    if not phases:
+        print(f"No profiles found in {args.directory}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(phases, indent=2))
+
+
+def _require_root(parser):
     if os.getuid() != 0:
         LOG.error("You must be root to run this command")
-        cli.parser.print_help()
+        parser.print_help()
         sys.exit(2)
 
-    LOG.info("=" * 40)
-    LOG.info("=== OpenStack Version: %s", args.version)
-    distro = distribution.DistributionInfo()
-    LOG.info("=== Distribution: %s", distro.distro_normalized_id)
-    LOG.info("=" * 40)
-    if not args.skip_validation:
-        LOG.info("=== Validating version for distro...")
-        if not distro.validate_distro(args.version):
-            raise DistroNotSupported(distro.distro_normalized_id)
-        LOG.info("OK! %s on %s", args.version, distro.distro_normalized_id)
-    else:
-        LOG.info("=== Skipping validation of version for distro...")
-
-    if not args.skip_repos:
-        repos = distro.get_repos(args.version, enable_ceph=not args.skip_ceph_install)
-        LOG.info("=== Configuring repositories...")
-
-        if "rhel" in distro.distro_id:
-            LOG.info("Disabling all existing configured repositories...")
-            rhsm = SubscriptionManager.instance()
-            rhsm.repos(disable=["*"])
-
-        for repo in repos:
-            LOG.info("Configuring %s", repo.name)
-            repo.save()
-    else:
-        LOG.info("=== Skipping repository configuration...")
-
-    if not (
-        args.skip_modules and not args.update_packages and args.skip_client_install
-    ):
-        LOG.info("=== Configuring dnf...")
-        # we don't need a manager if we're not calling it
-        manager = DnfManager.instance()
-    else:
-        LOG.info("=== Skipping dnf configuration...")
-
-    # modules are only an 8 thing
-    if not args.skip_modules and int(distro.distro_major_version_id) < 9:
-        modules = distro.get_modules(args.version)
-        LOG.info("=== Configuring modules...")
-        for mod in modules:
-            LOG.info("Enabling %s:%s", mod.name, mod.stream)
-            manager.enable_module(mod.name, mod.stream, mod.profile)
-    else:
-        LOG.info("=== Skipping module configuration...")
-
-    if args.update_packages:
-        LOG.info("=== Performing update...")
-        manager.update_package("*")
-        LOG.info("NOTE: A manual reboot may be required")
-
-    if not args.skip_client_install:
-        LOG.info("=== Installing tripleoclient...")
-        manager.install_update_package("python3-tripleoclient")
-    else:
-        LOG.info("=== Skipping tripleoclient installation...")
-    LOG.info("=== Done!")
+
+def run_daemon(argv: list):
+    parser = argparse.ArgumentParser(
+        prog="rhos-bootstrap daemon",
+        description="Run a long running bootstrap service which keeps dnf "
+        "loaded between requests. Use 'rhos-bootstrap client' to talk to it.",
+    )
+    parser.add_argument(
+        "--socket", default=DAEMON_SOCKET, help="Path of the unix socket to create"
+    )
+    parser.add_argument(
+        "--debug", action="store_true", default=False, help="Enable debug logging"
+    )
+    parser.add_argument(
+        "--skip-log-file",
+        action="store_false",
+        default=True,
+        help=f"Disable logging to {LOG_FILE}",
+    )
+    args = parser.parse_args(argv)
+    BootstrapCli().configure_logger(log_file=args.skip_log_file, debug=args.debug)
+    _require_root(parser)
+    daemon.BootstrapDaemon(args.socket).serve_forever()
+
+
+def run_client(argv: list):
+    parser = argparse.ArgumentParser(
+        prog="rhos-bootstrap client",
+        description="Send a request to a running 'rhos-bootstrap daemon'. "
+        "The arguments after the action are the regular rhos-bootstrap "
+        "arguments.",
+    )
+    parser.add_argument("action", choices=daemon.ACTIONS, help="Request to send")
+    parser.add_argument(
+        "--socket", default=DAEMON_SOCKET, help="Path of the daemon unix socket"
+    )
+    args, remaining = parser.parse_known_args(argv)
+    options = {}
+    if args.action != "status":
+        options = daemon.client_options(vars(BootstrapCli().parse_args(remaining)))
+        try:
+            daemon.check_options(options)
+        except ValueError as e:
+            parser.error(str(e))
+    response = daemon.send_request(args.action, options, args.socket)
+    for message in response.get("log", []):
+        print(message)
+    if not response["ok"]:
+        print(response["error"], file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(response["result"], indent=2))
+    if not response["result"].get("success", True):
+        sys.exit(1)
+
+
+COMMANDS = {
+    "client": run_client,
+    "daemon": run_daemon,
+    "history": show_history,
+    "list-versions": list_versions,
+    "profile-summary": profile_summary,
+    "status": check_status,
+}
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+
+    cli = BootstrapCli()
+    args = cli.parse_args()
+    cli.configure_logger(log_file=args.skip_log_file, debug=args.debug)
+    try:
+        options = api.BootstrapOptions.from_args(args)
+    except ValueError as e:
+        cli.parser.error(str(e))
+    _require_root(cli.parser)
+
+    if args.dry_run:
+        if args.installroots:
+            cli.parser.error("--dry-run can not be combined with --installroot")
+        report = api.Bootstrapper().dry_run(args.version, options)
+        print(json.dumps(report, indent=2))
+        if not report["success"]:
+            sys.exit(1)
+        return
+
+    if args.installroots:
+        try:
+            result = batch.run_batch(
+                args.version, args.installroots, options, args.installroot_workers
+            )
+        except ValueError as e:
+            # invalid installroots or installroot options, nothing ran
+            cli.parser.error(str(e))
+        if not result.host.success:
+            raise result.host.exception
+        if not result.success:
+            raise InstallrootsFailed(result.failed)
+        return
+
+    result = api.Bootstrapper().run(args.version, options)
+    if not result.success:
+        raise result.exception
 
 
 if __name__ == "__main__":
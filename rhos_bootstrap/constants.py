@@ -26,8 +26,75 @@ RHOS_VERSIONS_SEARCH_PATHS = [
     os.path.join(sys.prefix, "share", "rhos_bootstrap"),
 ]
 
+# version data fragments layered on top of the search paths
+RHOS_VERSIONS_OVERRIDES_DIR = os.path.join("/etc", "rhos-bootstrap", "overrides.d")
+
+# local mirrors for the generated and fetched repositories
+RHOS_MIRRORS_FILE = os.path.join("/etc", "rhos-bootstrap", "mirrors.yaml")
+
+RHOS_CACHE_DIR = os.path.join("/var", "cache", "rhos-bootstrap")
+
+RHOS_STATE_DIR = os.path.join("/var", "lib", "rhos-bootstrap")
+
+# dnf cache shared by the installroots of a batch without --shared-cache
+INSTALLROOT_CACHE_DIR = os.path.join(RHOS_CACHE_DIR, "installroots")
+
+# transaction resolved and downloaded by a --download-only run
+STAGED_TRANSACTION_FILE = os.path.join(RHOS_STATE_DIR, "staged-transaction.json")
+
+# packages whose signature was verified, skipped while they are unchanged
+VERIFIED_PACKAGES_FILE = os.path.join(RHOS_STATE_DIR, "verified-packages.json")
+
+# immutable hashes the symlinked delorean repos were pinned to
+DELOREAN_PINS_FILE = os.path.join(RHOS_STATE_DIR, "delorean-pins.json")
+
+# what the last successful run configured, used by the status command
+STATE_FILE = os.path.join(RHOS_STATE_DIR, "state.json")
+
+# outcome and timings of the previous runs, used by the history command
+HISTORY_DB = os.path.join(RHOS_STATE_DIR, "history.sqlite")
+
+# completed steps of the last run, used by --resume
+JOURNAL_FILE = os.path.join(RHOS_STATE_DIR, "journal.json")
+
 YUM_REPO_BASE_DIR = "/etc/yum.repos.d"
 
+# repositories managed by subscription-manager
+RHSM_REPO_FILE = os.path.join(YUM_REPO_BASE_DIR, "redhat.repo")
+
+DNF_MODULES_DIR = "/etc/dnf/modules.d"
+
+RPMDB_DIR = "/var/lib/rpm"
+
+DAEMON_SOCKET = os.path.join("/run", "rhos-bootstrap", "daemon.sock")
+
+# seconds to wait for a repository server to connect or send data
+HTTP_TIMEOUT = 30
+
+# number of repositories to fetch metadata for concurrently
+DEFAULT_PREFETCH_WORKERS = 4
+
+# size limit of a shared dnf cache
+DEFAULT_SHARED_CACHE_MAX_MB = 20480
+
+# initial number of packages per batch of a memory bounded update
+DEFAULT_UPDATE_BATCH_SIZE = 200
+
+# number of runs kept in the history
+DEFAULT_HISTORY_MAX_RUNS = 1000
+
+# nice level of the package phases with the priority governor
+DEFAULT_GOVERNOR_NICE = 10
+
+# CPU and IO weight of the package phases with the scope governor
+DEFAULT_GOVERNOR_WEIGHT = 20
+
+# number of installroots bootstrapped concurrently
+DEFAULT_INSTALLROOT_WORKERS = os.cpu_count() or 1
+
+# number of processes verifying package signatures
+DEFAULT_VERIFY_WORKERS = os.cpu_count() or 1
+
 DEFAULT_MIRROR_MAP = {
     "fedora": "https://mirrors.fedoraproject.org",
     "centos": "http://mirror.centos.org",
@@ -0,0 +1,323 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Warm bootstrap daemon
+
+The daemon keeps a loaded DistributionInfo and DnfManager so repeated
+plan and apply requests do not pay for the dnf setup every time. Requests
+and responses are single json lines over a unix socket that only root can
+use. Transactions are serialized and the dnf sack is only reloaded when the
+repository files, the module state or the rpmdb changed.
+"""
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from rhos_bootstrap import api
+from rhos_bootstrap import batch
+from rhos_bootstrap import constants
+from rhos_bootstrap.exceptions import DaemonAlreadyRunning
+from rhos_bootstrap.utils.dnf import DnfManager
+
+LOG = logging.getLogger(__name__)
+
+ACTIONS = ["plan", "apply", "status"]
+
+# request options naming files or directories, the daemon does not share
+# the working directory of its clients
+PATH_OPTIONS = (
+    "packages_file",
+    "export_transaction",
+    "replay_transaction",
+    "shared_cache",
+    "delorean_pins",
+    "events_file",
+    "profile_dir",
+    "installroot",
+    "installroots",
+)
+
+
+def _paths(value) -> list:
+    if not value:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def client_options(options: dict) -> dict:
+    """Request options of the rhos-bootstrap arguments, with absolute paths"""
+    options = dict(options)
+    for name in PATH_OPTIONS:
+        if isinstance(options.get(name), list):
+            options[name] = [os.path.abspath(p) for p in options[name]]
+        elif options.get(name):
+            options[name] = os.path.abspath(options[name])
+    return options
+
+
+def check_options(options: dict):
+    """Reject the request options the daemon can not honour"""
+    # the descriptor is only open in the client
+    if options.get("events_fd") is not None:
+        raise ValueError("--events-fd can not be used through the daemon")
+    for name in PATH_OPTIONS:
+        for path in _paths(options.get(name)):
+            if not os.path.isabs(path):
+                raise ValueError(f"{path} must be an absolute path")
+
+
+def system_fingerprint() -> list:
+    """The mtime and size of the repository, module and rpmdb files"""
+    fingerprint = []
+    for base_dir in (
+        constants.YUM_REPO_BASE_DIR,
+        constants.DNF_MODULES_DIR,
+        constants.RPMDB_DIR,
+    ):
+        try:
+            names = sorted(os.listdir(base_dir))
+        except OSError:
+            continue
+        for name in names:
+            path = os.path.join(base_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            fingerprint.append([path, stat.st_mtime_ns, stat.st_size])
+    return fingerprint
+
+
+class _RequestLogHandler(logging.Handler):
+    """Collect the log messages emitted while handling a request
+
+    Requests are handled in their own thread, only the records of the
+    thread that created the handler are collected.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(logging.Formatter("[%(levelname)s]: %(message)s"))
+        self.messages = []
+        self._thread = threading.get_ident()
+
+    def filter(self, record):
+        return record.thread == self._thread and super().filter(record)
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def _peer_uid(self) -> int:
+        creds = self.request.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+        )
+        _, uid, _ = struct.unpack("3i", creds)
+        return uid
+
+    def handle(self):
+        if self._peer_uid() != 0:
+            response = {"ok": False, "error": "Only root may use the daemon"}
+        else:
+            try:
+                request = json.loads(self.rfile.readline().decode("utf-8"))
+            except ValueError:
+                response = {"ok": False, "error": "Invalid request"}
+            else:
+                response = self.server.bootstrap_daemon.handle(request)
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, bootstrap_daemon):
+        self.bootstrap_daemon = bootstrap_daemon
+        super().__init__(socket_path, _RequestHandler)
+
+
+class BootstrapDaemon:
+    """Long running bootstrap service"""
+
+    def __init__(self, socket_path: str = constants.DAEMON_SOCKET):
+        self._socket_path = socket_path
+        self._lock = threading.Lock()
+        self._bootstrapper = api.Bootstrapper()
+        self._fingerprint = None
+        self._started = time.time()
+        self._requests = 0
+        # handle() runs in a thread per connection
+        self._requests_lock = threading.Lock()
+
+    @property
+    def socket_path(self):
+        return self._socket_path
+
+    @property
+    def distro(self):
+        return self._bootstrapper.distro
+
+    def warm(self):
+        LOG.info("Loading distribution information and dnf...")
+        LOG.info("Distribution: %s", self.distro.distro_normalized_id)
+        DnfManager.instance()
+        self._fingerprint = system_fingerprint()
+
+    def _refresh_if_changed(self):
+        fingerprint = system_fingerprint()
+        if fingerprint != self._fingerprint and DnfManager.loaded():
+            LOG.info("Repositories or rpmdb changed, reloading dnf")
+            DnfManager.instance().refresh()
+        self._fingerprint = fingerprint
+
+    def plan(self, version: str, options: api.BootstrapOptions) -> dict:
+        with self._lock:
+            self._refresh_if_changed()
+            return self._bootstrapper.plan(version, options)
+
+    def apply(self, version: str, options: api.BootstrapOptions) -> dict:
+        with self._lock:
+            self._refresh_if_changed()
+            result = self._bootstrapper.run(version, options)
+            # our own changes were already loaded by the manager
+            self._fingerprint = system_fingerprint()
+            return result.to_dict()
+
+    def dry_run(self, version: str, options: api.BootstrapOptions) -> dict:
+        with self._lock:
+            self._refresh_if_changed()
+            return self._bootstrapper.dry_run(version, options)
+
+    def apply_batch(
+        self,
+        version: str,
+        installroots: list,
+        options: api.BootstrapOptions,
+        workers: int = constants.DEFAULT_INSTALLROOT_WORKERS,
+    ) -> dict:
+        with self._lock:
+            self._refresh_if_changed()
+            result = batch.run_batch(
+                version, installroots, options, workers, self._bootstrapper
+            )
+            self._fingerprint = system_fingerprint()
+            return result.to_dict()
+
+    def _dispatch(self, action: str, request_options: dict) -> dict:
+        """Run a plan or apply request with the rhos-bootstrap arguments"""
+        version = request_options["version"]
+        check_options(request_options)
+        options = api.BootstrapOptions.from_dict(request_options)
+        dry_run = request_options.get("dry_run")
+        installroots = request_options.get("installroots")
+        if action == "plan":
+            if dry_run or installroots:
+                raise ValueError("--dry-run and --installroot need the apply action")
+            return self.plan(version, options)
+        if dry_run:
+            if installroots:
+                raise ValueError("--dry-run can not be combined with --installroot")
+            return self.dry_run(version, options)
+        if installroots:
+            return self.apply_batch(
+                version,
+                installroots,
+                options,
+                request_options.get("installroot_workers")
+                or constants.DEFAULT_INSTALLROOT_WORKERS,
+            )
+        return self.apply(version, options)
+
+    def status(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self._started, 3),
+            "requests": self._requests,
+            "distro": self.distro.distro_normalized_id,
+            "dnf_loaded": DnfManager.loaded(),
+            "busy": self._lock.locked(),
+            "stale": system_fingerprint() != self._fingerprint,
+        }
+
+    def handle(self, request: dict) -> dict:
+        with self._requests_lock:
+            self._requests += 1
+        action = request.get("action")
+        if action not in ACTIONS:
+            return {"ok": False, "error": f"Unknown action {action}", "log": []}
+        handler = _RequestLogHandler()
+        root_logger = logging.getLogger()
+        root_logger.addHandler(handler)
+        try:
+            if action == "status":
+                result = self.status()
+            else:
+                result = self._dispatch(action, request.get("options", {}))
+            response = {"ok": True, "result": result}
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.exception("Request %s failed", action)
+            response = {"ok": False, "error": str(e)}
+        finally:
+            root_logger.removeHandler(handler)
+        response["log"] = handler.messages
+        return response
+
+    def _socket_alive(self) -> bool:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(self._socket_path)
+            except OSError:
+                # refused, nothing listens on it anymore
+                return False
+        return True
+
+    def serve_forever(self):
+        socket_dir = os.path.dirname(self._socket_path)
+        os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+        if os.path.exists(self._socket_path):
+            if self._socket_alive():
+                raise DaemonAlreadyRunning(self._socket_path)
+            LOG.debug("Removing stale socket %s", self._socket_path)
+            os.unlink(self._socket_path)
+        old_umask = os.umask(0o077)
+        try:
+            server = _UnixServer(self._socket_path, self)
+        finally:
+            os.umask(old_umask)
+        os.chmod(self._socket_path, 0o600)
+        try:
+            self.warm()
+            LOG.info("Listening on %s", self._socket_path)
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.unlink(self._socket_path)
+
+
+def send_request(
+    action: str, options: dict = None, socket_path: str = constants.DAEMON_SOCKET
+) -> dict:
+    request = {"action": action, "options": options or {}}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as response:
+            return json.loads(response.readline().decode("utf-8"))
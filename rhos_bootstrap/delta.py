@@ -0,0 +1,147 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Version to version delta
+
+When a system already configured for an OpenStack version is upgraded to
+another one, only the repositories and module streams that differ between
+the two versions need to be touched. Delorean repositories are built from
+the version so they always change between versions.
+"""
+
+import logging
+
+LOG = logging.getLogger(__name__)
+
+
+def _repo_key(repo_type: str, name: str, version: str) -> tuple:
+    if "delorean" in repo_type:
+        return (repo_type, name, version)
+    return (repo_type, name)
+
+
+class VersionDelta:  # pylint: disable=too-many-instance-attributes
+    """Repository and module differences between two versions"""
+
+    def __init__(
+        self,
+        distro,
+        from_version: str,
+        to_version: str,
+        enable_ceph: bool = False,
+        use_modules: bool = True,
+    ):
+        self._from_version = from_version
+        self._to_version = to_version
+        old_repos = distro.get_repo_specs(from_version, enable_ceph)
+        new_repos = distro.get_repo_specs(to_version, enable_ceph)
+        old_keys = {_repo_key(t, n, from_version) for t, n in old_repos}
+        new_keys = {_repo_key(t, n, to_version) for t, n in new_repos}
+        self._repos_added = [
+            (t, n) for t, n in new_repos if _repo_key(t, n, to_version) not in old_keys
+        ]
+        self._repos_removed = [
+            (t, n)
+            for t, n in old_repos
+            if _repo_key(t, n, from_version) not in new_keys
+        ]
+        self._repos_kept = [
+            (t, n) for t, n in new_repos if _repo_key(t, n, to_version) in old_keys
+        ]
+
+        self._modules_added = []
+        self._modules_switched = []
+        self._modules_removed = []
+        if use_modules:
+            old_modules = {m.name: m for m in distro.get_modules(from_version)}
+            new_modules = {m.name: m for m in distro.get_modules(to_version)}
+            for name, mod in new_modules.items():
+                if name not in old_modules:
+                    self._modules_added.append(mod)
+                elif mod.stream != old_modules[name].stream:
+                    self._modules_switched.append((old_modules[name], mod))
+            self._modules_removed = [
+                mod for name, mod in old_modules.items() if name not in new_modules
+            ]
+
+    @property
+    def from_version(self):
+        return self._from_version
+
+    @property
+    def to_version(self):
+        return self._to_version
+
+    @property
+    def repos_added(self) -> list:
+        return self._repos_added
+
+    @property
+    def repos_removed(self) -> list:
+        return self._repos_removed
+
+    @property
+    def repos_kept(self) -> list:
+        return self._repos_kept
+
+    @property
+    def modules_added(self) -> list:
+        return self._modules_added
+
+    @property
+    def modules_switched(self) -> list:
+        """List of (old, new) DnfModule"""
+        return self._modules_switched
+
+    @property
+    def modules_removed(self) -> list:
+        return self._modules_removed
+
+    @property
+    def modules_changed(self) -> bool:
+        return bool(
+            self._modules_added or self._modules_switched or self._modules_removed
+        )
+
+    @property
+    def scoped_update(self) -> bool:
+        """Whether the update can be limited to the packages of added repos
+
+        A module stream change can replace any package of the module, so
+        the whole system is updated in that case.
+        """
+        return not self.modules_changed
+
+    def to_dict(self) -> dict:
+        def _repos(specs):
+            return [{"type": t, "name": n} for t, n in specs]
+
+        return {
+            "from_version": self._from_version,
+            "to_version": self._to_version,
+            "repos": {
+                "add": _repos(self._repos_added),
+                "remove": _repos(self._repos_removed),
+                "keep": _repos(self._repos_kept),
+            },
+            "modules": {
+                "enable": [f"{m.name}:{m.stream}" for m in self._modules_added],
+                "switch": [
+                    f"{o.name}:{o.stream} -> {n.stream}"
+                    for o, n in self._modules_switched
+                ],
+                "disable": [f"{m.name}:{m.stream}" for m in self._modules_removed],
+            },
+            "scoped_update": self.scoped_update,
+        }
@@ -17,13 +17,14 @@ from __future__ import print_function
 import logging
 import os
 import subprocess
-import yaml
 
+from rhos_bootstrap import catalog
 from rhos_bootstrap import constants
 from rhos_bootstrap import exceptions
 from rhos_bootstrap.utils import repos
 from rhos_bootstrap.utils import dnf
 from rhos_bootstrap.utils import rhsm
+from rhos_bootstrap.utils.mirrors import MirrorConfig
 
 LOG = logging.getLogger(__name__)
 
@@ -56,25 +57,62 @@ class DistributionInfo:
         self._distro_version_id = distro_version_id or _version_id
         self._distro_name = distro_name or _name
         self._is_stream = "stream" in self._distro_name.lower()
+        self._mirrors = None
         self._load_data()
 
     def _load_data(self):
+        layers = []
+        catalog_dir = None
         for ver_path in constants.RHOS_VERSIONS_SEARCH_PATHS:
             data_path = os.path.join(ver_path, f"{self.distro_id}.yaml")
-            if not os.path.exists(data_path):
+            if os.path.exists(data_path):
+                LOG.debug("Found distro data in %s", data_path)
+                layers.append(data_path)
+            else:
                 LOG.debug("%s does not exist", data_path)
-                continue
-            LOG.debug("Found distro data in %s", data_path)
-            with open(data_path, "r", encoding="utf-8") as data:
-                self._distro_data = yaml.safe_load(data.read())
-                return
-        LOG.error("Unable to find a %s.yaml", self.distro_id)
-        raise exceptions.DistroNotSupported(self.distro_id)
+            shard_path = os.path.join(ver_path, self.distro_id)
+            if not catalog_dir and catalog.is_sharded(shard_path):
+                LOG.debug("Found sharded distro data in %s", shard_path)
+                catalog_dir = shard_path
+        # search paths are in order of precedence so merge the last one first
+        layers.reverse()
+        layers.extend(
+            catalog.find_overrides(
+                constants.RHOS_VERSIONS_OVERRIDES_DIR, self.distro_id
+            )
+        )
+        if not layers and not catalog_dir:
+            LOG.error("Unable to find a %s.yaml", self.distro_id)
+            raise exceptions.DistroNotSupported(self.distro_id)
+
+        data = {}
+        if layers:
+            cache_file = os.path.join(
+                constants.RHOS_CACHE_DIR, f"{self.distro_id}-versions.json"
+            )
+            data = catalog.load_layers(layers, cache_file)
+        if catalog_dir:
+            index = catalog.load_index(catalog_dir)
+            data = {
+                "distros": catalog.deep_merge(
+                    index.get("distros", {}), data.get("distros", {})
+                ),
+                "versions": catalog.ShardedVersions(
+                    catalog_dir, index.get("index", {}), data.get("versions", {})
+                ),
+            }
+        self._distro_data = data
 
     @property
     def distro_data(self):
         return self._distro_data
 
+    @property
+    def mirrors(self) -> MirrorConfig:
+        if self._mirrors is None:
+            self._mirrors = MirrorConfig.from_file(constants.RHOS_MIRRORS_FILE)
+        return self._mirrors
+
     @property
     def distro_id(self):
         return self._distro_id
@@ -134,7 +172,7 @@ class DistributionInfo:
             )
             return False
         # make sure distro is in the listed distributions
-        distros = self.versions[version].get("distros", [])
+        distros = self.get_version_distros(version)
         if self.distro_normalized_id not in distros:
             LOG.warning(
                 "%s not in %s",
@@ -158,6 +196,22 @@ class DistributionInfo:
                 raise exceptions.SubscriptionManagerConfigError()
         return True
 
+    def get_version_distros(self, version) -> list:
+        if isinstance(self.versions, catalog.ShardedVersions):
+            # answer from the index without loading the version data
+            return self.versions.distros(version)
+        return self.versions[version].get("distros", [])
+
+    def list_versions(self) -> list:
+        dist = self.distro_normalized_id
+        if isinstance(self.versions, catalog.ShardedVersions):
+            return self.versions.supported_versions(dist)
+        return [
+            version
+            for version, data in self.versions.items()
+            if dist in data.get("distros", [])
+        ]
+
     def get_version(self, version) -> dict:
         if version not in self.versions:
             LOG.error("%s is not available in version list", version)
@@ -169,15 +223,28 @@ class DistributionInfo:
         if "rhel" in self.distro_id:
             return repos.RhsmRepo(name)
         if "centos" in repo_type:
-            return repos.TripleoCentosRepo(repo_type, name)
+            return repos.TripleoCentosRepo(
+                repo_type, name, mirror=self.mirrors.mirror(repo_type)
+            )
         if "ceph" in repo_type:
-            return repos.TripleoCephRepo(self.distro_normalized_id, name)
+            return repos.TripleoCephRepo(
+                self.distro_normalized_id,
+                name,
+                mirror=self.mirrors.mirror(self.distro_normalized_id),
+            )
         if "delorean" in repo_type:
             dlrn_dist = f"{self.distro_id}{self.distro_major_version_id}"
-            return repos.TripleoDeloreanRepos(dlrn_dist, version, name)
+            return repos.TripleoDeloreanRepos(
+                dlrn_dist,
+                version,
+                name,
+                mirror=self.mirrors.mirror("rdo"),
+                mirrors=self.mirrors,
+            )
         raise exceptions.RepositoryNotSupported(repo_type)
 
-    def get_repos(self, version, enable_ceph: bool = False) -> list:
+    def get_repo_specs(self, version, enable_ceph: bool = False) -> list:
+        """List of (repo_type, name) for the repositories of a version"""
         r = []
         dist = self.distro_normalized_id
         version_data = self.get_version(version)
@@ -186,16 +253,27 @@ class DistributionInfo:
 
         # handle distro specific repos
         for name in version_data["repos"].get(dist, []):
-            r.append(self.construct_repo(dist, version, name))
+            r.append((dist, name))
 
         # handle other software related repos
         for repo in constants.SUPPORTED_REPOS:
             for name in version_data["repos"].get(repo, []):
                 if not enable_ceph and "ceph" in name:
                     continue
-                r.append(self.construct_repo(repo, version, name))
+                r.append((repo, name))
         return r
 
+    def get_repos(self, version, enable_ceph: bool = False) -> list:
+        return [
+            self.construct_repo(repo_type, version, name)
+            for repo_type, name in self.get_repo_specs(version, enable_ceph)
+        ]
+
+    def get_packages(self, version) -> dnf.PackageManifest:
+        return dnf.PackageManifest.from_dict(
+            self.get_version(version).get("packages", {})
+        )
+
     def get_modules(self, version) -> list:
         r = []
         module_data = self.get_version(version).get("modules", {})
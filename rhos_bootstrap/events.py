@@ -0,0 +1,164 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Machine readable progress events
+
+Events are written as json lines, e.g.::
+
+    {"event": "phase_start", "phase": "repos", "ts": 1600000000.0}
+
+by a background thread so a slow reader never blocks the bootstrap. Events
+are dropped, and counted, when the reader falls too far behind. Progress
+events are rate limited to one per interval, the final one is always
+written.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+# seconds between two progress events of the same kind
+DEFAULT_PROGRESS_INTERVAL = 0.5
+
+# events waiting to be written before new ones are dropped
+DEFAULT_QUEUE_SIZE = 1000
+
+# seconds close() waits for the pending events to be written
+CLOSE_TIMEOUT = 2
+
+_STOP = object()
+
+
+class EventStream:  # pylint: disable=too-many-instance-attributes
+    """Json lines event writer, a no-op without a file"""
+
+    def __init__(
+        self,
+        out=None,
+        progress_interval: float = DEFAULT_PROGRESS_INTERVAL,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        fields: dict = None,
+    ):
+        self._out = out
+        self._file = out
+        # added to every event, e.g. the installroot of a batch run
+        self._fields = dict(fields or {})
+        self._progress_interval = progress_interval
+        self._last_progress = {}
+        self._dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        # set when close() gives up on a stalled writer, the writer then
+        # closes the file once its write returns
+        self._lock = threading.Lock()
+        self._abandoned = False
+        self._stopped = False
+        if out is not None:
+            self._thread = threading.Thread(
+                target=self._writer, name="rhos-bootstrap-events", daemon=True
+            )
+            self._thread.start()
+
+    @classmethod
+    def open(cls, fd: int = None, path: str = None, **kwargs):
+        if fd is not None:
+            # the caller owns the descriptor
+            return cls(os.fdopen(fd, "w", encoding="utf-8", closefd=False), **kwargs)
+        if path:
+            # pylint: disable=consider-using-with
+            return cls(open(path, "a", encoding="utf-8"), **kwargs)
+        return cls(**kwargs)
+
+    def __bool__(self):
+        return self._out is not None
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped
+
+    def _writer(self):
+        out = self._file
+        while True:
+            event = self._queue.get()
+            if event is _STOP or self._abandoned:
+                break
+            try:
+                out.write(json.dumps(event, sort_keys=True, default=str) + "\n")
+                out.flush()
+            except (OSError, ValueError) as e:
+                LOG.debug("Unable to write events, stopping: %s", e)
+                self._out = None
+                break
+        with self._lock:
+            self._stopped = True
+            abandoned = self._abandoned
+        if abandoned:
+            self._close_file()
+
+    def _close_file(self):
+        try:
+            self._file.close()
+        except (OSError, ValueError) as e:
+            LOG.debug("Unable to close the event stream: %s", e)
+
+    def emit(self, event: str, **data):
+        if self._out is None:
+            return
+        data = dict(self._fields, **data)
+        data.update(event=event, ts=round(time.time(), 3))
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            self._dropped += 1
+
+    def progress(self, event: str, done: int, total: int, **data):
+        """Emit a rate limited progress event, the final one always is"""
+        if self._out is None:
+            return
+        now = time.monotonic()
+        final = total is not None and done >= total
+        if not final and now - self._last_progress.get(event, 0) < (
+            self._progress_interval
+        ):
+            return
+        self._last_progress[event] = now
+        self.emit(event, done=done, total=total, **data)
+
+    def close(self):
+        if self._thread is None:
+            return
+        if self._dropped:
+            self.emit("events_dropped", count=self._dropped)
+        try:
+            self._queue.put(_STOP, timeout=1)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=CLOSE_TIMEOUT)
+        self._thread = None
+        self._out = None
+        with self._lock:
+            # the file is left to a writer stuck on a stalled reader
+            self._abandoned = not self._stopped
+        if self._abandoned:
+            LOG.warning(
+                "The event reader is stalled, dropping %d events",
+                self._queue.qsize(),
+            )
+            return
+        self._close_file()
@@ -57,3 +57,51 @@ class RepositoryNotSupported(Exception):
 
     def __init__(self, repo: str, message: str = "Repository {} is unknown"):
         super().__init__(message.format(repo))
+
+
+class RepositoryUnavailable(Exception):
+    """Repository can not be fetched"""
+
+    def __init__(self, uri: str, reason: str, message: str = "Unable to fetch {}: {}"):
+        super().__init__(message.format(uri, reason))
+
+
+class PackageManifestInvalid(Exception):
+    """Package manifest can not be used"""
+
+    def __init__(self, reason: str, message: str = "Invalid package manifest: {}"):
+        super().__init__(message.format(reason))
+
+
+class StagedTransactionInvalid(Exception):
+    """Staged transaction can not be applied"""
+
+    def __init__(
+        self, reason: str, message: str = "Staged transaction can not be used: {}"
+    ):
+        super().__init__(message.format(reason))
+
+
+class InstallrootsFailed(Exception):
+    """Bootstrap of one or more installroots failed"""
+
+    def __init__(
+        self, installroots: list, message: str = "Bootstrap failed for installroots: {}"
+    ):
+        super().__init__(message.format(", ".join(installroots)))
+
+
+class DaemonAlreadyRunning(Exception):
+    """Another daemon answers on the socket"""
+
+    def __init__(
+        self, socket_path: str, message: str = "A daemon is already listening on {}"
+    ):
+        super().__init__(message.format(socket_path))
+
+
+class MirrorConfigInvalid(Exception):
+    """Mirror configuration can not be used"""
+
+    def __init__(self, reason: str, message: str = "Invalid mirror configuration: {}"):
+        super().__init__(message.format(reason))
@@ -0,0 +1,335 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run history
+
+Every run is recorded in a small SQLite database: the version, the plan
+hash, the phase durations, the transaction sizes, the downloaded bytes, the
+number of commands and http requests and the result. The phases of the last
+run are compared with the median of the previous successful runs so that
+slow mirrors or a slow RHSM show up as regressed phases. The report can be
+exported in the node_exporter textfile format.
+"""
+
+import contextlib
+import logging
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from rhos_bootstrap.constants import DEFAULT_HISTORY_MAX_RUNS
+from rhos_bootstrap.constants import HISTORY_DB
+
+LOG = logging.getLogger(__name__)
+
+# a phase regressed when it took this much longer than its baseline
+DEFAULT_THRESHOLD = 1.5
+# and at least this many seconds longer, ignoring noise on quick phases
+DEFAULT_MIN_DELTA = 1.0
+# number of previous successful runs the baseline is the median of
+DEFAULT_WINDOW = 10
+# a baseline needs at least this many runs
+MIN_BASELINE_RUNS = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL NOT NULL,
+    version TEXT NOT NULL,
+    distro TEXT,
+    plan_hash TEXT,
+    success INTEGER NOT NULL,
+    error TEXT,
+    duration REAL NOT NULL,
+    installed INTEGER NOT NULL,
+    upgraded INTEGER NOT NULL,
+    removed INTEGER NOT NULL,
+    download_bytes INTEGER NOT NULL,
+    subprocesses INTEGER NOT NULL,
+    http_requests INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS phases (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS phases_run ON phases (run_id);
+"""
+
+_RUN_COLUMNS = (
+    "id",
+    "started",
+    "version",
+    "distro",
+    "plan_hash",
+    "success",
+    "error",
+    "duration",
+    "installed",
+    "upgraded",
+    "removed",
+    "download_bytes",
+    "subprocesses",
+    "http_requests",
+)
+
+
+class RunHistory:
+    """SQLite history of the bootstrap runs"""
+
+    def __init__(
+        self, path: str = HISTORY_DB, max_runs: int = DEFAULT_HISTORY_MAX_RUNS
+    ):
+        self._path = path
+        self._max_runs = max_runs
+
+    @property
+    def path(self):
+        return self._path
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self._path, timeout=30)
+        try:
+            conn.execute("PRAGMA foreign_keys = ON")
+            conn.executescript(_SCHEMA)
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, result: dict, plan_hash: str = None, started: float = None) -> int:
+        """Record a BootstrapResult.to_dict(), returns the run id"""
+        os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+        sizes = {"install": 0, "upgrade": 0, "remove": 0}
+        for transaction in result.get("transactions") or []:
+            for action in sizes:
+                sizes[action] += len(transaction.get(action, []))
+        calls = result.get("counters") or {}
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO runs (started, version, distro, plan_hash, success, "
+                "error, duration, installed, upgraded, removed, download_bytes, "
+                "subprocesses, http_requests) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    started if started is not None else time.time(),
+                    result["version"],
+                    result.get("distro"),
+                    plan_hash,
+                    int(bool(result["success"])),
+                    result.get("error"),
+                    result.get("duration", 0.0),
+                    sizes["install"],
+                    sizes["upgrade"],
+                    sizes["remove"],
+                    calls.get("download_bytes", 0),
+                    calls.get("subprocesses", 0),
+                    calls.get("http_requests", 0),
+                ),
+            )
+            run_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO phases (run_id, name, status, duration) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (run_id, phase["name"], phase["status"], phase["duration"])
+                    for phase in result.get("phases") or []
+                ],
+            )
+            # keep the history compact
+            conn.execute("DELETE FROM runs WHERE id <= ?", (run_id - self._max_runs,))
+        LOG.debug("Recorded run %d in %s", run_id, self._path)
+        return run_id
+
+    def runs(self, version: str = None, limit: int = None) -> list:
+        """The recorded runs, the most recent first"""
+        if not os.path.exists(self._path):
+            return []
+        query = f"SELECT {', '.join(_RUN_COLUMNS)} FROM runs"
+        params = []
+        if version:
+            query += " WHERE version = ?"
+            params.append(version)
+        query += " ORDER BY id DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._connect() as conn:
+            runs = [dict(zip(_RUN_COLUMNS, row)) for row in conn.execute(query, params)]
+            for run in runs:
+                run["success"] = bool(run["success"])
+                run["phases"] = {
+                    name: {"status": status, "duration": duration}
+                    for name, status, duration in conn.execute(
+                        "SELECT name, status, duration FROM phases "
+                        "WHERE run_id = ? ORDER BY rowid",
+                        (run["id"],),
+                    )
+                }
+        return runs
+
+    def report(
+        self,
+        version: str = None,
+        limit: int = 20,
+        window: int = DEFAULT_WINDOW,
+        threshold: float = DEFAULT_THRESHOLD,
+        min_delta: float = DEFAULT_MIN_DELTA,
+    ) -> dict:
+        """Recent runs, phase trends and the phases of the last run that
+        regressed against the median of the previous successful runs
+        """
+        runs = self.runs(version, limit=max(limit, window + 1))
+        report = {
+            "path": self._path,
+            "version": version,
+            "runs": runs[:limit],
+            "phases": {},
+            "regressions": [],
+        }
+        if not runs:
+            return report
+        last, previous = runs[0], [run for run in runs[1:] if run["success"]][:window]
+        for name, phase in last["phases"].items():
+            if phase["status"] != "done":
+                continue
+            samples = [
+                run["phases"][name]["duration"]
+                for run in previous
+                if run["phases"].get(name, {}).get("status") == "done"
+            ]
+            trend = {
+                "last": phase["duration"],
+                "baseline": None,
+                "min": min(samples) if samples else None,
+                "max": max(samples) if samples else None,
+                "samples": len(samples),
+                "regressed": False,
+            }
+            if len(samples) >= MIN_BASELINE_RUNS:
+                baseline = statistics.median(samples)
+                trend["baseline"] = baseline
+                trend["regressed"] = (
+                    phase["duration"] > baseline * threshold
+                    and phase["duration"] - baseline >= min_delta
+                )
+            if trend["regressed"]:
+                report["regressions"].append(
+                    {
+                        "run": last["id"],
+                        "phase": name,
+                        "duration": phase["duration"],
+                        "baseline": trend["baseline"],
+                    }
+                )
+            report["phases"][name] = trend
+        return report
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    values = ",".join(
+        f'{name}="{_escape(value)}"'
+        for name, value in sorted(labels.items())
+        if value is not None
+    )
+    return "{" + values + "}" if values else ""
+
+
+def textfile(report: dict) -> str:
+    """The history report in the node_exporter textfile format"""
+    metrics = []
+
+    def _metric(name, help_text, samples):
+        metrics.append(f"# HELP rhos_bootstrap_{name} {help_text}")
+        metrics.append(f"# TYPE rhos_bootstrap_{name} gauge")
+        for labels, value in samples:
+            metrics.append(f"rhos_bootstrap_{name}{_labels(**labels)} {value}")
+
+    runs = report["runs"]
+    _metric(
+        "history_runs",
+        "Number of runs in the reported history",
+        [({"version": report["version"]}, len(runs))],
+    )
+    if runs:
+        last = runs[0]
+        labels = {"version": last["version"], "distro": last["distro"]}
+        for name, help_text, value in (
+            (
+                "last_run_timestamp_seconds",
+                "Start time of the last run",
+                last["started"],
+            ),
+            (
+                "last_run_success",
+                "Whether the last run succeeded",
+                int(last["success"]),
+            ),
+            ("last_run_duration_seconds", "Duration of the last run", last["duration"]),
+            ("last_run_installed_packages", "Packages installed", last["installed"]),
+            ("last_run_upgraded_packages", "Packages upgraded", last["upgraded"]),
+            ("last_run_removed_packages", "Packages removed", last["removed"]),
+            (
+                "last_run_download_bytes",
+                "Package bytes downloaded",
+                last["download_bytes"],
+            ),
+            ("last_run_subprocesses", "Commands run", last["subprocesses"]),
+            (
+                "last_run_http_requests",
+                "Http requests outside of dnf",
+                last["http_requests"],
+            ),
+        ):
+            _metric(name, f"{help_text} by the last run", [(labels, value)])
+    phases = report["phases"]
+    _metric(
+        "phase_duration_seconds",
+        "Duration of the phases of the last run",
+        [({"phase": name}, trend["last"]) for name, trend in phases.items()],
+    )
+    _metric(
+        "phase_baseline_seconds",
+        "Median duration of the phases in the previous successful runs",
+        [
+            ({"phase": name}, trend["baseline"])
+            for name, trend in phases.items()
+            if trend["baseline"] is not None
+        ],
+    )
+    _metric(
+        "phase_regressed",
+        "Whether the phase of the last run regressed against its baseline",
+        [({"phase": name}, int(trend["regressed"])) for name, trend in phases.items()],
+    )
+    return "\n".join(metrics) + "\n"
+
+
+def write_textfile(path: str, report: dict):
+    """Atomically replace path, as the node_exporter collector expects"""
+    target_dir = os.path.dirname(path) or "."
+    with tempfile.NamedTemporaryFile(
+        "w", dir=target_dir, delete=False, encoding="utf-8", suffix=".tmp"
+    ) as out:
+        out.write(textfile(report))
+    os.chmod(out.name, 0o644)
+    os.replace(out.name, path)
@@ -0,0 +1,85 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checkpoint journal
+
+The phases and steps of a bootstrap run are recorded as they complete so a
+``--resume`` run can skip them and continue from the one that failed. The
+journal is keyed by a hash of the plan and of the options changing what is
+done, a run with a different plan starts over.
+"""
+
+import hashlib
+import json
+import logging
+import time
+
+from rhos_bootstrap.constants import JOURNAL_FILE
+from rhos_bootstrap.utils.transaction import write_json
+
+LOG = logging.getLogger(__name__)
+
+
+def plan_key(plan: dict, options: dict) -> str:
+    data = json.dumps({"plan": plan, "options": options}, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class CheckpointJournal:
+    """Completed bootstrap steps"""
+
+    def __init__(self, key: str, path: str = JOURNAL_FILE, steps: list = None):
+        self._key = key
+        self._path = path
+        self._steps = list(steps or [])
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def steps(self) -> list:
+        return list(self._steps)
+
+    @classmethod
+    def load(cls, key: str, path: str = JOURNAL_FILE):
+        """The journal of a previous run with the same plan, or a new one"""
+        try:
+            with open(path, "r", encoding="utf-8") as data:
+                journal = json.load(data)
+        except (OSError, ValueError) as e:
+            LOG.warning("No checkpoint journal to resume from: %s", e)
+            return cls(key, path)
+        if journal.get("key") != key:
+            LOG.warning("The checkpoint journal is for a different plan, starting over")
+            return cls(key, path)
+        return cls(key, path, journal.get("steps"))
+
+    def done(self, step: str) -> bool:
+        return step in self._steps
+
+    def complete(self, step: str):
+        if step not in self._steps:
+            self._steps.append(step)
+        self.save()
+
+    def save(self):
+        try:
+            write_json(
+                self._path,
+                {"key": self._key, "steps": self._steps, "updated": time.time()},
+            )
+        except OSError as e:
+            # not fatal, the run just can not be resumed
+            LOG.warning("Unable to write %s: %s", self._path, e)
@@ -0,0 +1,294 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bootstrap state
+
+A successful run records what it configured: the repository files and
+their content hash (or the RHSM repository ids), the module streams and the
+installed packages. The system can then be checked against it without
+loading dnf, using the network or running subscription-manager, cheap
+enough to be run by monitoring every minute.
+"""
+
+import configparser
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import time
+
+from rhos_bootstrap import constants
+from rhos_bootstrap.utils import counters
+from rhos_bootstrap.utils.repos import RhsmRepo
+from rhos_bootstrap.utils.transaction import write_json
+
+LOG = logging.getLogger(__name__)
+
+
+def _file_sha256(path: str) -> str:
+    try:
+        with open(path, "rb") as data:
+            return hashlib.sha256(data.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _read_ini(path: str) -> configparser.ConfigParser:
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    try:
+        parser.read(path, encoding="utf-8")
+    except configparser.Error as e:
+        LOG.debug("Unable to parse %s: %s", path, e)
+    return parser
+
+
+def installed_packages(names: list) -> dict:
+    """{name: nevra} of the installed packages, None when not installed"""
+    installed = {name: None for name in names}
+    try:
+        import rpm  # pylint: disable=import-outside-toplevel,import-error
+    except ImportError:
+        for name in names:
+            counters.count(counters.SUBPROCESSES)
+            proc = subprocess.run(
+                ["rpm", "-q", "--qf", "%{NAME}-%{EVR}.%{ARCH}\\n", name],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                universal_newlines=True,
+                check=False,
+            )
+            if proc.returncode == 0:
+                installed[name] = proc.stdout.splitlines()[-1]
+        return installed
+    transaction = rpm.TransactionSet()
+    for name in names:
+        for header in transaction.dbMatch("name", name):
+            installed[name] = f"{header['name']}-{header['evr']}.{header['arch']}"
+    return installed
+
+
+class BootstrapState:
+    """What a successful bootstrap run configured"""
+
+    def __init__(
+        self,
+        version: str,
+        distro: str,
+        *,
+        repos: dict = None,
+        modules: dict = None,
+        packages: list = None,
+        updated: float = None,
+    ):
+        self._version = version
+        self._distro = distro
+        # {name: {"type": "rhsm"}|{"type": "file", "sha256": ...}}, None
+        # when the repositories were not configured
+        self._repos = repos
+        # {name: stream}, None when the modules were not configured
+        self._modules = modules
+        self._packages = packages
+        self._updated = updated or time.time()
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def distro(self):
+        return self._distro
+
+    @property
+    def repos(self) -> dict:
+        return self._repos
+
+    @property
+    def modules(self) -> dict:
+        return self._modules
+
+    @property
+    def packages(self) -> list:
+        return self._packages
+
+    @classmethod
+    def from_system(
+        cls,
+        version: str,
+        distro: str,
+        repos: list = None,
+        modules: list = None,
+        packages: list = None,
+        repo_dir: str = None,
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        """Record the configured repos and modules as they are now"""
+        repo_dir = repo_dir or constants.YUM_REPO_BASE_DIR
+        recorded = None
+        if repos is not None:
+            recorded = {}
+            for repo in repos:
+                if isinstance(repo, RhsmRepo):
+                    recorded[repo.name] = {"type": "rhsm"}
+                    continue
+                recorded[repo.name] = {
+                    "type": "file",
+                    "sha256": _file_sha256(os.path.join(repo_dir, f"{repo.name}.repo")),
+                }
+        if modules is not None:
+            modules = {mod.name: mod.stream for mod in modules}
+        return cls(version, distro, repos=recorded, modules=modules, packages=packages)
+
+    @classmethod
+    def load(cls, path: str = None):
+        """The recorded state, None if there is none"""
+        path = path or constants.STATE_FILE
+        try:
+            with open(path, "r", encoding="utf-8") as data:
+                state = json.load(data)
+            return cls(
+                state["version"],
+                state["distro"],
+                repos=state.get("repos"),
+                modules=state.get("modules"),
+                packages=state.get("packages"),
+                updated=state.get("updated"),
+            )
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            LOG.warning("Ignoring unreadable %s: %s", path, e)
+            return None
+
+    def save(self, path: str = None):
+        path = path or constants.STATE_FILE
+        write_json(path, self.to_dict())
+        # status checks do not need root
+        os.chmod(path, 0o644)
+
+    def to_dict(self) -> dict:
+        return {
+            "version": self._version,
+            "distro": self._distro,
+            "repos": self._repos,
+            "modules": self._modules,
+            "packages": self._packages,
+            "updated": self._updated,
+        }
+
+    def _repo_drift(self, repo_dir: str, rhsm_repo_file: str) -> list:
+        drift = []
+        rhsm = None
+        for name, repo in sorted((self._repos or {}).items()):
+            if repo["type"] == "rhsm":
+                if rhsm is None:
+                    rhsm = _read_ini(rhsm_repo_file)
+                enabled = rhsm.get(name, "enabled", fallback="0") == "1"
+                if not enabled:
+                    drift.append(
+                        {
+                            "type": "repo",
+                            "name": name,
+                            "expected": "enabled",
+                            "actual": "disabled",
+                        }
+                    )
+                continue
+            actual = _file_sha256(os.path.join(repo_dir, f"{name}.repo"))
+            if actual != repo["sha256"]:
+                drift.append(
+                    {
+                        "type": "repo",
+                        "name": name,
+                        "expected": repo["sha256"],
+                        "actual": actual or "missing",
+                    }
+                )
+        return drift
+
+    def _module_drift(self, modules_dir: str) -> list:
+        drift = []
+        for name, stream in sorted((self._modules or {}).items()):
+            module = _read_ini(os.path.join(modules_dir, f"{name}.module"))
+            actual = None
+            if module.get(name, "state", fallback="") == "enabled":
+                actual = module.get(name, "stream", fallback=None)
+            if actual != stream:
+                drift.append(
+                    {
+                        "type": "module",
+                        "name": name,
+                        "expected": stream,
+                        "actual": actual or "not enabled",
+                    }
+                )
+        return drift
+
+    def check(self, version: str, **kwargs) -> list:
+        """List the differences between the system and the recorded state
+
+        The repo_dir, rhsm_repo_file and modules_dir keyword arguments
+        default to the system locations.
+        """
+        if version != self._version:
+            return [
+                {
+                    "type": "version",
+                    "name": "version",
+                    "expected": version,
+                    "actual": self._version,
+                }
+            ]
+        drift = self._repo_drift(
+            kwargs.get("repo_dir") or constants.YUM_REPO_BASE_DIR,
+            kwargs.get("rhsm_repo_file") or constants.RHSM_REPO_FILE,
+        )
+        drift.extend(
+            self._module_drift(kwargs.get("modules_dir") or constants.DNF_MODULES_DIR)
+        )
+        if self._packages:
+            for name, nevra in installed_packages(self._packages).items():
+                if nevra is None:
+                    drift.append(
+                        {
+                            "type": "package",
+                            "name": name,
+                            "expected": "installed",
+                            "actual": "not installed",
+                        }
+                    )
+        return drift
+
+
+def status(version: str, path: str = None, **kwargs) -> dict:
+    """Whether the system is still bootstrapped for version"""
+    start = time.monotonic()
+    state = BootstrapState.load(path)
+    if state is None:
+        drift = [
+            {
+                "type": "state",
+                "name": "state",
+                "expected": version,
+                "actual": "not bootstrapped",
+            }
+        ]
+    else:
+        drift = state.check(version, **kwargs)
+    return {
+        "version": version,
+        "ok": not drift,
+        "drift": drift,
+        "bootstrapped": state.to_dict()["updated"] if state else None,
+        "duration": round(time.monotonic() - start, 3),
+    }
@@ -0,0 +1,851 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import sys
+from unittest import mock
+
+sys.modules["dnf"] = mock.MagicMock()
+sys.modules["dnf.cli.cli"] = mock.MagicMock()
+sys.modules["dnf.cli.progress"] = mock.MagicMock()
+sys.modules["dnf.exceptions"] = mock.MagicMock()
+sys.modules["dnf.logging"] = mock.MagicMock()
+sys.modules["dnf.transaction"] = mock.MagicMock()
+sys.modules["dnf.yum.rpmtrans"] = mock.MagicMock()
+sys.modules["libdnf"] = mock.MagicMock()
+from rhos_bootstrap import api
+from rhos_bootstrap import exceptions
+from rhos_bootstrap.utils.dnf import DnfModule
+from rhos_bootstrap.utils.dnf import PackageManifest
+
+
+def _options(**kwargs):
+    kwargs.setdefault("prefetch_workers", 0)
+    return api.BootstrapOptions(**kwargs)
+
+
+class TestApi(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.distro = mock.MagicMock()
+        self.distro.distro_id = "rhel"
+        self.distro.distro_normalized_id = "rhel8.4"
+        self.distro.distro_major_version_id = "8"
+        self.distro.get_repo_specs.return_value = [
+            ("rhel8.4", "baseos"),
+            ("ceph", "ceph-tools"),
+        ]
+        self.distro.get_modules.return_value = [
+            DnfModule("virt", "av"),
+            DnfModule("container-tools", "3.0"),
+            DnfModule("python36", "3.6"),
+        ]
+        self.distro.get_packages.return_value = PackageManifest()
+        tmpdir = self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        patcher = mock.patch.object(
+            api, "JOURNAL_FILE", os.path.join(tmpdir, "journal.json")
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.history_db = os.path.join(tmpdir, "history.sqlite")
+        patcher = mock.patch.object(api, "HISTORY_DB", self.history_db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.state_file = os.path.join(tmpdir, "state.json")
+        patcher = mock.patch("rhos_bootstrap.constants.STATE_FILE", self.state_file)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_build_plan(self):
+        manager = mock.MagicMock()
+        manager.enabled_modules = {
+            "virt": {"stream": "av"},
+            "container-tools": {"stream": "2.0"},
+        }
+        plan = api.build_plan(self.distro, "16.2", _options(), manager)
+        self.assertEqual(
+            plan["repos"],
+            [
+                {"type": "rhel8.4", "name": "baseos"},
+                {"type": "ceph", "name": "ceph-tools"},
+            ],
+        )
+        self.assertEqual(
+            [(m["name"], m["action"]) for m in plan["modules"]],
+            [("virt", "none"), ("container-tools", "switch"), ("python36", "enable")],
+        )
+        self.distro.get_repo_specs.assert_called_once_with("16.2", enable_ceph=True)
+
+        plan = api.build_plan(
+            self.distro, "16.2", _options(skip_repos=True, skip_modules=True)
+        )
+        self.assertEqual(plan["repos"], [])
+        self.assertEqual(plan["modules"], [])
+        self.assertNotIn("delta", plan)
+        self.assertTrue(plan["client_install"])
+
+    @mock.patch("rhos_bootstrap.api.SubscriptionManager")
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run(self, dnf_mock, rhsm_mock):
+        manager = dnf_mock.instance.return_value
+        manager.enable_module.side_effect = [True, False, True]
+        manager.update_package.return_value = {
+            "install": ["foo-1.0-1.noarch"],
+            "upgrade": ["bar-2.0-1.noarch"],
+            "remove": [],
+        }
+        manager.install_update_package.return_value = {
+            "install": [],
+            "upgrade": [],
+            "remove": [],
+        }
+        dnf_mock.loaded.return_value = True
+        repo = mock.MagicMock()
+        repo.name = "baseos"
+        self.distro.get_repos.return_value = [repo]
+        obj = api.Bootstrapper(self.distro)
+        res = obj.run("16.2", _options(update_packages=True))
+
+        self.assertTrue(res.success)
+        self.assertIsNone(res.error)
+        rhsm_mock.instance.return_value.repos.assert_called_once_with(disable=["*"])
+        repo.save.assert_called_once_with()
+        manager.refresh.assert_called_once_with(prefetcher=None, cacheonly=False)
+        self.assertEqual(manager.enable_module.call_count, 3)
+        manager.update_package.assert_called_once_with("*")
+        manager.install_update_package.assert_called_once_with("python3-tripleoclient")
+        data = res.to_dict()
+        self.assertEqual(data["distro"], "rhel8.4")
+        self.assertEqual(
+            [(p["name"], p["status"]) for p in data["phases"]],
+            [
+                ("validation", "done"),
+                ("repos", "done"),
+                ("dnf_setup", "done"),
+                ("modules", "done"),
+                ("update", "done"),
+                ("client_install", "done"),
+            ],
+        )
+        self.assertEqual(
+            data["changed"],
+            [
+                {"type": "repo", "name": "baseos", "action": "configure"},
+                {"type": "module", "name": "virt:av", "action": "enable"},
+                {"type": "module", "name": "python36:3.6", "action": "enable"},
+                {"type": "package", "name": "foo-1.0-1.noarch", "action": "install"},
+                {"type": "package", "name": "bar-2.0-1.noarch", "action": "upgrade"},
+            ],
+        )
+        self.assertEqual(len(data["transactions"]), 2)
+        self.assertEqual(data["transactions"][0]["phase"], "update")
+
+        recorded = api.BootstrapState.load()
+        self.assertEqual(recorded.version, "16.2")
+        self.assertEqual(recorded.repos, {"baseos": mock.ANY})
+        self.assertEqual(
+            recorded.modules,
+            {"virt": "av", "container-tools": "3.0", "python36": "3.6"},
+        )
+        self.assertEqual(recorded.packages, ["python3-tripleoclient"])
+
+    @mock.patch("rhos_bootstrap.api.SubscriptionManager")
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_resume(self, dnf_mock, rhsm_mock):
+        manager = dnf_mock.instance.return_value
+        manager.enable_module.return_value = True
+        manager.update_package.side_effect = [Exception("mirror down"), {}]
+        manager.install_update_package.return_value = {}
+        repo = mock.MagicMock()
+        repo.name = "baseos"
+        repo.is_configured.return_value = True
+        self.distro.get_repos.return_value = [repo]
+        obj = api.Bootstrapper(self.distro)
+        res = obj.run("16.2", _options(update_packages=True))
+        self.assertFalse(res.success)
+        self.assertEqual(res.phases[-1]["name"], "update")
+
+        manager.enabled_modules = {
+            "virt": {"stream": "av"},
+            "container-tools": {"stream": "3.0"},
+            "python36": {"stream": "3.6"},
+        }
+        manager.is_installed.return_value = False
+        repo.save.reset_mock()
+        manager.enable_module.reset_mock()
+        res = obj.run("16.2", _options(update_packages=True, resume=True))
+        self.assertTrue(res.success)
+        self.assertEqual(
+            [(p["name"], p["status"]) for p in res.phases],
+            [
+                ("validation", "resumed"),
+                ("repos", "resumed"),
+                ("dnf_setup", "done"),
+                ("modules", "resumed"),
+                ("update", "done"),
+                ("client_install", "done"),
+            ],
+        )
+        rhsm_mock.instance.return_value.repos.assert_called_once_with(disable=["*"])
+        repo.save.assert_not_called()
+        manager.enable_module.assert_not_called()
+        self.assertEqual(manager.update_package.call_count, 2)
+
+        # changed repos are configured again, completed sub-steps are not
+        repo.is_configured.return_value = False
+        res = obj.run("16.2", _options(update_packages=True, resume=True))
+        self.assertTrue(res.success)
+        self.assertEqual(
+            res.phases[1], {"name": "repos", "status": "done", "duration": mock.ANY}
+        )
+        rhsm_mock.instance.return_value.repos.assert_called_once_with(disable=["*"])
+        repo.save.assert_called_once_with()
+        self.assertEqual(res.phases[-2]["status"], "resumed")
+
+        # a different plan starts over
+        res = obj.run("16.2", _options(resume=True))
+        self.assertEqual(res.phases[0]["status"], "done")
+
+    @mock.patch("rhos_bootstrap.api.DeloreanPins")
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_delorean_pins(self, dnf_mock, pins_mock):
+        self.distro.distro_id = "centos"
+        repo = mock.MagicMock()
+        repo.name = "tripleo-delorean-current-tripleo"
+        self.distro.get_repos.return_value = [repo]
+        pins_mock.load.return_value.apply.return_value = {"a/b": "abcd"}
+        obj = api.Bootstrapper(self.distro)
+        res = obj.run("16.2", _options(delorean_pins="/tmp/pins.json"))
+        self.assertTrue(res.success)
+        pins_mock.load.assert_called_once_with("/tmp/pins.json")
+        pins_mock.load.return_value.apply.assert_called_once_with([repo])
+        self.assertEqual(res.to_dict()["pins"], {"a/b": "abcd"})
+
+        pins_mock.reset_mock()
+        res = obj.run("16.2", _options())
+        pins_mock.load.assert_not_called()
+        self.assertEqual(res.pins, {})
+
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_plugins(self, dnf_mock):
+        manager = dnf_mock.instance.return_value
+        options = _options(
+            skip_repos=True,
+            skip_modules=True,
+            plugin_deny=["dnf_setup:product-id"],
+        )
+        obj = api.Bootstrapper(self.distro)
+        res = obj.run("16.2", options)
+        self.assertTrue(res.success)
+        profiler = dnf_mock.instance.call_args[1]["plugin_profiler"]
+        self.assertFalse(profiler.policy.allowed("product-id", "dnf_setup"))
+        manager.use_plugin_profiler.assert_called_once_with(profiler)
+        self.assertEqual(res.to_dict()["plugins"], profiler.report())
+        self.assertEqual(profiler.phase, "client_install")
+
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_events(self, dnf_mock):
+        manager = dnf_mock.instance.return_value
+        manager.enable_module.return_value = True
+        path = os.path.join(self.tmpdir, "events.jsonl")
+        obj = api.Bootstrapper(self.distro)
+        res = obj.run("16.2", _options(skip_repos=True, events_file=path))
+        self.assertTrue(res.success)
+        self.assertIsInstance(manager.events, api.EventStream)
+        with open(path, "r", encoding="utf-8") as data:
+            events = [json.loads(line) for line in data]
+        self.assertEqual(events[0]["event"], "run_start")
+        self.assertEqual(events[-1]["event"], "run_end")
+        self.assertTrue(events[-1]["success"])
+        self.assertIn(
+            {"phase": "modules", "event": "phase_start"},
+            [{k: e[k] for k in ("phase", "event")} for e in events if "phase" in e],
+        )
+        self.assertEqual(
+            [e["name"] for e in events if e["event"] == "change"],
+            ["virt:av", "container-tools:3.0", "python36:3.6"],
+        )
+        skipped = [e for e in events if e.get("phase") == "repos"]
+        self.assertEqual(skipped[0]["status"], "skipped")
+
+    @mock.patch("rhos_bootstrap.api.ResourceGovernor")
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_governor(self, dnf_mock, governor_mock):
+        manager = dnf_mock.instance.return_value
+        manager.throttle = 0
+        governor = governor_mock.return_value
+        obj = api.Bootstrapper(self.distro)
+        res = obj.run("16.2", _options(skip_repos=True))
+        governor_mock.assert_not_called()
+        manager.use_throttle.assert_not_called()
+        self.assertIsNone(res.governor)
+
+        res = obj.run(
+            "16.2",
+            _options(skip_repos=True, governor="priority", throttle_bandwidth="1M"),
+        )
+        self.assertTrue(res.success)
+        governor_mock.assert_called_once_with(
+            "priority", nice=10, weight=20, bandwidth=1048576
+        )
+        manager.use_throttle.assert_called_once_with(1048576)
+        governor.use_download_rate.assert_called_once_with(manager.download_rate)
+        governor.throttled.assert_called_once_with("client_install")
+        self.assertEqual(res.to_dict()["governor"], governor.report.return_value)
+
+    @mock.patch("rhos_bootstrap.api.PhaseProfiler")
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_profile(self, dnf_mock, profiler_mock):
+        obj = api.Bootstrapper(self.distro)
+        res = obj.run("16.2", _options(skip_repos=True, profile_dir="/tmp/profiles"))
+        self.assertTrue(res.success)
+        profiler_mock.assert_called_once_with("/tmp/profiles")
+        profiler = profiler_mock.return_value
+        self.assertEqual(
+            [c[0][0] for c in profiler.profile.call_args_list],
+            ["validation", "dnf_setup", "modules", "client_install"],
+        )
+        obj.run(
+            "16.2",
+            _options(
+                skip_repos=True, profile_dir="/tmp/profiles", installroot="/srv/a/b"
+            ),
+        )
+        profiler_mock.assert_called_with("/tmp/profiles/srv_a_b")
+
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_history(self, dnf_mock):
+        obj = api.Bootstrapper(self.distro)
+        with mock.patch("rhos_bootstrap.api.counters.snapshot") as snapshot_mock:
+            snapshot_mock.return_value = {
+                "subprocesses": 2,
+                "http_requests": 1,
+                "download_bytes": 0,
+            }
+            res = obj.run("16.2", _options(skip_repos=True))
+        self.assertTrue(res.success)
+        self.assertEqual(res.to_dict()["counters"]["subprocesses"], 2)
+        obj.run("16.2", _options(skip_repos=True, skip_history=True))
+        runs = api.RunHistory(self.history_db).runs()
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(runs[0]["version"], "16.2")
+        self.assertEqual(runs[0]["subprocesses"], 2)
+        self.assertEqual(len(runs[0]["plan_hash"]), 64)
+        self.assertEqual(
+            list(runs[0]["phases"]), [phase["name"] for phase in res.phases]
+        )
+
+        # a history that can not be written does not fail the run
+        with mock.patch.object(
+            api.RunHistory, "record", side_effect=api.sqlite3.Error("locked")
+        ):
+            self.assertTrue(obj.run("16.2", _options(skip_repos=True)).success)
+
+    @mock.patch("rhos_bootstrap.api.render_repos")
+    @mock.patch("rhos_bootstrap.api.DryRunResolver")
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_dry_run(self, dnf_mock, resolver_mock, render_mock):
+        render_mock.return_value = []
+        resolver = resolver_mock.return_value
+        resolver.setup.return_value = True
+        resolver.problems = []
+        resolver.resolve.return_value = {
+            "transaction": {
+                "install": ["foo-1.0-1.noarch"],
+                "upgrade": [],
+                "remove": [],
+            },
+            "packages": {"python3-tripleoclient": "installed"},
+            "download_size": 1024,
+        }
+        repo = mock.MagicMock()
+        self.distro.get_repos.return_value = [repo]
+        obj = api.Bootstrapper(self.distro)
+        res = obj.dry_run("16.2", _options(update_packages=True))
+        self.assertTrue(res["success"])
+        self.assertEqual(res["download_size"], 1024)
+        self.assertEqual(res["transaction"]["install"], ["foo-1.0-1.noarch"])
+        render_mock.assert_called_once_with(
+            mock.ANY, [repo], removed=[], reset_rhsm=True
+        )
+        reposdir = render_mock.call_args[0][0]
+        resolver_mock.assert_called_once_with(reposdir, None)
+        self.assertFalse(os.path.exists(reposdir))
+        resolver.switch_modules.assert_called_once_with(
+            self.distro.get_modules.return_value, disable=None
+        )
+        manifest = resolver.resolve.call_args[0][0]
+        self.assertEqual(
+            manifest.intents(), [("install", "python3-tripleoclient"), ("upgrade", "*")]
+        )
+        resolver.close.assert_called_once_with()
+        repo.save.assert_not_called()
+        dnf_mock.instance.assert_not_called()
+        self.assertFalse(os.path.exists(self.state_file))
+
+        self.distro.validate_distro.return_value = False
+        resolver.setup.return_value = False
+        resolver.problems = ["Unable to load the repositories: offline"]
+        res = obj.dry_run("16.2", _options())
+        self.assertFalse(res["success"])
+        self.assertEqual(len(res["problems"]), 2)
+
+    @mock.patch("rhos_bootstrap.api.PackageManifest.from_file")
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_scoped_sack(self, dnf_mock, from_file_mock):
+        manager = dnf_mock.instance.return_value
+        manager.sack_stats = {"repos": 2, "solvables": 42}
+        baseos = mock.MagicMock(repo_ids=["baseos"])
+        appstream = mock.MagicMock(repo_ids=["appstream", "baseos"])
+        self.distro.get_repos.return_value = [baseos, appstream]
+        options = dict(skip_repos=True, skip_modules=True, scoped_sack=True)
+        obj = api.Bootstrapper(self.distro)
+        res = obj.run("16.2", _options(skip_filelists=True, **options))
+        self.assertTrue(res.success)
+        kwargs = dnf_mock.instance.call_args[1]
+        self.assertEqual(kwargs["repo_scope"], ["appstream", "baseos"])
+        self.assertTrue(kwargs["skip_filelists"])
+        self.assertEqual(res.to_dict()["sack"], manager.sack_stats)
+
+        # a file path needs the filelists
+        from_file_mock.return_value = PackageManifest(install=["/usr/bin/foo"])
+        obj.run(
+            "16.2",
+            _options(skip_filelists=True, packages_file="packages.yaml", **options),
+        )
+        self.assertFalse(dnf_mock.instance.call_args[1]["skip_filelists"])
+
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_installroot(self, dnf_mock):
+        root = os.path.join(self.tmpdir, "root")
+        obj = api.Bootstrapper(self.distro)
+        res = obj.run(
+            "16.2",
+            _options(
+                installroot=root,
+                skip_validation=True,
+                skip_repos=True,
+                skip_modules=True,
+            ),
+        )
+        self.assertTrue(res.success)
+        self.assertEqual(dnf_mock.instance.call_args[1]["installroot"], root)
+        dnf_mock.loaded_for.assert_called_once_with(root)
+        for path in (api.JOURNAL_FILE, self.state_file):
+            self.assertTrue(os.path.exists(os.path.join(root, path.lstrip(os.sep))))
+        self.assertFalse(os.path.exists(self.state_file))
+
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_failure(self, dnf_mock):
+        self.distro.validate_distro.return_value = False
+        obj = api.Bootstrapper(self.distro)
+        res = obj.run("16.2", _options())
+        self.assertFalse(res.success)
+        self.assertIsInstance(res.exception, exceptions.DistroNotSupported)
+        self.assertEqual(res.phases[0]["status"], "failed")
+        dnf_mock.instance.assert_not_called()
+
+        res = obj.run(
+            "16.2",
+            _options(
+                skip_validation=True,
+                skip_repos=True,
+                skip_modules=True,
+                skip_client_install=True,
+            ),
+        )
+        self.assertTrue(res.success)
+        self.assertEqual([p["status"] for p in res.phases], ["skipped"] * 6)
+        dnf_mock.instance.assert_not_called()
+
+    @mock.patch("rhos_bootstrap.api.PackageManifest.from_file")
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_manifest(self, dnf_mock, file_mock):
+        manager = dnf_mock.instance.return_value
+        manager.apply_manifest.return_value = {
+            "packages": {"foo": "installed"},
+            "transaction": {"install": ["foo-1-1.noarch"], "upgrade": [], "remove": []},
+        }
+        self.distro.get_packages.return_value = PackageManifest(install=["bar"])
+        file_mock.return_value = PackageManifest(install=["foo"], remove=["baz"])
+        obj = api.Bootstrapper(self.distro)
+        res = obj.run(
+            "16.2",
+            _options(skip_repos=True, skip_modules=True, packages_file="p.yaml"),
+        )
+        self.assertTrue(res.success)
+        file_mock.assert_called_once_with("p.yaml")
+        manifest = manager.apply_manifest.call_args[0][0]
+        self.assertEqual(manifest.install, ["bar", "foo", "python3-tripleoclient"])
+        self.assertEqual(manifest.remove, ["baz"])
+        manager.install_update_package.assert_not_called()
+        self.assertEqual(res.packages, {"foo": "installed"})
+        self.assertEqual(res.transactions[0]["phase"], "client_install")
+
+    @mock.patch("rhos_bootstrap.api.SubscriptionManager")
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_delta(self, dnf_mock, rhsm_mock):
+        manager = dnf_mock.instance.return_value
+        manager.upgradable_packages.return_value = ["foo"]
+        manager.apply_manifest.return_value = {
+            "packages": {"foo": "upgraded"},
+            "transaction": {"install": [], "upgrade": ["foo-2-1.noarch"], "remove": []},
+        }
+        self.distro.get_repo_specs.side_effect = lambda v, *a, **kw: {
+            "16.1": [("rhel8.4", "baseos"), ("rhel8.4", "osp-16.1")],
+            "16.2": [("rhel8.4", "baseos"), ("rhel8.4", "osp-16.2")],
+        }[v]
+        self.distro.get_modules.return_value = [DnfModule("virt", "av")]
+        repos = {}
+
+        def _construct(repo_type, version, name):
+            repo = repos.setdefault(name, mock.MagicMock())
+            repo.name = name
+            repo.repo_ids = [name]
+            return repo
+
+        self.distro.construct_repo.side_effect = _construct
+        obj = api.Bootstrapper(self.distro)
+        res = obj.run(
+            "16.2",
+            _options(
+                from_version="16.1", update_packages=True, skip_client_install=True
+            ),
+        )
+        self.assertTrue(res.success)
+        rhsm_mock.instance.return_value.repos.assert_not_called()
+        self.distro.get_repos.assert_not_called()
+        repos["osp-16.1"].remove.assert_called_once_with()
+        repos["osp-16.2"].save.assert_called_once_with()
+        self.assertNotIn("baseos", repos)
+        manager.upgradable_packages.assert_called_once_with(["osp-16.2"])
+        manager.update_package.assert_not_called()
+        self.assertEqual(manager.apply_manifest.call_args[0][0].upgrade, ["foo"])
+        self.assertEqual(
+            [c for c in res.changed if c["type"] == "repo"],
+            [
+                {"type": "repo", "name": "osp-16.1", "action": "remove"},
+                {"type": "repo", "name": "osp-16.2", "action": "configure"},
+            ],
+        )
+
+        # a module stream change updates everything
+        self.distro.get_modules.side_effect = lambda v: {
+            "16.1": [DnfModule("virt", "rhel")],
+            "16.2": [DnfModule("virt", "av")],
+        }[v]
+        manager.apply_manifest.reset_mock()
+        res = obj.run(
+            "16.2",
+            _options(
+                from_version="16.1", update_packages=True, skip_client_install=True
+            ),
+        )
+        self.assertTrue(res.success)
+        manager.update_package.assert_called_once_with("*")
+        manager.apply_manifest.assert_not_called()
+
+    @mock.patch("rhos_bootstrap.api.ResolvedTransaction")
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_download_only(self, dnf_mock, staged_mock):
+        manager = dnf_mock.instance.return_value
+        manager.cacheonly = False
+        manager.apply_manifest.return_value = {
+            "packages": {"*": "upgraded"},
+            "transaction": {"install": [], "upgrade": ["foo-2-1.noarch"], "remove": []},
+        }
+        obj = api.Bootstrapper(self.distro)
+        res = obj.run(
+            "16.2",
+            _options(
+                skip_repos=True,
+                skip_modules=True,
+                download_only=True,
+                update_packages=True,
+            ),
+        )
+        self.assertTrue(res.success)
+        args, kwargs = manager.apply_manifest.call_args
+        self.assertEqual(args[0].upgrade, ["*"])
+        self.assertEqual(args[0].install, ["python3-tripleoclient"])
+        self.assertEqual(kwargs, {"download_only": True})
+        manager.update_package.assert_not_called()
+        staged_mock.assert_called_once_with(
+            "16.2",
+            "rhel8.4",
+            {"install": ["python3-tripleoclient"], "upgrade": ["*"], "remove": []},
+            {"install": [], "upgrade": ["foo-2-1.noarch"], "remove": []},
+            state=manager.system_state.return_value,
+        )
+        staged_mock.return_value.save.assert_called_once_with()
+        self.assertEqual(res.changed, [])
+        self.assertEqual(
+            [p["name"] for p in res.phases],
+            ["validation", "repos", "dnf_setup", "modules", "download"],
+        )
+
+    @mock.patch("rhos_bootstrap.api.SubscriptionManager")
+    @mock.patch("rhos_bootstrap.api.ResolvedTransaction")
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_apply_staged(self, dnf_mock, staged_mock, rhsm_mock):
+        manager = dnf_mock.instance.return_value
+        manager.cacheonly = True
+        manager.shared_cache = None
+        manager.repo_scope = None
+        manager.skip_filelists = False
+        manager.apply_manifest.return_value = {
+            "packages": {"*": "upgraded"},
+            "transaction": {"install": [], "upgrade": ["foo-2-1.noarch"], "remove": []},
+        }
+        staged = staged_mock.load.return_value
+        staged.version = "16.2"
+        staged.manifest = {"upgrade": ["*"]}
+        obj = api.Bootstrapper(self.distro)
+        res = obj.run("16.2", _options(skip_modules=True, apply_staged=True))
+        self.assertTrue(res.success)
+        dnf_mock.instance.assert_called_once_with(
+            prefetcher=None,
+            cacheonly=True,
+            shared_cache=None,
+            plugin_profiler=mock.ANY,
+            installroot=None,
+            repo_scope=None,
+            skip_filelists=False,
+        )
+        manager.refresh.assert_not_called()
+        rhsm_mock.instance.assert_not_called()
+        self.distro.get_repos.assert_not_called()
+        args, kwargs = manager.apply_manifest.call_args
+        self.assertEqual(args[0].upgrade, ["*"])
+        self.assertEqual(kwargs, {"expected": staged.transaction})
+        staged.remove.assert_called_once_with()
+        self.assertEqual(res.phases[1]["status"], "skipped")
+
+        staged.remove.reset_mock()
+        staged.version = "16.1"
+        res = obj.run("16.2", _options(skip_modules=True, apply_staged=True))
+        self.assertFalse(res.success)
+        self.assertIsInstance(res.exception, exceptions.StagedTransactionInvalid)
+        staged.remove.assert_not_called()
+
+    @mock.patch("rhos_bootstrap.api.ResolvedTransaction")
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_replay(self, dnf_mock, resolved_mock):
+        manager = dnf_mock.instance.return_value
+        manager.cacheonly = False
+        summary = {"install": [], "upgrade": ["foo-2-1.noarch"], "remove": []}
+        manager.apply_resolved.return_value = summary
+        manager.apply_manifest.return_value = {
+            "packages": {"*": "upgraded"},
+            "transaction": summary,
+        }
+        loaded = resolved_mock.load.return_value
+        loaded.incompatibilities.return_value = []
+        options = _options(
+            skip_repos=True,
+            skip_modules=True,
+            update_packages=True,
+            replay_transaction="role.json",
+            export_transaction="out.json",
+        )
+        obj = api.Bootstrapper(self.distro)
+        res = obj.run("16.2", options)
+        self.assertTrue(res.success)
+        self.assertTrue(res.replayed)
+        resolved_mock.load.assert_called_once_with("role.json")
+        loaded.incompatibilities.assert_called_once_with(
+            "16.2", "rhel8.4", manager.system_state.return_value
+        )
+        manager.apply_resolved.assert_called_once_with(loaded.transaction)
+        manager.apply_manifest.assert_not_called()
+        manager.update_package.assert_not_called()
+        resolved_mock.return_value.save.assert_called_once_with("out.json")
+        self.assertEqual(res.transactions[0]["phase"], "packages")
+        self.assertEqual(
+            [p["name"] for p in res.phases],
+            ["validation", "repos", "dnf_setup", "modules", "packages"],
+        )
+
+        # incompatible systems resolve normally
+        loaded.incompatibilities.return_value = ["the installed packages differ"]
+        manager.apply_resolved.reset_mock()
+        res = obj.run("16.2", options)
+        self.assertTrue(res.success)
+        self.assertFalse(res.replayed)
+        manager.apply_resolved.assert_not_called()
+        self.assertEqual(manager.apply_manifest.call_args[0][0].upgrade, ["*"])
+        self.assertEqual(manager.apply_manifest.call_args[1], {"download_only": False})
+
+        # and so do failed replays
+        loaded.incompatibilities.return_value = []
+        manager.apply_resolved.side_effect = exceptions.StagedTransactionInvalid("foo")
+        manager.apply_manifest.reset_mock()
+        res = obj.run("16.2", options)
+        self.assertTrue(res.success)
+        self.assertFalse(res.replayed)
+        manager.apply_manifest.assert_called_once()
+
+    @mock.patch("rhos_bootstrap.api.SharedCache")
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_shared_cache(self, dnf_mock, cache_mock):
+        manager = dnf_mock.instance.return_value
+        manager.cacheonly = False
+        manager.shared_cache = None
+        cache_mock.return_value.stats.return_value = {
+            "metadata": {"hits": 1, "misses": 0},
+            "packages": {"hits": 2, "misses": 1},
+        }
+        obj = api.Bootstrapper(self.distro)
+        options = _options(
+            skip_repos=True, skip_modules=True, shared_cache="/srv/dnf-cache"
+        )
+        res = obj.run("16.2", options)
+        self.assertTrue(res.success)
+        shared_cache = cache_mock.return_value
+        cache_mock.assert_called_once_with("/srv/dnf-cache", 20480)
+        shared_cache.reset_stats.assert_called_once_with()
+        dnf_mock.instance.assert_called_once_with(
+            prefetcher=None,
+            cacheonly=False,
+            shared_cache=shared_cache,
+            plugin_profiler=mock.ANY,
+            installroot=None,
+            repo_scope=None,
+            skip_filelists=False,
+        )
+        # an already loaded manager switches to the shared cache
+        manager.use_shared_cache.assert_called_once_with(shared_cache)
+        manager.refresh.assert_called_once_with(prefetcher=None, cacheonly=False)
+        self.assertEqual(res.cache, shared_cache.stats.return_value)
+
+        # the cache is reused by the following runs
+        shared_cache.path = "/srv/dnf-cache"
+        shared_cache.max_size = 20480 * 1024 * 1024
+        manager.shared_cache = shared_cache
+        manager.repo_scope = None
+        manager.skip_filelists = False
+        manager.refresh.reset_mock()
+        res = obj.run("16.2", options)
+        cache_mock.assert_called_once()
+        manager.refresh.assert_not_called()
+        self.assertEqual(shared_cache.reset_stats.call_count, 2)
+
+        res = obj.run("16.2", _options(skip_repos=True, skip_modules=True))
+        self.assertIsNone(res.cache)
+        manager.use_shared_cache.assert_called_with(None)
+
+    @mock.patch("rhos_bootstrap.api.DnfManager")
+    def test_run_batched_update(self, dnf_mock):
+        manager = dnf_mock.instance.return_value
+        manager.update_batched.return_value = [
+            {
+                "repo": "baseos",
+                "packages": ["foo", "bar"],
+                "peak_rss_mb": 300.0,
+                "transaction": {"install": [], "upgrade": ["foo-2-1.noarch"]},
+            },
+            {
+                "repo": "appstream",
+                "packages": ["baz"],
+                "peak_rss_mb": 250.0,
+                "transaction": {"install": [], "upgrade": ["baz-2-1.noarch"]},
+            },
+        ]
+        obj = api.Bootstrapper(self.distro)
+        res = obj.run(
+            "16.2",
+            _options(
+                skip_repos=True,
+                skip_modules=True,
+                skip_client_install=True,
+                update_packages=True,
+                update_memory_budget_mb=512,
+            ),
+        )
+        self.assertTrue(res.success)
+        manager.update_batched.assert_called_once_with(512, None)
+        manager.update_package.assert_not_called()
+        self.assertEqual(
+            res.batches,
+            [
+                {"repo": "baseos", "packages": 2, "peak_rss_mb": 300.0},
+                {"repo": "appstream", "packages": 1, "peak_rss_mb": 250.0},
+            ],
+        )
+        self.assertEqual([t["phase"] for t in res.transactions], ["update", "update"])
+
+    def test_options(self):
+        obj = api.BootstrapOptions(skip_repos=True)
+        self.assertTrue(obj.skip_repos)
+        self.assertFalse(obj.update_packages)
+        self.assertTrue(obj.use_dnf)
+        self.assertRaises(TypeError, api.BootstrapOptions, foo=True)
+        self.assertRaises(
+            ValueError, api.BootstrapOptions, download_only=True, apply_staged=True
+        )
+        self.assertRaises(
+            ValueError,
+            api.BootstrapOptions,
+            download_only=True,
+            replay_transaction="foo.json",
+        )
+        self.assertRaises(
+            ValueError,
+            api.BootstrapOptions,
+            apply_staged=True,
+            export_transaction="foo.json",
+        )
+        self.assertTrue(
+            api.BootstrapOptions(export_transaction="foo.json").single_transaction
+        )
+        self.assertFalse(obj.single_transaction)
+        self.assertRaises(
+            ValueError,
+            api.BootstrapOptions,
+            download_only=True,
+            update_memory_budget_mb=512,
+        )
+        self.assertRaises(ValueError, api.BootstrapOptions, plugin_deny=["update:"])
+        self.assertRaises(ValueError, api.BootstrapOptions, rhsm_backend="foo")
+        self.assertRaises(ValueError, api.BootstrapOptions, governor="foo")
+        self.assertRaises(ValueError, api.BootstrapOptions, governor_weight=0)
+        self.assertRaises(ValueError, api.BootstrapOptions, throttle_bandwidth="x")
+        self.assertEqual(
+            api.BootstrapOptions(throttle_bandwidth="2M").throttle_bytes, 2097152
+        )
+        self.assertRaises(
+            ValueError,
+            api.BootstrapOptions,
+            installroot="/srv/root",
+            download_only=True,
+        )
+        obj = api.BootstrapOptions.from_dict({"skip_modules": True, "debug": True})
+        self.assertTrue(obj.skip_modules)
+        self.assertEqual(obj.to_dict()["skip_modules"], True)
+        self.assertNotIn("debug", obj.to_dict())
+
+    @mock.patch("rhos_bootstrap.api.Bootstrapper")
+    def test_bootstrap(self, bootstrapper_mock):
+        api._BOOTSTRAPPER = None
+        api.bootstrap("16.2")
+        api.plan("16.2")
+        bootstrapper_mock.assert_called_once_with()
+        bootstrapper_mock.return_value.run.assert_called_once_with("16.2", None)
+        bootstrapper_mock.return_value.plan.assert_called_once_with("16.2", None)
+        api._BOOTSTRAPPER = None
@@ -0,0 +1,124 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+from unittest import mock
+
+sys.modules["dnf"] = mock.MagicMock()
+sys.modules["dnf.cli.cli"] = mock.MagicMock()
+sys.modules["dnf.cli.progress"] = mock.MagicMock()
+sys.modules["dnf.exceptions"] = mock.MagicMock()
+sys.modules["dnf.logging"] = mock.MagicMock()
+sys.modules["dnf.transaction"] = mock.MagicMock()
+sys.modules["dnf.yum.rpmtrans"] = mock.MagicMock()
+sys.modules["libdnf"] = mock.MagicMock()
+from rhos_bootstrap import api
+from rhos_bootstrap import batch
+
+
+class _InlinePool:
+    """multiprocessing pool running the tasks in the test process"""
+
+    def __init__(self, processes, initializer, initargs):
+        self.processes = processes
+        initializer(*initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    @staticmethod
+    def apply_async(func, args):
+        result = mock.MagicMock()
+        try:
+            result.get.return_value = func(*args)
+        except Exception as e:  # pylint: disable=broad-except
+            result.get.side_effect = e
+        return result
+
+
+class TestBatch(unittest.TestCase):
+    def test_host_options(self):
+        options = api.BootstrapOptions(
+            update_packages=True, packages_file="foo.yaml", delorean_pins="pins.json"
+        )
+        obj = batch.host_options(options)
+        self.assertFalse(obj.use_dnf)
+        self.assertEqual(obj.delorean_pins, "pins.json")
+
+    def test_installroot_options(self):
+        options = api.BootstrapOptions(update_packages=True)
+        obj = batch.installroot_options(options, "/srv/root", "/srv/cache")
+        self.assertEqual(obj["installroot"], "/srv/root")
+        self.assertEqual(obj["shared_cache"], "/srv/cache")
+        self.assertTrue(obj["skip_repos"])
+        self.assertTrue(obj["skip_validation"])
+        self.assertTrue(obj["update_packages"])
+        self.assertRaises(
+            ValueError,
+            batch.installroot_options,
+            api.BootstrapOptions(download_only=True),
+            "/srv/root",
+            "/srv/cache",
+        )
+
+    @mock.patch("rhos_bootstrap.batch.api.Bootstrapper")
+    @mock.patch("multiprocessing.get_context")
+    def test_run_batch(self, context_mock, bootstrapper_mock):
+        context_mock.return_value.Pool = _InlinePool
+        host = mock.MagicMock()
+        host.run.return_value.success = True
+        worker = bootstrapper_mock.return_value
+        worker.run.return_value.to_dict.side_effect = [
+            {"version": "16.2", "success": True, "error": None},
+            {"version": "16.2", "success": False, "error": "foo"},
+        ]
+        res = batch.run_batch(
+            "16.2",
+            ["/srv/a", "/srv/b", "/srv/a/"],
+            api.BootstrapOptions(update_packages=True),
+            workers=4,
+            bootstrapper=host,
+        )
+        host_options = host.run.call_args[0][1]
+        self.assertFalse(host_options.use_dnf)
+        bootstrapper_mock.assert_called_once_with(host.distro)
+        self.assertEqual(
+            [c[0][1].installroot for c in worker.run.call_args_list],
+            ["/srv/a", "/srv/b"],
+        )
+        self.assertEqual(
+            worker.run.call_args[0][1].shared_cache, batch.INSTALLROOT_CACHE_DIR
+        )
+        self.assertFalse(res.success)
+        self.assertEqual(res.failed, ["/srv/b"])
+        self.assertEqual(list(res.to_dict()["installroots"]), ["/srv/a", "/srv/b"])
+
+    @mock.patch("multiprocessing.get_context")
+    def test_run_batch_host_failure(self, context_mock):
+        host = mock.MagicMock()
+        host.run.return_value.success = False
+        res = batch.run_batch("16.2", ["/srv/a"], bootstrapper=host)
+        self.assertFalse(res.success)
+        self.assertEqual(res.installroots, {})
+        context_mock.assert_not_called()
+
+    def test_run_batch_invalid(self):
+        host = mock.MagicMock()
+        self.assertRaises(ValueError, batch.run_batch, "16.2", [], bootstrapper=host)
+        self.assertRaises(ValueError, batch.run_batch, "16.2", ["/"], bootstrapper=host)
+        host.run.assert_not_called()
@@ -0,0 +1,166 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+import yaml
+from unittest import mock
+
+from rhos_bootstrap import catalog
+
+DUMMY_DATA = """
+---
+distros:
+  redhat:
+    versions:
+      - 8.4
+      - 8.2
+versions:
+  "16.2":
+    distros:
+      - rhel8.4
+    repos:
+      rhel8.4:
+        - baseos
+  "16.1":
+    distros:
+      - rhel8.2
+      - rhel8.4
+    repos:
+      rhel8.2:
+        - baseos
+"""
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.data = yaml.safe_load(DUMMY_DATA)
+        self.catalog_dir = os.path.join(self.tmp.name, "rhel")
+
+    def test_deep_merge(self):
+        base = {"a": {"b": [1, 2], "c": 1, "d": "x"}, "e": 1}
+        overlay = {"a": {"b": [2, 3], "c": 2, "d": None}, "f": {"g": 1}}
+        self.assertEqual(
+            catalog.deep_merge(base, overlay),
+            {"a": {"b": [1, 2, 3], "c": 2}, "e": 1, "f": {"g": 1}},
+        )
+        # inputs are not modified
+        self.assertEqual(base, {"a": {"b": [1, 2], "c": 1, "d": "x"}, "e": 1})
+
+    def test_find_overrides(self):
+        self.assertEqual(catalog.find_overrides(self.catalog_dir, "rhel"), [])
+        for name in ["rhel-b.yaml", "rhel.yaml", "rhel-a.yaml", "centos.yaml", "x"]:
+            with open(os.path.join(self.tmp.name, name), "w", encoding="utf-8"):
+                pass
+        self.assertEqual(
+            catalog.find_overrides(self.tmp.name, "rhel"),
+            [
+                os.path.join(self.tmp.name, "rhel-a.yaml"),
+                os.path.join(self.tmp.name, "rhel-b.yaml"),
+                os.path.join(self.tmp.name, "rhel.yaml"),
+            ],
+        )
+
+    def test_load_layers(self):
+        base = os.path.join(self.tmp.name, "base.yaml")
+        over = os.path.join(self.tmp.name, "over.yaml")
+        cache_file = os.path.join(self.tmp.name, "cache", "rhel.json")
+        with open(base, "w", encoding="utf-8") as f:
+            f.write(DUMMY_DATA)
+        with open(over, "w", encoding="utf-8") as f:
+            f.write('versions:\n  "16.2":\n    repos:\n      rhel8.4: [extra]\n')
+
+        data = catalog.load_layers([base, over], cache_file)
+        self.assertEqual(
+            data["versions"]["16.2"]["repos"]["rhel8.4"], ["baseos", "extra"]
+        )
+        self.assertEqual(data["distros"], self.data["distros"])
+        self.assertTrue(os.path.exists(cache_file))
+
+        with mock.patch("rhos_bootstrap.catalog._load_yaml") as load_mock:
+            self.assertEqual(catalog.load_layers([base, over], cache_file), data)
+            load_mock.assert_not_called()
+
+        # a changed layer invalidates the cache
+        with open(over, "w", encoding="utf-8") as f:
+            f.write('versions:\n  "16.2":\n    distros: [rhel8.5]\n')
+        data = catalog.load_layers([base, over], cache_file)
+        self.assertEqual(data["versions"]["16.2"]["distros"], ["rhel8.4", "rhel8.5"])
+
+    def test_build_index(self):
+        idx = catalog.build_index(self.data["versions"], self.data["distros"])
+        self.assertEqual(idx["distros"], self.data["distros"])
+        self.assertEqual(
+            idx["index"], {"rhel8.4": ["16.2", "16.1"], "rhel8.2": ["16.1"]}
+        )
+
+    def test_write_catalog(self):
+        self.assertFalse(catalog.is_sharded(self.catalog_dir))
+        catalog.write_catalog(self.data, self.catalog_dir)
+        self.assertTrue(catalog.is_sharded(self.catalog_dir))
+        self.assertEqual(
+            sorted(os.listdir(self.catalog_dir)),
+            ["16.1.yaml", "16.2.yaml", "index.yaml"],
+        )
+        idx = catalog.load_index(self.catalog_dir)
+        self.assertEqual(idx["distros"], self.data["distros"])
+
+        # re-index keeps the distros information
+        os.unlink(os.path.join(self.catalog_dir, "16.1.yaml"))
+        catalog.write_index(self.catalog_dir)
+        idx = catalog.load_index(self.catalog_dir)
+        self.assertEqual(idx["distros"], self.data["distros"])
+        self.assertEqual(idx["index"], {"rhel8.4": ["16.2"]})
+
+    def test_sharded_versions(self):
+        catalog.write_catalog(self.data, self.catalog_dir)
+        idx = catalog.load_index(self.catalog_dir)
+        obj = catalog.ShardedVersions(self.catalog_dir, idx["index"])
+        self.assertEqual(obj.catalog_dir, self.catalog_dir)
+        self.assertEqual(len(obj), 2)
+        self.assertEqual(sorted(obj), ["16.1", "16.2"])
+        self.assertIn("16.1", obj)
+        self.assertNotIn("17.0", obj)
+        self.assertEqual(sorted(obj.distros("16.1")), ["rhel8.2", "rhel8.4"])
+        self.assertEqual(obj.supported_versions("rhel8.2"), ["16.1"])
+        self.assertEqual(obj.supported_versions("rhel9.0"), [])
+
+        with mock.patch("rhos_bootstrap.catalog._load_yaml") as load_mock:
+            load_mock.return_value = self.data["versions"]["16.2"]
+            self.assertEqual(obj["16.2"], self.data["versions"]["16.2"])
+            self.assertEqual(obj.get("16.2"), self.data["versions"]["16.2"])
+            # only loaded once
+            load_mock.assert_called_once_with(
+                os.path.join(self.catalog_dir, "16.2.yaml")
+            )
+            self.assertRaises(KeyError, obj.__getitem__, "17.0")
+
+    def test_sharded_versions_overlay(self):
+        catalog.write_catalog(self.data, self.catalog_dir)
+        idx = catalog.load_index(self.catalog_dir)
+        overlay = {
+            "16.2": {"distros": ["rhel8.5"], "repos": {"rhel8.4": ["extra"]}},
+            "17.0": {"distros": ["rhel9.0"]},
+        }
+        obj = catalog.ShardedVersions(self.catalog_dir, idx["index"], overlay)
+        self.assertEqual(sorted(obj), ["16.1", "16.2", "17.0"])
+        self.assertEqual(obj.supported_versions("rhel8.5"), ["16.2"])
+        self.assertEqual(obj.distros("17.0"), ["rhel9.0"])
+        self.assertEqual(obj["16.2"]["repos"]["rhel8.4"], ["baseos", "extra"])
+        self.assertEqual(obj["16.2"]["distros"], ["rhel8.4", "rhel8.5"])
+        self.assertEqual(obj["17.0"], {"distros": ["rhel9.0"]})
@@ -0,0 +1,253 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import socket
+import threading
+import tempfile
+import unittest
+import sys
+from unittest import mock
+
+sys.modules["dnf"] = mock.MagicMock()
+sys.modules["dnf.cli.cli"] = mock.MagicMock()
+sys.modules["dnf.cli.progress"] = mock.MagicMock()
+sys.modules["dnf.exceptions"] = mock.MagicMock()
+sys.modules["dnf.logging"] = mock.MagicMock()
+sys.modules["dnf.transaction"] = mock.MagicMock()
+sys.modules["dnf.yum.rpmtrans"] = mock.MagicMock()
+sys.modules["libdnf"] = mock.MagicMock()
+from rhos_bootstrap import daemon
+from rhos_bootstrap.exceptions import DaemonAlreadyRunning
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.multiple(
+            "rhos_bootstrap.constants",
+            YUM_REPO_BASE_DIR=self.tmp.name,
+            DNF_MODULES_DIR=os.path.join(self.tmp.name, "missing"),
+            RPMDB_DIR=os.path.join(self.tmp.name, "missing"),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        dnf_patcher = mock.patch("rhos_bootstrap.daemon.DnfManager")
+        self.dnf_mock = dnf_patcher.start()
+        self.addCleanup(dnf_patcher.stop)
+        self.obj = daemon.BootstrapDaemon(os.path.join(self.tmp.name, "sock"))
+        self.bootstrapper = mock.MagicMock()
+        self.bootstrapper.distro.distro_normalized_id = "rhel8.4"
+        self.obj._bootstrapper = self.bootstrapper
+
+    def _write_repo(self, name, data="data"):
+        with open(os.path.join(self.tmp.name, name), "w", encoding="utf-8") as f:
+            f.write(data)
+
+    def test_fingerprint(self):
+        self.assertEqual(daemon.system_fingerprint(), [])
+        self._write_repo("foo.repo")
+        fingerprint = daemon.system_fingerprint()
+        self.assertEqual(len(fingerprint), 1)
+        self.assertEqual(fingerprint[0][0], os.path.join(self.tmp.name, "foo.repo"))
+        self.assertEqual(fingerprint[0][2], 4)
+
+    def test_refresh(self):
+        self.dnf_mock.loaded.return_value = True
+        self.obj.warm()
+        self.dnf_mock.instance.assert_called_once_with()
+        refresh = self.dnf_mock.instance.return_value.refresh
+
+        self.obj._refresh_if_changed()
+        refresh.assert_not_called()
+
+        self._write_repo("foo.repo")
+        self.obj._refresh_if_changed()
+        refresh.assert_called_once_with()
+        self.obj._refresh_if_changed()
+        refresh.assert_called_once_with()
+
+    def test_handle(self):
+        self.bootstrapper.plan.return_value = {"repos": []}
+        res = self.obj.handle(
+            {"action": "plan", "options": {"version": "16.2", "debug": True}}
+        )
+        self.assertEqual(res["result"], {"repos": []})
+        self.assertTrue(res["ok"])
+        version, options = self.bootstrapper.plan.call_args[0]
+        self.assertEqual(version, "16.2")
+        self.assertFalse(options.skip_repos)
+
+        def _run(version, options):
+            daemon.LOG.warning("applying %s", version)
+            return mock.MagicMock(to_dict=lambda: {"version": version})
+
+        self.bootstrapper.run.side_effect = _run
+        res = self.obj.handle({"action": "apply", "options": {"version": "16.2"}})
+        self.assertTrue(res["ok"])
+        self.assertEqual(res["result"]["version"], "16.2")
+        self.assertIn("[WARNING]: applying 16.2", res["log"])
+
+        self.bootstrapper.run.side_effect = Exception("boom")
+        res = self.obj.handle({"action": "apply", "options": {"version": "16.2"}})
+        self.assertFalse(res["ok"])
+        self.assertEqual(res["error"], "boom")
+
+        res = self.obj.handle({"action": "status"})
+        self.assertEqual(res["result"]["requests"], 4)
+        self.assertEqual(res["result"]["distro"], "rhel8.4")
+        self.assertFalse(res["result"]["busy"])
+
+        res = self.obj.handle({"action": "nope"})
+        self.assertFalse(res["ok"])
+
+    @mock.patch("rhos_bootstrap.batch.run_batch")
+    def test_handle_options(self, batch_mock):
+        self.bootstrapper.dry_run.return_value = {"success": True}
+        res = self.obj.handle(
+            {"action": "apply", "options": {"version": "16.2", "dry_run": True}}
+        )
+        self.assertEqual(res["result"], {"success": True})
+        self.bootstrapper.run.assert_not_called()
+
+        batch_mock.return_value.to_dict.return_value = {"success": True}
+        res = self.obj.handle(
+            {
+                "action": "apply",
+                "options": {
+                    "version": "16.2",
+                    "installroots": ["/srv/a", "/srv/b"],
+                    "installroot_workers": 2,
+                },
+            }
+        )
+        self.assertTrue(res["ok"])
+        version, roots, _, workers, bootstrapper = batch_mock.call_args[0]
+        self.assertEqual(
+            (version, roots, workers, bootstrapper),
+            ("16.2", ["/srv/a", "/srv/b"], 2, self.bootstrapper),
+        )
+        self.bootstrapper.run.assert_not_called()
+
+        for action, options in (
+            ("plan", {"dry_run": True}),
+            ("plan", {"installroots": ["/srv/a"]}),
+            ("apply", {"dry_run": True, "installroots": ["/srv/a"]}),
+        ):
+            res = self.obj.handle(
+                {"action": action, "options": dict(options, version="16.2")}
+            )
+            self.assertFalse(res["ok"])
+        self.bootstrapper.plan.assert_not_called()
+        self.bootstrapper.run.assert_not_called()
+
+    def test_handle_client_options(self):
+        for options, error in (
+            ({"events_fd": 3}, "--events-fd can not be used through the daemon"),
+            ({"events_file": "events.json"}, "events.json must be an absolute path"),
+            ({"installroots": ["/srv/a", "b"]}, "b must be an absolute path"),
+        ):
+            res = self.obj.handle(
+                {"action": "apply", "options": dict(options, version="16.2")}
+            )
+            self.assertFalse(res["ok"])
+            self.assertEqual(res["error"], error)
+        self.bootstrapper.run.assert_not_called()
+
+        options = daemon.client_options(
+            {"events_file": "events.json", "installroots": ["a"], "profile_dir": None}
+        )
+        self.assertEqual(
+            options,
+            {
+                "events_file": os.path.join(os.getcwd(), "events.json"),
+                "installroots": [os.path.join(os.getcwd(), "a")],
+                "profile_dir": None,
+            },
+        )
+        daemon.check_options(options)
+
+    def test_handle_concurrent(self):
+        other = threading.Event()
+
+        def _plan(version, options):
+            thread = threading.Thread(
+                target=lambda: (daemon.LOG.warning("other request"), other.set())
+            )
+            thread.start()
+            thread.join()
+            daemon.LOG.warning("planning %s", version)
+            return {}
+
+        self.bootstrapper.plan.side_effect = _plan
+        res = self.obj.handle({"action": "plan", "options": {"version": "16.2"}})
+        self.assertTrue(other.is_set())
+        self.assertIn("[WARNING]: planning 16.2", res["log"])
+        self.assertNotIn("[WARNING]: other request", res["log"])
+
+    def test_handle_counter(self):
+        threads = [
+            threading.Thread(target=self.obj.handle, args=({"action": "status"},))
+            for _ in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.obj.status()["requests"], 20)
+
+    def test_serve_forever_running(self):
+        path = self.obj.socket_path
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as live:
+            live.bind(path)
+            live.listen(1)
+            with self.assertRaises(DaemonAlreadyRunning):
+                self.obj.serve_forever()
+        self.assertTrue(os.path.exists(path))
+
+    @mock.patch("rhos_bootstrap.daemon._UnixServer")
+    def test_serve_forever_stale(self, server_mock):
+        path = self.obj.socket_path
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(path)
+        existed = []
+
+        def _server(socket_path, bootstrap_daemon):
+            # the stale socket was removed before binding the new one
+            existed.append(os.path.exists(socket_path))
+            with open(socket_path, "w", encoding="utf-8"):
+                pass
+            return mock.DEFAULT
+
+        server_mock.side_effect = _server
+        self.obj.warm = mock.MagicMock()
+        self.obj.serve_forever()
+        self.assertEqual(existed, [False])
+        server_mock.return_value.serve_forever.assert_called_once_with()
+        self.assertFalse(os.path.exists(path))
+
+    @mock.patch("socket.socket")
+    def test_send_request(self, socket_mock):
+        sock = socket_mock.return_value.__enter__.return_value
+        sock.makefile.return_value.__enter__.return_value.readline.return_value = (
+            b'{"ok": true, "result": {}}\n'
+        )
+        res = daemon.send_request("status", socket_path="/tmp/sock")
+        self.assertEqual(res, {"ok": True, "result": {}})
+        sock.connect.assert_called_once_with("/tmp/sock")
+        sent = json.loads(sock.sendall.call_args[0][0].decode("utf-8"))
+        self.assertEqual(sent, {"action": "status", "options": {}})
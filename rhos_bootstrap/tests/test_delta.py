@@ -0,0 +1,117 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import sys
+from unittest import mock
+
+sys.modules["dnf"] = mock.MagicMock()
+sys.modules["dnf.cli.cli"] = mock.MagicMock()
+sys.modules["dnf.cli.progress"] = mock.MagicMock()
+sys.modules["dnf.exceptions"] = mock.MagicMock()
+sys.modules["dnf.logging"] = mock.MagicMock()
+sys.modules["dnf.transaction"] = mock.MagicMock()
+sys.modules["dnf.yum.rpmtrans"] = mock.MagicMock()
+sys.modules["libdnf"] = mock.MagicMock()
+from rhos_bootstrap import delta
+from rhos_bootstrap.utils.dnf import DnfModule
+
+REPOS = {
+    "wallaby": [
+        ("centos8-stream", "highavailability"),
+        ("ceph", "pacific"),
+        ("delorean", "current-tripleo"),
+        ("delorean", "deps"),
+    ],
+    "xena": [
+        ("centos8-stream", "highavailability"),
+        ("centos8-stream", "powertools"),
+        ("delorean", "current-tripleo"),
+        ("delorean", "deps"),
+    ],
+}
+
+MODULES = {
+    "wallaby": [DnfModule("container-tools", "3.0"), DnfModule("virt", "rhel")],
+    "xena": [DnfModule("container-tools", "3.0"), DnfModule("python36", "3.6")],
+}
+
+
+class TestVersionDelta(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.distro = mock.MagicMock()
+        self.distro.get_repo_specs.side_effect = lambda v, ceph: REPOS[v]
+        self.distro.get_modules.side_effect = lambda v: MODULES[v]
+
+    def test_delta(self):
+        obj = delta.VersionDelta(self.distro, "wallaby", "xena", enable_ceph=True)
+        self.assertEqual(
+            obj.repos_added,
+            [
+                ("centos8-stream", "powertools"),
+                ("delorean", "current-tripleo"),
+                ("delorean", "deps"),
+            ],
+        )
+        self.assertEqual(
+            obj.repos_removed,
+            [
+                ("ceph", "pacific"),
+                ("delorean", "current-tripleo"),
+                ("delorean", "deps"),
+            ],
+        )
+        self.assertEqual(obj.repos_kept, [("centos8-stream", "highavailability")])
+        self.assertEqual([m.name for m in obj.modules_added], ["python36"])
+        self.assertEqual([m.name for m in obj.modules_removed], ["virt"])
+        self.assertEqual(obj.modules_switched, [])
+        self.assertTrue(obj.modules_changed)
+        self.assertFalse(obj.scoped_update)
+        self.distro.get_repo_specs.assert_any_call("wallaby", True)
+
+        data = obj.to_dict()
+        self.assertEqual(data["modules"]["enable"], ["python36:3.6"])
+        self.assertEqual(data["modules"]["disable"], ["virt:rhel"])
+        self.assertEqual(
+            data["repos"]["keep"],
+            [{"type": "centos8-stream", "name": "highavailability"}],
+        )
+
+    def test_same_version(self):
+        obj = delta.VersionDelta(self.distro, "xena", "xena")
+        self.assertEqual(obj.repos_added, [])
+        self.assertEqual(obj.repos_removed, [])
+        self.assertFalse(obj.modules_changed)
+        self.assertTrue(obj.scoped_update)
+
+    def test_switched_modules(self):
+        MODULES["16.1"] = [DnfModule("virt", "rhel")]
+        MODULES["16.2"] = [DnfModule("virt", "av")]
+        REPOS["16.1"] = REPOS["16.2"] = []
+        self.addCleanup(MODULES.pop, "16.1")
+        self.addCleanup(MODULES.pop, "16.2")
+        self.addCleanup(REPOS.pop, "16.1")
+        self.addCleanup(REPOS.pop, "16.2")
+        obj = delta.VersionDelta(self.distro, "16.1", "16.2")
+        self.assertEqual(
+            [(o.stream, n.stream) for o, n in obj.modules_switched], [("rhel", "av")]
+        )
+        self.assertEqual(obj.to_dict()["modules"]["switch"], ["virt:rhel -> av"])
+        self.assertFalse(obj.scoped_update)
+
+        self.distro.get_modules.reset_mock()
+        obj = delta.VersionDelta(self.distro, "16.1", "16.2", use_modules=False)
+        self.assertFalse(obj.modules_changed)
+        self.distro.get_modules.assert_not_called()
@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import tempfile
 import yaml
 import unittest
 import sys
@@ -23,8 +25,12 @@ sys.modules["dnf.cli.cli"] = mock.MagicMock()
 sys.modules["dnf.cli.progress"] = mock.MagicMock()
 sys.modules["dnf.exceptions"] = mock.MagicMock()
 sys.modules["dnf.logging"] = mock.MagicMock()
+sys.modules["dnf.transaction"] = mock.MagicMock()
+sys.modules["dnf.yum.rpmtrans"] = mock.MagicMock()
 sys.modules["libdnf"] = mock.MagicMock()
+from rhos_bootstrap import catalog
 from rhos_bootstrap import distribution
+from rhos_bootstrap.utils.mirrors import MirrorConfig
 
 DUMMY_CENTOS_DATA = """
 ---
@@ -145,6 +151,60 @@ class TestDistributionInfo(unittest.TestCase):
             "baz",
         )
 
+    def test_data_sharded(self):
+        dummy_data = yaml.safe_load(DUMMY_RHEL_DATA)
+        with tempfile.TemporaryDirectory() as tmp:
+            catalog.write_catalog(dummy_data, os.path.join(tmp, "rhel"))
+            with mock.patch(
+                "rhos_bootstrap.constants.RHOS_VERSIONS_SEARCH_PATHS", [tmp]
+            ):
+                obj = distribution.DistributionInfo("rhel", "8.2", "Red Hat")
+            self.assertIsInstance(obj.versions, catalog.ShardedVersions)
+            self.assertEqual(obj.distros, dummy_data["distros"])
+            self.assertEqual(obj.list_versions(), ["16.1"])
+            self.assertEqual(obj.get_version_distros("16.1"), ["rhel8.2"])
+            self.assertEqual(obj.get_version("16.1"), dummy_data["versions"]["16.1"])
+            self.assertRaises(exceptions.VersionNotSupported, obj.get_version, "999")
+
+    def test_data_layered(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for name in ["high", "low", "overrides.d"]:
+                paths.append(os.path.join(tmp, name))
+                os.mkdir(paths[-1])
+            with open(os.path.join(paths[1], "rhel.yaml"), "w") as f:
+                f.write(DUMMY_RHEL_DATA)
+            with open(os.path.join(paths[0], "rhel.yaml"), "w") as f:
+                f.write('versions:\n  "16.1":\n    modules:\n      virt: av\n')
+            with open(os.path.join(paths[2], "rhel-internal.yaml"), "w") as f:
+                f.write('versions:\n  "16.1":\n    repos:\n      ansible: [int]\n')
+            with mock.patch.multiple(
+                "rhos_bootstrap.constants",
+                RHOS_VERSIONS_SEARCH_PATHS=paths[:2],
+                RHOS_VERSIONS_OVERRIDES_DIR=paths[2],
+                RHOS_CACHE_DIR=os.path.join(tmp, "cache"),
+            ):
+                obj = distribution.DistributionInfo("rhel", "8.2", "Red Hat")
+            version = obj.get_version("16.1")
+            self.assertEqual(version["modules"]["virt"], "av")
+            self.assertEqual(version["modules"]["python36"], 3.6)
+            self.assertEqual(
+                version["repos"]["ansible"],
+                ["ansible-2.9-for-rhel-8-x86_64-rpms", "int"],
+            )
+            self.assertTrue(
+                os.path.exists(os.path.join(tmp, "cache", "rhel-versions.json"))
+            )
+
+    @mock.patch("rhos_bootstrap.distribution.DistributionInfo._load_data")
+    def test_list_versions(self, load_mock):
+        obj = distribution.DistributionInfo("centos", "8", "CentOS Stream")
+        obj._distro_data = yaml.safe_load(DUMMY_CENTOS_DATA)
+        self.assertEqual(obj.list_versions(), ["master", "wallaby"])
+
+        obj._distro_version_id = "9"
+        self.assertEqual(obj.list_versions(), [])
+
     @mock.patch("rhos_bootstrap.distribution.DistributionInfo._load_data")
     def test_validate_distro(self, load_mock):
         obj = distribution.DistributionInfo("centos", "8", "CentOS Stream")
@@ -208,15 +268,24 @@ class TestDistributionInfo(unittest.TestCase):
         dummy_data = yaml.safe_load(DUMMY_CENTOS_DATA)
         obj = distribution.DistributionInfo("centos", "8", "CentOS Stream")
         obj._distro_data = dummy_data
+        obj._mirrors = MirrorConfig({"rdo": "http://rdo.local"})
 
         obj.construct_repo("centos8-stream", "master", "centos-repo")
-        centos_mock.assert_called_once_with("centos8-stream", "centos-repo")
+        centos_mock.assert_called_once_with(
+            "centos8-stream", "centos-repo", mirror=None
+        )
 
         obj.construct_repo("ceph", "master", "ceph-repo")
-        ceph_mock.assert_called_once_with("centos8-stream", "ceph-repo")
+        ceph_mock.assert_called_once_with("centos8-stream", "ceph-repo", mirror=None)
 
         obj.construct_repo("delorean", "master", "dlrn-repo")
-        dlrn_mock.assert_called_once_with("centos8", "master", "dlrn-repo")
+        dlrn_mock.assert_called_once_with(
+            "centos8",
+            "master",
+            "dlrn-repo",
+            mirror="http://rdo.local",
+            mirrors=obj._mirrors,
+        )
 
         self.assertRaises(
             exceptions.RepositoryNotSupported, obj.construct_repo, "nope", "foo", "bar"
@@ -246,6 +315,17 @@ class TestDistributionInfo(unittest.TestCase):
         res = obj.get_repos("master")
         self.assertEqual(len(res), 3)
 
+    @mock.patch("rhos_bootstrap.distribution.DistributionInfo._load_data")
+    def test_packages(self, load_mock):
+        dummy_data = yaml.safe_load(DUMMY_RHEL_DATA)
+        dummy_data["versions"]["16.1"]["packages"] = {"install": ["ceph-ansible"]}
+        obj = distribution.DistributionInfo("rhel", "8.2", "Red Hat")
+        obj._distro_data = dummy_data
+        self.assertEqual(obj.get_packages("16.1").install, ["ceph-ansible"])
+
+        del dummy_data["versions"]["16.1"]["packages"]
+        self.assertFalse(obj.get_packages("16.1"))
+
     @mock.patch("rhos_bootstrap.utils.dnf.DnfModule")
     @mock.patch("rhos_bootstrap.distribution.DistributionInfo._load_data")
     def test_modules(self, load_mock, mod_mock):
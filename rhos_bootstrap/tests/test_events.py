@@ -0,0 +1,124 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from rhos_bootstrap import events
+
+
+def _read(path):
+    with open(path, "r", encoding="utf-8") as data:
+        return [json.loads(line) for line in data]
+
+
+class TestEventStream(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, "events.jsonl")
+
+    def test_file(self):
+        obj = events.EventStream.open(path=self.path)
+        self.assertTrue(obj)
+        obj.emit("phase_start", phase="repos")
+        obj.emit("change", type="repo", name="baseos", action="configure")
+        obj.close()
+        data = _read(self.path)
+        self.assertEqual([e["event"] for e in data], ["phase_start", "change"])
+        self.assertEqual(data[0]["phase"], "repos")
+        self.assertIn("ts", data[0])
+
+    def test_fd(self):
+        read_fd, write_fd = os.pipe()
+        obj = events.EventStream.open(fd=write_fd)
+        obj.emit("run_start", version="16.2")
+        obj.close()
+        # the descriptor belongs to the caller
+        os.close(write_fd)
+        with os.fdopen(read_fd, "r", encoding="utf-8") as pipe:
+            self.assertEqual(json.loads(pipe.readline())["version"], "16.2")
+
+    def test_fields(self):
+        obj = events.EventStream.open(
+            path=self.path, fields={"installroot": "/srv/root"}
+        )
+        obj.emit("run_start", version="16.2")
+        obj.close()
+        self.assertEqual(_read(self.path)[0]["installroot"], "/srv/root")
+
+    def test_progress(self):
+        obj = events.EventStream.open(path=self.path, progress_interval=60)
+        for done in range(0, 100, 10):
+            obj.progress("download", done, 100)
+        obj.progress("download", 100, 100)
+        obj.progress("transaction_progress", 1, 10)
+        obj.close()
+        self.assertEqual(
+            [(e["event"], e["done"]) for e in _read(self.path)],
+            [("download", 0), ("download", 100), ("transaction_progress", 1)],
+        )
+
+    def test_dropped(self):
+        out = mock.MagicMock()
+        with mock.patch("threading.Thread"):
+            obj = events.EventStream(out, queue_size=2)
+        for _ in range(5):
+            obj.emit("change")
+        self.assertEqual(obj.dropped, 3)
+
+    def test_no_output(self):
+        obj = events.EventStream.open()
+        self.assertFalse(obj)
+        obj.emit("run_start")
+        obj.progress("download", 1, 2)
+        obj.close()
+        self.assertEqual(obj.dropped, 0)
+
+    @mock.patch("rhos_bootstrap.events.CLOSE_TIMEOUT", 0.1)
+    def test_stalled_reader(self):
+        stalled = threading.Event()
+        released = threading.Event()
+        out = mock.MagicMock()
+        out.write.side_effect = lambda _: (stalled.set(), released.wait(5))
+        obj = events.EventStream(out)
+        writer = obj._thread
+        obj.emit("run_start")
+        obj.emit("run_end")
+        self.assertTrue(stalled.wait(5))
+        with self.assertLogs(events.LOG, "WARNING"):
+            obj.close()
+        self.assertFalse(obj)
+        # the writer still owns the file
+        out.close.assert_not_called()
+        released.set()
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+        out.close.assert_called_once_with()
+        # the pending event was dropped
+        self.assertEqual(out.write.call_count, 1)
+
+    def test_write_error(self):
+        out = mock.MagicMock()
+        out.write.side_effect = OSError("broken pipe")
+        obj = events.EventStream(out)
+        obj.emit("run_start")
+        obj.close()
+        self.assertFalse(obj)
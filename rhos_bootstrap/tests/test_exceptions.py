@@ -29,6 +29,10 @@ class TestExceptions(unittest.TestCase):
         obj = ex.RepositoryNotSupported("foo")
         self.assertEqual(str(obj), "Repository foo is unknown")
 
+    def test_repo_unavailable(self):
+        obj = ex.RepositoryUnavailable("https://foo/bar.repo", "timed out")
+        self.assertEqual(str(obj), "Unable to fetch https://foo/bar.repo: timed out")
+
     def test_subscription_manager_config_error(self):
         obj = ex.SubscriptionManagerConfigError()
         self.assertEqual(
@@ -39,3 +43,23 @@ class TestExceptions(unittest.TestCase):
     def test_subscription_manager_failure(self):
         obj = ex.SubscriptionManagerFailure("foo")
         self.assertEqual(str(obj), "Failed running subscription-manager foo")
+
+    def test_package_manifest_invalid(self):
+        obj = ex.PackageManifestInvalid("foo")
+        self.assertEqual(str(obj), "Invalid package manifest: foo")
+
+    def test_staged_transaction_invalid(self):
+        obj = ex.StagedTransactionInvalid("foo")
+        self.assertEqual(str(obj), "Staged transaction can not be used: foo")
+
+    def test_installroots_failed(self):
+        obj = ex.InstallrootsFailed(["/srv/a", "/srv/b"])
+        self.assertEqual(str(obj), "Bootstrap failed for installroots: /srv/a, /srv/b")
+
+    def test_daemon_already_running(self):
+        obj = ex.DaemonAlreadyRunning("/run/foo.sock")
+        self.assertEqual(str(obj), "A daemon is already listening on /run/foo.sock")
+
+    def test_mirror_config_invalid(self):
+        obj = ex.MirrorConfigInvalid("foo")
+        self.assertEqual(str(obj), "Invalid mirror configuration: foo")
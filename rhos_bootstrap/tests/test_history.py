@@ -0,0 +1,132 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+from rhos_bootstrap import history
+
+
+def _result(version="16.2", success=True, **durations):
+    return {
+        "version": version,
+        "distro": "rhel8.4",
+        "success": success,
+        "error": None if success else "failed",
+        "duration": sum(durations.values()),
+        "phases": [
+            {"name": name, "status": "done", "duration": duration}
+            for name, duration in durations.items()
+        ],
+        "transactions": [
+            {"phase": "update", "install": ["a-1"], "upgrade": ["b-2"], "remove": []}
+        ],
+        "counters": {"download_bytes": 1024, "subprocesses": 3, "http_requests": 2},
+    }
+
+
+class TestRunHistory(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.history = history.RunHistory(
+            os.path.join(self.tmp, "db", "history.sqlite")
+        )
+
+    def test_record(self):
+        self.assertEqual(self.history.runs(), [])
+        run_id = self.history.record(_result(repos=1.5), plan_hash="abc", started=10)
+        self.history.record(_result(version="17.0", repos=2.0))
+        runs = self.history.runs(version="16.2")
+        self.assertEqual(len(runs), 1)
+        run = runs[0]
+        self.assertEqual(run["id"], run_id)
+        self.assertEqual(run["plan_hash"], "abc")
+        self.assertEqual(run["started"], 10)
+        self.assertTrue(run["success"])
+        self.assertEqual((run["installed"], run["upgraded"], run["removed"]), (1, 1, 0))
+        self.assertEqual(run["download_bytes"], 1024)
+        self.assertEqual(run["subprocesses"], 3)
+        self.assertEqual(run["http_requests"], 2)
+        self.assertEqual(run["phases"], {"repos": {"status": "done", "duration": 1.5}})
+        self.assertEqual(len(self.history.runs()), 2)
+
+    def test_record_max_runs(self):
+        obj = history.RunHistory(self.history.path, max_runs=2)
+        for duration in (1.0, 2.0, 3.0):
+            obj.record(_result(repos=duration))
+        runs = obj.runs()
+        self.assertEqual([run["duration"] for run in runs], [3.0, 2.0])
+
+    def test_report(self):
+        for duration in (10.0, 11.0, 12.0):
+            self.history.record(_result(repos=duration, modules=1.0))
+        self.history.record(_result(success=False, repos=100.0, modules=1.0))
+        self.history.record(_result(repos=30.0, modules=1.4))
+        report = self.history.report(limit=2)
+        self.assertEqual(len(report["runs"]), 2)
+        repos = report["phases"]["repos"]
+        self.assertEqual(repos["baseline"], 11.0)
+        self.assertEqual(repos["samples"], 3)
+        self.assertEqual((repos["min"], repos["max"]), (10.0, 12.0))
+        self.assertTrue(repos["regressed"])
+        # slower but by less than the minimum delta
+        self.assertFalse(report["phases"]["modules"]["regressed"])
+        self.assertEqual(
+            report["regressions"],
+            [
+                {
+                    "run": report["runs"][0]["id"],
+                    "phase": "repos",
+                    "duration": 30.0,
+                    "baseline": 11.0,
+                }
+            ],
+        )
+
+    def test_report_no_baseline(self):
+        self.history.record(_result(repos=10.0))
+        self.history.record(_result(repos=30.0))
+        report = self.history.report()
+        self.assertIsNone(report["phases"]["repos"]["baseline"])
+        self.assertEqual(report["regressions"], [])
+
+    def test_textfile(self):
+        for duration in (10.0, 11.0, 12.0, 30.0):
+            self.history.record(_result(repos=duration))
+        path = os.path.join(self.tmp, "rhos_bootstrap.prom")
+        history.write_textfile(path, self.history.report(version="16.2"))
+        with open(path, "r", encoding="utf-8") as data:
+            lines = data.read().splitlines()
+        self.assertIn('rhos_bootstrap_history_runs{version="16.2"} 4', lines)
+        self.assertIn(
+            'rhos_bootstrap_last_run_success{distro="rhel8.4",version="16.2"} 1',
+            lines,
+        )
+        self.assertIn(
+            'rhos_bootstrap_phase_duration_seconds{phase="repos"} 30.0', lines
+        )
+        self.assertIn(
+            'rhos_bootstrap_phase_baseline_seconds{phase="repos"} 11.0', lines
+        )
+        self.assertIn('rhos_bootstrap_phase_regressed{phase="repos"} 1', lines)
+        self.assertIn("# TYPE rhos_bootstrap_phase_regressed gauge", lines)
+
+    def test_textfile_empty(self):
+        text = history.textfile(self.history.report())
+        self.assertIn("rhos_bootstrap_history_runs 0", text)
+        self.assertNotIn("last_run", text)
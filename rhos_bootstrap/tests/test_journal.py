@@ -0,0 +1,64 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rhos_bootstrap import journal
+
+
+class TestCheckpointJournal(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, "journal.json")
+
+    def test_plan_key(self):
+        key = journal.plan_key({"version": "16.2"}, {"update_packages": True})
+        self.assertEqual(
+            key, journal.plan_key({"version": "16.2"}, {"update_packages": True})
+        )
+        self.assertNotEqual(
+            key, journal.plan_key({"version": "16.2"}, {"update_packages": False})
+        )
+
+    def test_complete_load(self):
+        obj = journal.CheckpointJournal("abc", self.path)
+        self.assertFalse(obj.done("repos"))
+        obj.complete("repos")
+        obj.complete("repo:baseos")
+        obj.complete("repos")
+        self.assertTrue(obj.done("repos"))
+
+        loaded = journal.CheckpointJournal.load("abc", self.path)
+        self.assertEqual(loaded.steps, ["repos", "repo:baseos"])
+        self.assertEqual(journal.CheckpointJournal.load("def", self.path).steps, [])
+
+    def test_load_missing(self):
+        obj = journal.CheckpointJournal.load("abc", self.path)
+        self.assertEqual(obj.steps, [])
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("{")
+        self.assertEqual(journal.CheckpointJournal.load("abc", self.path).steps, [])
+
+    def test_save_failure(self):
+        obj = journal.CheckpointJournal("abc", os.path.join(self.path, "nope"))
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("")
+        # the run can continue without a journal
+        obj.complete("repos")
+        self.assertTrue(obj.done("repos"))
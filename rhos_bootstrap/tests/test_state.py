@@ -0,0 +1,128 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from rhos_bootstrap import state
+from rhos_bootstrap.utils.repos import RhsmRepo
+
+
+class TestBootstrapState(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.repo_dir = os.path.join(self.tmp, "yum.repos.d")
+        self.modules_dir = os.path.join(self.tmp, "modules.d")
+        os.makedirs(self.repo_dir)
+        os.makedirs(self.modules_dir)
+        self.path = os.path.join(self.tmp, "state.json")
+        self.rhsm_file = os.path.join(self.repo_dir, "redhat.repo")
+        self._write(self.rhsm_file, "[rhel-baseos]\nenabled = 1\n")
+        self._write(os.path.join(self.repo_dir, "delorean.repo"), "[delorean]\n")
+        self._write(
+            os.path.join(self.modules_dir, "virt.module"),
+            "[virt]\nname=virt\nstream=av\nprofiles=\nstate=enabled\n",
+        )
+        installed = mock.patch(
+            "rhos_bootstrap.state.installed_packages",
+            return_value={"python3-tripleoclient": "python3-tripleoclient-1-1"},
+        )
+        self.installed_mock = installed.start()
+        self.addCleanup(installed.stop)
+
+    @staticmethod
+    def _write(path, data):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(data)
+
+    def _record(self):
+        delorean = mock.MagicMock()
+        delorean.name = "delorean"
+        virt = mock.MagicMock(stream="av")
+        virt.name = "virt"
+        with mock.patch("rhos_bootstrap.utils.repos.SubscriptionManager"):
+            rhsm = RhsmRepo("rhel-baseos")
+        obj = state.BootstrapState.from_system(
+            "16.2",
+            "rhel8.4",
+            repos=[rhsm, delorean],
+            modules=[virt],
+            packages=["python3-tripleoclient"],
+            repo_dir=self.repo_dir,
+        )
+        obj.save(self.path)
+        return obj
+
+    def _status(self, version="16.2"):
+        return state.status(
+            version,
+            self.path,
+            repo_dir=self.repo_dir,
+            rhsm_repo_file=self.rhsm_file,
+            modules_dir=self.modules_dir,
+        )
+
+    def test_status(self):
+        obj = self._record()
+        self.assertEqual(obj.repos["rhel-baseos"], {"type": "rhsm"})
+        self.assertEqual(obj.repos["delorean"]["type"], "file")
+        self.assertEqual(oct(os.stat(self.path).st_mode & 0o777), "0o644")
+
+        report = self._status()
+        self.assertTrue(report["ok"])
+        self.assertEqual(report["drift"], [])
+        self.installed_mock.assert_called_once_with(["python3-tripleoclient"])
+
+        report = self._status("17.0")
+        self.assertFalse(report["ok"])
+        self.assertEqual(report["drift"][0]["type"], "version")
+
+    def test_status_drift(self):
+        self._record()
+        self._write(self.rhsm_file, "[rhel-baseos]\nenabled = 0\n")
+        self._write(os.path.join(self.repo_dir, "delorean.repo"), "[changed]\n")
+        self._write(
+            os.path.join(self.modules_dir, "virt.module"),
+            "[virt]\nname=virt\nstream=rhel\nstate=enabled\n",
+        )
+        self.installed_mock.return_value = {"python3-tripleoclient": None}
+        report = self._status()
+        self.assertFalse(report["ok"])
+        self.assertEqual(
+            [(d["type"], d["name"], d["actual"]) for d in report["drift"]],
+            [
+                ("repo", "delorean", mock.ANY),
+                ("repo", "rhel-baseos", "disabled"),
+                ("module", "virt", "rhel"),
+                ("package", "python3-tripleoclient", "not installed"),
+            ],
+        )
+
+        os.unlink(os.path.join(self.repo_dir, "delorean.repo"))
+        os.unlink(os.path.join(self.modules_dir, "virt.module"))
+        drift = self._status()["drift"]
+        self.assertEqual(drift[0]["actual"], "missing")
+        self.assertEqual(drift[2]["actual"], "not enabled")
+
+    def test_status_not_bootstrapped(self):
+        report = self._status()
+        self.assertFalse(report["ok"])
+        self.assertEqual(report["drift"][0]["type"], "state")
+        self._write(self.path, "{")
+        self.assertFalse(self._status()["ok"])
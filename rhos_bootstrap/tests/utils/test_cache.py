@@ -0,0 +1,164 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import fcntl
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from rhos_bootstrap.utils import cache
+
+
+def _write(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as out:
+        out.write(b"x" * size)
+
+
+class TestSharedCache(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "cache")
+
+    @mock.patch("fcntl.lockf")
+    def test_lock(self, lockf_mock):
+        obj = cache.SharedCache(self.path)
+        with obj.lock():
+            with obj.lock():
+                self.assertEqual(lockf_mock.call_count, 1)
+            self.assertEqual(lockf_mock.call_count, 1)
+        self.assertEqual(lockf_mock.call_count, 2)
+        self.assertTrue(os.path.exists(os.path.join(self.path, cache.LOCK_FILE)))
+
+    @mock.patch("fcntl.lockf")
+    def test_hold(self, lockf_mock):
+        obj = cache.SharedCache(self.path)
+        with obj.hold(read=["b", "a"], write=["c"]):
+            pass
+        names = [
+            os.path.basename(c[0][0].name)
+            for c in lockf_mock.call_args_list
+            if c[0][1] != fcntl.LOCK_UN
+        ]
+        modes = [c[0][1] for c in lockf_mock.call_args_list if c[0][1] != fcntl.LOCK_UN]
+        self.assertEqual(
+            names,
+            [
+                cache.LOCK_FILE,
+                ".rhos-bootstrap-a.lock",
+                ".rhos-bootstrap-b.lock",
+                ".rhos-bootstrap-c.lock",
+            ],
+        )
+        self.assertEqual(
+            modes, [fcntl.LOCK_SH, fcntl.LOCK_SH, fcntl.LOCK_SH, fcntl.LOCK_EX]
+        )
+
+    def test_lock_upgrade(self):
+        obj = cache.SharedCache(self.path)
+        order = []
+
+        def _write_repo():
+            with obj.lock("repo"):
+                order.append("write")
+
+        with obj.lock("repo", shared=True):
+            writer = threading.Thread(target=_write_repo)
+            writer.start()
+            writer.join(0.2)
+            # the exclusive lock waits for the shared holders
+            self.assertTrue(writer.is_alive())
+            order.append("read")
+        writer.join()
+        self.assertEqual(order, ["read", "write"])
+
+    def test_refresh_metadata(self):
+        obj = cache.SharedCache(self.path)
+        fresh = mock.MagicMock(id="fresh")
+        fresh._repo.isExpired.return_value = False
+        expired = mock.MagicMock(id="expired")
+        expired._repo.isExpired.return_value = True
+        obj.refresh_metadata([fresh, expired])
+        fresh.load.assert_not_called()
+        expired.load.assert_called_once_with()
+
+    def test_check_packages(self):
+        obj = cache.SharedCache(self.path)
+        good = mock.MagicMock()
+        good.localPkg.return_value = os.path.join(self.path, "good.rpm")
+        good.verifyLocalPkg.return_value = True
+        bad = mock.MagicMock()
+        bad.localPkg.return_value = os.path.join(self.path, "bad.rpm")
+        bad.verifyLocalPkg.return_value = False
+        missing = mock.MagicMock()
+        missing.localPkg.return_value = os.path.join(self.path, "missing.rpm")
+        _write(good.localPkg(), 1)
+        _write(bad.localPkg(), 1)
+        obj.check_packages([good, bad, missing])
+        self.assertEqual(obj.stats()["packages"], {"hits": 1, "misses": 2})
+        self.assertFalse(os.path.exists(bad.localPkg()))
+        self.assertTrue(os.path.exists(good.localPkg()))
+
+        obj.reset_stats()
+        self.assertEqual(obj.stats()["packages"], {"hits": 0, "misses": 0})
+
+    def test_metadata(self):
+        obj = cache.SharedCache(self.path)
+        cached = mock.MagicMock(id="cached")
+        cached._repo.getCachedir.return_value = os.path.join(self.path, "cached")
+        fetched = mock.MagicMock(id="fetched")
+        fetched._repo.getCachedir.return_value = os.path.join(self.path, "fetched")
+        _write(os.path.join(self.path, "cached", "repodata", "repomd.xml"), 1)
+        snapshot = obj.metadata_snapshot([cached, fetched])
+        _write(os.path.join(self.path, "fetched", "repodata", "repomd.xml"), 1)
+        obj.record_metadata(snapshot, [cached, fetched])
+        self.assertEqual(obj.stats()["metadata"], {"hits": 1, "misses": 1})
+
+    def test_evict(self):
+        obj = cache.SharedCache(self.path, max_size_mb=1)
+        half = 512 * 1024
+        for i, name in enumerate(["old", "used", "new"]):
+            path = os.path.join(self.path, "repo", "packages", f"{name}.rpm")
+            _write(path, half)
+            os.utime(path, ns=(i, i))
+        _write(os.path.join(self.path, "repo", "repodata", "primary.xml"), 10)
+        kept = os.path.join(self.path, "repo", "packages", "old.rpm")
+        self.assertEqual(obj.evict(keep={kept}), 2)
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.path, "repo", "packages"))),
+            ["old.rpm"],
+        )
+        self.assertEqual(obj.stats()["evicted"], 2)
+        self.assertEqual(obj.evict(), 0)
+
+    def test_evict_in_use(self):
+        obj = cache.SharedCache(self.path, max_size_mb=1)
+        for name in ["old", "new"]:
+            _write(os.path.join(self.path, "repo", "packages", f"{name}.rpm"), 1048576)
+        # used by another thread
+        with obj.lock(shared=True):
+            self.assertEqual(obj.evict(), 0)
+        # used by another system
+        busy = OSError(errno.EAGAIN, "busy")
+        with mock.patch("fcntl.lockf", side_effect=busy):
+            self.assertEqual(obj.evict(), 0)
+        self.assertEqual(
+            len(os.listdir(os.path.join(self.path, "repo", "packages"))), 2
+        )
+        self.assertEqual(obj.evict(), 1)
@@ -0,0 +1,31 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from rhos_bootstrap.utils import counters
+
+
+class TestCounters(unittest.TestCase):
+    def test_counters(self):
+        counters.reset()
+        counters.count(counters.SUBPROCESSES)
+        counters.count(counters.SUBPROCESSES)
+        counters.count(counters.DOWNLOAD_BYTES, 2048)
+        self.assertEqual(
+            counters.snapshot(),
+            {"subprocesses": 2, "http_requests": 0, "download_bytes": 2048},
+        )
+        counters.reset()
+        self.assertEqual(sum(counters.snapshot().values()), 0)
@@ -12,6 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import multiprocessing
+import os
+import tempfile
 import unittest
 import sys
 from unittest import mock
@@ -24,9 +27,40 @@ sys.modules["dnf.logging"] = mock.MagicMock()
 sys.modules["dnf.transaction"] = mock.MagicMock()
 sys.modules["dnf.yum.rpmtrans"] = mock.MagicMock()
 sys.modules["libdnf"] = mock.MagicMock()
+from rhos_bootstrap import exceptions
 from rhos_bootstrap.utils import dnf
 
 
+def _pkg(name, nevra=None):
+    pkg = mock.MagicMock()
+    pkg.name = name
+    pkg.__str__.return_value = nevra or f"{name}-1-1.noarch"
+    return pkg
+
+
+class _DnfError(Exception):
+    pass
+
+
+def _transaction(install=(), upgrade=(), remove=(), replaced=()):
+    actions = dnf.dnf.transaction
+    items = [
+        mock.MagicMock(action=action, pkg=pkg)
+        for action, pkgs in (
+            (actions.PKG_INSTALL, install),
+            (actions.PKG_UPGRADE, upgrade),
+            (actions.PKG_REMOVE, remove),
+            (actions.PKG_UPGRADED, replaced),
+        )
+        for pkg in pkgs
+    ]
+    transaction = mock.MagicMock()
+    transaction.__iter__.side_effect = lambda: iter(items)
+    transaction.install_set = list(install) + list(upgrade)
+    transaction.remove_set = list(remove) + list(replaced)
+    return transaction
+
+
 class TestDnfManager(unittest.TestCase):
     @mock.patch("rhos_bootstrap.utils.dnf.DnfManager.setup")
     def test_instance(self, setup_mock):
@@ -34,6 +68,719 @@ class TestDnfManager(unittest.TestCase):
         self.assertIsInstance(obj, dnf.DnfManager)
 
         self.assertRaises(RuntimeError, dnf.DnfManager)
+        self.assertTrue(dnf.DnfManager.loaded())
+
+    def test_unload(self):
+        instance = mock.MagicMock()
+        dnf.DnfManager._instance = instance
+        dnf.DnfManager.unload()
+        instance.dnf_base.close.assert_called_once_with()
+        self.assertFalse(dnf.DnfManager.loaded())
+
+    @mock.patch("rhos_bootstrap.utils.dnf.DnfManager.setup")
+    def test_instance_installroot(self, setup_mock):
+        host = mock.MagicMock(installroot=None)
+        dnf.DnfManager._instance = host
+        self.assertTrue(dnf.DnfManager.loaded_for(None))
+        self.assertFalse(dnf.DnfManager.loaded_for("/srv/root"))
+        self.assertIs(dnf.DnfManager.instance(), host)
+        self.assertIs(dnf.DnfManager.instance(installroot=None), host)
+        setup_mock.assert_not_called()
+        # a manager loaded for another root is closed and replaced
+        obj = dnf.DnfManager.instance(installroot="/srv/root")
+        self.assertIsNot(obj, host)
+        host.dnf_base.close.assert_called_once_with()
+        setup_mock.assert_called_once_with(installroot="/srv/root")
+        dnf.DnfManager.reset()
+
+    def test_reset(self):
+        dnf.DnfManager._instance = mock.MagicMock()
+        dnf.DnfManager.reset()
+        self.assertFalse(dnf.DnfManager.loaded())
+
+    @mock.patch("rhos_bootstrap.utils.dnf.Cli")
+    def test_setup_installroot(self, cli_mock):
+        obj = dnf.DnfManager.__new__(dnf.DnfManager)
+        with mock.patch.object(obj, "_update_modules"):
+            obj.setup(installroot="/srv/root")
+        self.assertEqual(obj.installroot, "/srv/root")
+        self.assertEqual(obj.dnf_base.conf.installroot, "/srv/root")
+        self.assertEqual(obj.dnf_base.conf.reposdir, ["/etc/yum.repos.d"])
+        cli_mock.return_value._read_conf_file.assert_called_once_with("/")
+
+    def test_installroot_path(self):
+        self.assertEqual(
+            dnf.installroot_path(None, "/var/lib/foo.json"), "/var/lib/foo.json"
+        )
+        self.assertEqual(
+            dnf.installroot_path("/srv/root", "/var/lib/foo.json"),
+            "/srv/root/var/lib/foo.json",
+        )
+
+    def test_refresh(self):
+        obj = dnf.DnfManager.__new__(dnf.DnfManager)
+        obj.dnf_base = mock.MagicMock()
+        prefetcher = mock.MagicMock()
+        with mock.patch.object(obj, "_update_modules") as update_mock:
+            obj.refresh(prefetcher=prefetcher)
+            update_mock.assert_called_once_with()
+        obj.dnf_base.reset.assert_called_once_with(sack=True, repos=True)
+        obj.dnf_base.read_all_repos.assert_called_once_with()
+        prefetcher.wait.assert_called_once_with()
+
+    def test_use_shared_cache(self):
+        obj = dnf.DnfManager.__new__(dnf.DnfManager)
+        obj.dnf_base = mock.MagicMock()
+        conf = obj.dnf_base.conf
+        conf.cachedir = "/var/cache/dnf"
+        conf.system_cachedir = "/var/cache/dnf"
+        conf.keepcache = False
+        shared_cache = mock.MagicMock(path="/srv/cache")
+        obj.use_shared_cache(shared_cache)
+        self.assertEqual(conf.cachedir, "/srv/cache")
+        self.assertEqual(conf.system_cachedir, "/srv/cache")
+        self.assertTrue(conf.keepcache)
+        self.assertIs(obj.shared_cache, shared_cache)
+
+        with mock.patch.object(obj, "_update_modules"):
+            obj.refresh()
+        self.assertEqual(conf.cachedir, "/srv/cache")
+
+        obj.use_shared_cache(None)
+        self.assertEqual(conf.cachedir, "/var/cache/dnf")
+        self.assertFalse(conf.keepcache)
+
+    def test_use_throttle(self):
+        obj = dnf.DnfManager.__new__(dnf.DnfManager)
+        obj.dnf_base = mock.MagicMock()
+        obj.dnf_base.conf.max_parallel_downloads = 3
+        obj.use_throttle(1024)
+        self.assertEqual(obj.throttle, 1024)
+        # every one of the 3 parallel transfers is throttled
+        self.assertEqual(obj.dnf_base.conf.throttle, 341)
+        self.assertEqual(obj.download_rate, 1023)
+        obj.use_throttle(0)
+        self.assertEqual(obj.dnf_base.conf.throttle, 0)
+        self.assertEqual(obj.download_rate, 0)
+
+    def test_use_repo_scope(self):
+        obj = dnf.DnfManager.__new__(dnf.DnfManager)
+        obj.dnf_base = mock.MagicMock()
+        obj.dnf_base.conf.optional_metadata_types = ["comps", "filelists"]
+        obj.use_repo_scope(["baseos"], skip_filelists=True)
+        self.assertEqual(obj.repo_scope, {"baseos"})
+        self.assertEqual(obj.dnf_base.conf.optional_metadata_types, ["comps"])
+        baseos = mock.MagicMock(id="baseos")
+        other = mock.MagicMock(id="other")
+        obj.dnf_base.repos.iter_enabled.return_value = [baseos, other]
+        obj._scope_repos()
+        baseos.disable.assert_not_called()
+        other.disable.assert_called_once_with()
+
+        obj.shared_cache = None
+        obj.dnf_base.sack.__len__.return_value = 42
+        with mock.patch.object(obj, "get_all_modules", return_value=[]):
+            obj._update_modules()
+        self.assertEqual(obj.sack_stats["solvables"], 42)
+        self.assertEqual(obj.sack_stats["repos"], 2)
+        self.assertTrue(obj.sack_stats["scoped"])
+        self.assertFalse(obj.sack_stats["filelists"])
+
+        obj.use_repo_scope()
+        self.assertIsNone(obj.repo_scope)
+        self.assertEqual(
+            obj.dnf_base.conf.optional_metadata_types, ["comps", "filelists"]
+        )
+        other.disable.reset_mock()
+        obj._scope_repos()
+        other.disable.assert_not_called()
+
+    def test_use_plugin_profiler(self):
+        obj = dnf.DnfManager.__new__(dnf.DnfManager)
+        obj.dnf_base = mock.MagicMock()
+        plugin = mock.MagicMock()
+        obj.dnf_base._plugins.plugins = [plugin]
+        profiler = mock.MagicMock()
+        obj.use_plugin_profiler(profiler)
+        self.assertIs(obj.plugin_profiler, profiler)
+        profiler.instrument.assert_called_once_with([plugin])
+
+    def test_process_packages_shared_cache(self):
+        obj = dnf.DnfManager.__new__(dnf.DnfManager)
+        obj.dnf_base = mock.MagicMock()
+        del obj.dnf_base.package_signature_check
+        pkg = _pkg("foo")
+        pkg.localPkg.return_value = "/srv/cache/foo.rpm"
+        pkg.repoid = "repo"
+        obj.dnf_base.transaction.install_set = [pkg]
+        obj.shared_cache = mock.MagicMock()
+        obj._process_packages()
+        # only the repository of the missing package is locked exclusively
+        self.assertEqual(
+            obj.shared_cache.hold.call_args_list,
+            [mock.call(read=(), write=()), mock.call(read=(), write={"repo"})],
+        )
+        obj.shared_cache.check_packages.assert_called_once_with([pkg])
+        obj.dnf_base.download_packages.assert_called_once()
+        obj.shared_cache.evict.assert_called_once_with(keep={"/srv/cache/foo.rpm"})
+
+    def test_process_packages_events(self):
+        obj = dnf.DnfManager.__new__(dnf.DnfManager)
+        obj.dnf_base = mock.MagicMock()
+        del obj.dnf_base.package_signature_check
+        obj.shared_cache = None
+        obj.events = mock.MagicMock()
+        obj._process_packages()
+        progress = obj.dnf_base.download_packages.call_args[0][1]
+        self.assertIsInstance(progress, dnf.DownloadProgressEvents)
+
+    def test_transaction_summary(self):
+        obj = dnf.DnfManager.__new__(dnf.DnfManager)
+        obj.dnf_base = mock.MagicMock()
+        obj.dnf_base.transaction = None
+        self.assertEqual(
+            obj.transaction_summary(), {"install": [], "upgrade": [], "remove": []}
+        )
+
+        obj.dnf_base.transaction = _transaction(
+            install=[
+                _pkg("bar", "bar-1-1.noarch"),
+                _pkg("kernel", "kernel-5-1.x86_64"),
+            ],
+            upgrade=[
+                _pkg("glibc", "glibc-2-1.x86_64"),
+                _pkg("glibc", "glibc-2-1.i686"),
+            ],
+            remove=[
+                _pkg("baz", "baz-1-1.noarch"),
+                _pkg("kernel", "kernel-4-1.x86_64"),
+            ],
+            replaced=[
+                _pkg("glibc", "glibc-1-1.x86_64"),
+                _pkg("glibc", "glibc-1-1.i686"),
+            ],
+        )
+        # multilib pairs and installonly packages are kept apart
+        self.assertEqual(
+            obj.transaction_summary(),
+            {
+                "install": ["bar-1-1.noarch", "kernel-5-1.x86_64"],
+                "upgrade": ["glibc-2-1.i686", "glibc-2-1.x86_64"],
+                "remove": ["baz-1-1.noarch", "kernel-4-1.x86_64"],
+            },
+        )
+
+        # a new kernel is installed, not upgraded
+        manifest = dnf.PackageManifest(install=["kernel"], upgrade=["glibc"])
+        with mock.patch.object(obj, "_process_packages"):
+            with mock.patch.object(obj, "_commit"):
+                res = obj.apply_manifest(manifest)
+        self.assertEqual(res["packages"], {"kernel": "installed", "glibc": "upgraded"})
+
+    @mock.patch("rhos_bootstrap.utils.dnf.MarkingError", Exception)
+    def test_apply_manifest(self):
+        obj = dnf.DnfManager.__new__(dnf.DnfManager)
+        obj.dnf_base = mock.MagicMock()
+        obj.dnf_base.transaction = _transaction(
+            install=[_pkg("foo")],
+            upgrade=[_pkg("bar", "bar-2-1.noarch")],
+            remove=[_pkg("baz")],
+            replaced=[_pkg("bar")],
+        )
+
+        def _install(name):
+            if name == "missing":
+                raise Exception("no match")
+
+        obj.dnf_base.install.side_effect = _install
+        manifest = dnf.PackageManifest(
+            install=["foo", "missing", "other"], upgrade=["ba?"], remove=["baz"]
+        )
+        with mock.patch.object(obj, "_process_packages") as process_mock:
+            with mock.patch.object(obj, "_commit") as commit_mock:
+                commit_mock.return_value = {"install": ["foo-1-1.noarch"]}
+                res = obj.apply_manifest(manifest)
+                process_mock.assert_called_once_with()
+                commit_mock.assert_called_once_with()
+        self.assertEqual(
+            res["packages"],
+            {
+                "foo": "installed",
+                "missing": "not-found",
+                "other": "unchanged",
+                "ba?": "upgraded",
+                "baz": "removed",
+            },
+        )
+        self.assertEqual(res["transaction"], {"install": ["foo-1-1.noarch"]})
+        obj.dnf_base.upgrade.assert_any_call("ba?")
+        obj.dnf_base.remove.assert_called_once_with("baz")
+        self.assertIsNone(obj.dnf_base.cmds)
+
+        # nothing to do does not commit
+        obj.dnf_base.transaction = _transaction()
+        with mock.patch.object(obj, "_process_packages"):
+            with mock.patch.object(obj, "_commit") as commit_mock:
+                res = obj.apply_manifest(dnf.PackageManifest(upgrade=["foo"]))
+                commit_mock.assert_not_called()
+        self.assertEqual(res["packages"], {"foo": "unchanged"})
+
+    def test_apply_manifest_staged(self):
+        obj = dnf.DnfManager.__new__(dnf.DnfManager)
+        obj.dnf_base = mock.MagicMock()
+        obj.dnf_base.transaction = _transaction(install=[_pkg("foo")])
+        manifest = dnf.PackageManifest(install=["foo"])
+        summary = {"install": ["foo-1-1.noarch"], "upgrade": [], "remove": []}
+        with mock.patch.object(obj, "_process_packages"):
+            with mock.patch.object(obj, "_commit") as commit_mock:
+                res = obj.apply_manifest(manifest, download_only=True)
+                commit_mock.assert_not_called()
+                self.assertEqual(res["transaction"], summary)
+                obj.dnf_base.reset.assert_called_once_with(goal=True)
+
+                obj.dnf_base.reset.reset_mock()
+                self.assertRaises(
+                    exceptions.StagedTransactionInvalid,
+                    obj.apply_manifest,
+                    manifest,
+                    expected={"install": [], "upgrade": [], "remove": []},
+                )
+                commit_mock.assert_not_called()
+                obj.dnf_base.reset.assert_called_once_with(goal=True)
+
+                obj.apply_manifest(manifest, expected=summary)
+                commit_mock.assert_called_once_with()
+
+    @mock.patch("rhos_bootstrap.utils.dnf.MarkingError", Exception)
+    def test_apply_resolved(self):
+        obj = dnf.DnfManager.__new__(dnf.DnfManager)
+        obj.dnf_base = mock.MagicMock()
+        obj.dnf_base.transaction = _transaction(
+            install=[_pkg("bar", "bar-1-1.noarch")],
+            upgrade=[_pkg("foo", "foo-2-1.noarch")],
+            replaced=[_pkg("foo", "foo-1-1.noarch")],
+        )
+        summary = {
+            "install": ["bar-1-1.noarch"],
+            "upgrade": ["foo-2-1.noarch"],
+            "remove": [],
+        }
+        with mock.patch.object(obj, "_process_packages"):
+            with mock.patch.object(obj, "_commit") as commit_mock:
+                commit_mock.return_value = summary
+                self.assertEqual(obj.apply_resolved(summary), summary)
+                commit_mock.assert_called_once_with()
+                obj.dnf_base.install.assert_has_calls(
+                    [
+                        mock.call("bar-1-1.noarch", strict=True),
+                        mock.call("foo-2-1.noarch", strict=True),
+                    ]
+                )
+
+                commit_mock.reset_mock()
+                self.assertRaises(
+                    exceptions.StagedTransactionInvalid,
+                    obj.apply_resolved,
+                    dict(summary, remove=["baz-1-1.noarch"]),
+                )
+                commit_mock.assert_not_called()
+                obj.dnf_base.reset.assert_called_with(goal=True)
+
+                obj.dnf_base.install.side_effect = Exception("missing")
+                self.assertRaises(
+                    exceptions.StagedTransactionInvalid, obj.apply_resolved, summary
+                )
+                commit_mock.assert_not_called()
+
+    def test_system_state(self):
+        obj = dnf.DnfManager.__new__(dnf.DnfManager)
+        obj.dnf_base = mock.MagicMock()
+        obj.dnf_base.sack._rpmdb_version.return_value = "10:abc"
+        obj.enabled_modules = {"virt": {"stream": "av"}}
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, "repodata"))
+            with open(os.path.join(tmp, "repodata", "repomd.xml"), "wb") as out:
+                out.write(b"repomd")
+            repo = mock.MagicMock()
+            repo.id = "baseos"
+            repo._repo.getCachedir.return_value = tmp
+            missing = mock.MagicMock()
+            missing.id = "appstream"
+            missing._repo.getCachedir.return_value = os.path.join(tmp, "missing")
+            obj.dnf_base.repos.iter_enabled.return_value = [repo, missing]
+            state = obj.system_state()
+        self.assertEqual(state["rpmdb"], "10:abc")
+        self.assertEqual(state["modules"], {"virt": "av"})
+        self.assertEqual(len(state["repos"]["baseos"]), 64)
+        self.assertIsNone(state["repos"]["appstream"])
+
+    @mock.patch("rhos_bootstrap.utils.dnf.DnfError", _DnfError)
+    @mock.patch("rhos_bootstrap.utils.dnf.memory")
+    def test_update_batched(self, memory_mock):
+        obj = dnf.DnfManager.__new__(dnf.DnfManager)
+        obj.dnf_base = mock.MagicMock()
+        memory_mock.rss_mb.return_value = 100
+        memory_mock.peak_rss_mb.side_effect = [900, 300, 300, 300]
+        pkgs = {name: _pkg(name) for name in "abcde"}
+        for name, pkg in pkgs.items():
+            pkg.reponame = "appstream" if name in "de" else "baseos"
+        query = obj.dnf_base.sack.query.return_value
+        query.upgrades.return_value.latest.return_value = [
+            pkgs[name] for name in "abcd"
+        ]
+        # e obsoletes an installed package
+        query.available.return_value.filter.return_value.latest.return_value = [
+            pkgs["e"]
+        ]
+        # b pulls d in again, c does not pass the transaction check
+        changed = [
+            {"d.noarch", "e.noarch", "old-e.noarch"},
+            {"a.noarch"},
+            {"b.noarch", "d.noarch"},
+            {"b.noarch", "d.noarch"},
+            {"c.noarch"},
+        ]
+        with mock.patch.object(
+            obj, "_process_packages", side_effect=[None] * 4 + [_DnfError(), None]
+        ):
+            with mock.patch.object(obj, "_changed_packages", side_effect=changed):
+                with mock.patch.object(obj, "_update_modules") as update_mock:
+                    with mock.patch.object(obj, "_commit") as commit_mock:
+                        commit_mock.return_value = {"upgrade": []}
+                        batches = obj.update_batched(500, batch_size=2)
+        self.assertEqual(
+            [(b["repo"], b["packages"], b["peak_rss_mb"]) for b in batches],
+            [
+                ("appstream", ["d-1-1.noarch", "e-1-1.noarch"], 900),
+                ("baseos", ["a-1-1.noarch"], 300),
+                ("baseos", ["b-1-1.noarch"], 300),
+                ("baseos", ["c-1-1.noarch"], 300),
+            ],
+        )
+        obj.dnf_base.package_install.assert_called_once_with(pkgs["e"])
+        obj.dnf_base.package_upgrade.assert_any_call(pkgs["d"])
+        self.assertEqual(memory_mock.reset_peak_rss.call_count, 6)
+        commit_mock.assert_called_with(refresh=False)
+        self.assertEqual(commit_mock.call_count, 4)
+        # the sack is only reloaded for b, c and after the update
+        self.assertEqual(update_mock.call_count, 3)
+
+        # a batch that fails on a fresh sack is not retried
+        obj.dnf_base.reset_mock()
+        with mock.patch.object(obj, "_process_packages", side_effect=_DnfError()):
+            self.assertRaises(_DnfError, obj.update_batched, 500)
+
+    def test_upgradable_packages(self):
+        obj = dnf.DnfManager.__new__(dnf.DnfManager)
+        obj.dnf_base = mock.MagicMock()
+        query = obj.dnf_base.sack.query.return_value.available.return_value
+        query.filter.return_value.upgrades.return_value = [
+            _pkg("foo"),
+            _pkg("bar"),
+            _pkg("foo", "foo-2-1.noarch"),
+        ]
+        self.assertEqual(obj.upgradable_packages(("repo1",)), ["bar", "foo"])
+        query.filter.assert_called_once_with(reponame=["repo1"])
+
+
+class TestDownloadProgressEvents(unittest.TestCase):
+    def test_progress(self):
+        meter = mock.MagicMock()
+        events = mock.MagicMock()
+        obj = dnf.DownloadProgressEvents(meter, events)
+        foo = mock.MagicMock(download_size=100)
+        bar = mock.MagicMock(download_size=300)
+        obj.start(2, 400, 0)
+        obj.progress(foo, 50)
+        obj.progress(bar, 100)
+        obj.end(foo, 0, None)
+        meter.start.assert_called_once_with(2, 400, 0)
+        meter.progress.assert_called_with(bar, 100)
+        meter.end.assert_called_once_with(foo, 0, None)
+        events.progress.assert_called_with("download", 200, 400, files=1, total_files=2)
+
+
+@mock.patch("rhos_bootstrap.utils.dnf.DnfError", _DnfError)
+class TestDryRunResolver(unittest.TestCase):
+    @mock.patch("rhos_bootstrap.utils.dnf.Cli")
+    def test_setup(self, cli_mock):
+        obj = dnf.DryRunResolver("/tmp/repos", shared_cache=mock.MagicMock())
+        with mock.patch("rhos_bootstrap.utils.dnf.dnf.Base"):
+            self.assertTrue(obj.setup())
+        self.assertEqual(obj.dnf_base.conf.reposdir, ["/tmp/repos"])
+        repos = list(obj.dnf_base.repos.iter_enabled())
+        obj._shared_cache.refresh_metadata.assert_called_once_with(repos)
+        obj._shared_cache.hold.assert_called_once_with(read=[repo.id for repo in repos])
+        obj.dnf_base.fill_sack.assert_called_once_with()
+        obj.dnf_base.init_plugins.assert_not_called()
+
+        obj = dnf.DryRunResolver("/tmp/repos")
+        with mock.patch("rhos_bootstrap.utils.dnf.dnf.Base") as base_mock:
+            base_mock.return_value.fill_sack.side_effect = _DnfError("offline")
+            self.assertFalse(obj.setup())
+        self.assertEqual(obj.problems, ["Unable to load the repositories: offline"])
+        obj.close()
+        base_mock.return_value.close.assert_called_once_with()
+
+    def test_switch_modules(self):
+        obj = dnf.DryRunResolver("/tmp/repos")
+        obj.module_base = mock.MagicMock()
+        obj.module_base.enable.side_effect = [None, _DnfError("conflict")]
+        obj.switch_modules(
+            [dnf.DnfModule("virt", "av"), dnf.DnfModule("container-tools", "3.0")],
+            disable=[dnf.DnfModule("python36", "3.6")],
+        )
+        obj.module_base.disable.assert_called_once_with(["python36"])
+        obj.module_base.reset.assert_any_call(["virt"])
+        obj.module_base.enable.assert_any_call(["virt:av"])
+        self.assertEqual(
+            obj.problems, ["Unable to enable container-tools:3.0: conflict"]
+        )
+
+    def test_resolve(self):
+        obj = dnf.DryRunResolver("/tmp/repos")
+        obj.dnf_base = mock.MagicMock()
+        foo = _pkg("foo", "foo-2-1.noarch")
+        foo.downloadsize = 100
+        foo.localPkg.return_value = "/nonexistent/foo.rpm"
+        obj.dnf_base.transaction = _transaction(upgrade=[foo], replaced=[_pkg("foo")])
+        manifest = dnf.PackageManifest(upgrade=["*"], install=["foo"])
+        res = obj.resolve(manifest)
+        obj.dnf_base.resolve.assert_called_once_with(allow_erasing=True)
+        obj.dnf_base.do_transaction.assert_not_called()
+        self.assertEqual(
+            res["transaction"],
+            {"install": [], "upgrade": ["foo-2-1.noarch"], "remove": []},
+        )
+        self.assertEqual(res["packages"]["foo"], "upgraded")
+        self.assertEqual(res["download_size"], 100)
+        self.assertEqual(obj.problems, [])
+
+        obj.dnf_base.resolve.side_effect = _DnfError("nothing provides bar")
+        res = obj.resolve(manifest)
+        self.assertIsNone(res["transaction"])
+        self.assertEqual(
+            obj.problems, ["Unable to resolve the transaction: nothing provides bar"]
+        )
+
+
+class TestPackageSignatureVerifier(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.cache_file = os.path.join(self.tmp, "state", "verified.json")
+        self.base = mock.MagicMock()
+        self.base.conf.installroot = "/"
+        self.base.repos = {
+            "signed": mock.MagicMock(gpgcheck=True, gpgkey=["file:///key"]),
+            "nokey": mock.MagicMock(gpgcheck=True, gpgkey=[]),
+            "unchecked": mock.MagicMock(gpgcheck=False, gpgkey=[]),
+        }
+
+    def _pkg(self, name, repo_id):
+        pkg = _pkg(name)
+        pkg.repoid = repo_id
+        pkg._from_cmdline = False
+        path = os.path.join(self.tmp, f"{name}.rpm")
+        with open(path, "w", encoding="utf-8") as out:
+            out.write(name)
+        pkg.localPkg.return_value = path
+        pkg.returnIdSum.return_value = ("sha256", f"{name}-1")
+        return pkg
+
+    @mock.patch("rhos_bootstrap.utils.dnf._check_signature")
+    def test_verify(self, check_mock):
+        foo = self._pkg("foo", "signed")
+        bar = self._pkg("bar", "signed")
+        baz = self._pkg("baz", "unchecked")
+        # bar needs the repository key
+        results = {foo.localPkg(): [0], bar.localPkg(): [1, 0]}
+        check_mock.side_effect = lambda root, path: results[path].pop(0)
+        obj = dnf.PackageSignatureVerifier(
+            self.base, workers=1, cache_file=self.cache_file
+        )
+        obj.verify([foo, bar, baz])
+        self.base.package_import_key.assert_called_once_with(bar, fullaskcb=mock.ANY)
+        self.assertEqual(check_mock.call_count, 3)
+
+        # unchanged packages are not verified again
+        check_mock.reset_mock()
+        obj.verify([foo, bar])
+        check_mock.assert_not_called()
+        # another build in the same file, same size and mtime
+        stat = os.stat(foo.localPkg())
+        with open(foo.localPkg(), "w", encoding="utf-8") as out:
+            out.write("fox")
+        os.utime(foo.localPkg(), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        foo.returnIdSum.return_value = ("sha256", "foo-2")
+        check_mock.side_effect = None
+        check_mock.return_value = 0
+        obj.verify([foo, bar])
+        check_mock.assert_called_once_with("/", foo.localPkg())
+
+    @mock.patch("rhos_bootstrap.utils.dnf._check_signature")
+    def test_verify_errors(self, check_mock):
+        pkgs = [
+            self._pkg("foo", "signed"),
+            self._pkg("bar", "nokey"),
+            self._pkg("baz", "signed"),
+        ]
+        results = {
+            pkgs[0].localPkg(): 4,
+            pkgs[1].localPkg(): 1,
+            pkgs[2].localPkg(): 0,
+        }
+        check_mock.side_effect = lambda root, path: results[path]
+        obj = dnf.PackageSignatureVerifier(
+            self.base, workers=1, cache_file=self.cache_file
+        )
+        with self.assertRaises(RuntimeError) as ctx:
+            obj.verify(pkgs)
+        self.assertEqual(
+            str(ctx.exception),
+            "Public key for bar.rpm is not installed\nPackage foo.rpm is not signed",
+        )
+        self.base.package_import_key.assert_not_called()
+        # the valid package is remembered
+        check_mock.reset_mock()
+        self.assertRaises(RuntimeError, obj.verify, pkgs)
+        self.assertEqual(check_mock.call_count, 2)
+
+    @mock.patch("concurrent.futures.ProcessPoolExecutor")
+    def test_verify_pool(self, pool_mock):
+        pkgs = [self._pkg("foo", "signed"), self._pkg("bar", "signed")]
+        executor = pool_mock.return_value.__enter__.return_value
+        executor.map.return_value = iter([0, 0])
+        obj = dnf.PackageSignatureVerifier(
+            self.base, workers=8, cache_file=self.cache_file
+        )
+        obj.verify(pkgs)
+        pool_mock.assert_called_once_with(max_workers=2)
+        executor.map.assert_called_once_with(
+            dnf._check_signature,
+            ["/", "/"],
+            [pkgs[1].localPkg(), pkgs[0].localPkg()],
+        )
+
+
+def _signature_ok(installroot, path):
+    return 0
+
+
+def _check_in_worker(paths):
+    base = mock.MagicMock()
+    base.conf.installroot = "/"
+    obj = dnf.PackageSignatureVerifier(base, workers=4)
+    pkgs = [mock.MagicMock(localPkg=mock.MagicMock(return_value=p)) for p in paths]
+    return sorted(obj._check(pkgs).values())
+
+
+class TestPackageSignatureVerifierWorker(unittest.TestCase):
+    @mock.patch("rhos_bootstrap.utils.dnf._check_signature", _signature_ok)
+    def test_check_in_pool_worker(self):
+        # pool workers are daemonic and can not have children
+        with multiprocessing.get_context("fork").Pool(1) as pool:
+            self.assertEqual(
+                pool.apply(_check_in_worker, (["/a.rpm", "/b.rpm"],)), [0, 0]
+            )
+
+
+class TestPackageManifest(unittest.TestCase):
+    def test_obj(self):
+        obj = dnf.PackageManifest()
+        self.assertFalse(obj)
+        self.assertEqual(obj.intents(), [])
+
+        obj = dnf.PackageManifest.from_dict(
+            {"install": ["foo"], "remove": ["bar"], "upgrade": None}
+        )
+        self.assertTrue(obj)
+        self.assertEqual(obj.install, ["foo"])
+        self.assertEqual(obj.upgrade, [])
+        self.assertEqual(obj.remove, ["bar"])
+        self.assertEqual(obj.intents(), [("install", "foo"), ("remove", "bar")])
+
+        merged = obj.merge(dnf.PackageManifest(install=["foo", "baz"]))
+        self.assertEqual(merged.install, ["foo", "baz"])
+        self.assertEqual(obj.install, ["foo"])
+        self.assertEqual(
+            merged.to_dict(),
+            {"install": ["foo", "baz"], "upgrade": [], "remove": ["bar"]},
+        )
+
+    def test_invalid(self):
+        self.assertRaises(
+            exceptions.PackageManifestInvalid,
+            dnf.PackageManifest.from_dict,
+            {"erase": ["foo"]},
+        )
+        self.assertRaises(
+            exceptions.PackageManifestInvalid,
+            dnf.PackageManifest.from_dict,
+            {"install": "foo"},
+        )
+        self.assertRaises(
+            exceptions.PackageManifestInvalid, dnf.PackageManifest.from_dict, ["foo"]
+        )
+
+    def test_from_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "packages.yaml")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("packages:\n  install:\n    - ceph-ansible\n")
+            obj = dnf.PackageManifest.from_file(path)
+            self.assertEqual(obj.install, ["ceph-ansible"])
+
+
+class TestDnfMetadataPrefetcher(unittest.TestCase):
+    @mock.patch("rhos_bootstrap.utils.dnf.dnf.Base")
+    def test_prefetch(self, base_mock):
+        repo_mock = mock.MagicMock()
+        base_inst = base_mock.return_value
+        base_inst.repos.get.side_effect = lambda x: repo_mock if x == "foo" else None
+
+        obj = dnf.DnfMetadataPrefetcher(2)
+        obj.submit(["foo", "bar"])
+        obj.submit(["foo"])
+        self.assertEqual(obj.wait(), {"foo": True, "bar": False})
+        repo_mock.load.assert_called_once_with()
+        self.assertEqual(base_inst.close.call_count, 2)
+
+    @mock.patch("rhos_bootstrap.utils.dnf.dnf.Base")
+    def test_prefetch_failure(self, base_mock):
+        base_mock.return_value.repos.get.return_value.load.side_effect = Exception(
+            "boom"
+        )
+        obj = dnf.DnfMetadataPrefetcher()
+        obj.submit(["foo"])
+        self.assertEqual(obj.wait(), {"foo": False})
+
+    @mock.patch("rhos_bootstrap.utils.dnf.Cli")
+    @mock.patch("rhos_bootstrap.utils.dnf.dnf.Base")
+    def test_prefetch_config(self, base_mock, cli_mock):
+        conf = base_mock.return_value.conf
+        conf.max_parallel_downloads = 4
+        obj = dnf.DnfMetadataPrefetcher(
+            1, installroot="/mnt/root", throttle=4 * 1024 * 1024
+        )
+        obj.submit(["foo"])
+        self.assertEqual(obj.wait(), {"foo": True})
+        self.assertEqual(conf.installroot, "/mnt/root")
+        self.assertEqual(conf.reposdir, [dnf.YUM_REPO_BASE_DIR])
+        self.assertEqual(conf.throttle, 1024 * 1024)
+        cli_mock.return_value._read_conf_file.assert_called_once_with("/")
+
+    @mock.patch("rhos_bootstrap.utils.dnf.dnf.Base")
+    def test_prefetch_close(self, base_mock):
+        obj = dnf.DnfMetadataPrefetcher(1)
+        obj.submit(["foo", "bar"])
+        obj.close()
+        # the executor is stopped, nothing else can be submitted
+        with self.assertRaises(RuntimeError):
+            obj.submit(["baz"])
+        self.assertLessEqual(base_mock.return_value.close.call_count, 2)
 
 
 class TestDnfModule(unittest.TestCase):
@@ -0,0 +1,143 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest import mock
+
+from rhos_bootstrap.utils import governor
+
+
+class TestResourceGovernor(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict(governor._SCOPES, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_parse_rate(self):
+        self.assertEqual(governor.parse_rate(None), 0)
+        self.assertEqual(governor.parse_rate("0"), 0)
+        self.assertEqual(governor.parse_rate(2048), 2048)
+        self.assertEqual(governor.parse_rate("512k"), 512 * 1024)
+        self.assertEqual(governor.parse_rate("10M"), 10 * 1024 * 1024)
+        self.assertEqual(governor.parse_rate("1G"), 1024**3)
+        self.assertRaises(ValueError, governor.parse_rate, "fast")
+        self.assertRaises(ValueError, governor.parse_rate, "-1M")
+
+    def test_invalid_mode(self):
+        self.assertRaises(ValueError, governor.ResourceGovernor, "foo")
+
+    @mock.patch("rhos_bootstrap.utils.governor._thread_id", return_value=42)
+    @mock.patch("os.setpriority")
+    @mock.patch("os.getpriority", return_value=0)
+    def test_priority(self, getprio_mock, setprio_mock, tid_mock):
+        obj = governor.ResourceGovernor("priority", nice=10)
+        with mock.patch.object(obj, "_run") as run_mock:
+            run_mock.return_value = "best-effort: prio 4\n"
+            with obj.throttled("update"):
+                setprio_mock.assert_called_once_with(mock.ANY, 0, 10)
+            self.assertEqual(
+                run_mock.call_args_list,
+                [
+                    mock.call(["ionice", "-p", "42"]),
+                    mock.call(["ionice", "-c", "2", "-n", "7", "-p", "42"]),
+                    mock.call(["ionice", "-c", "2", "-n", "4", "-p", "42"]),
+                ],
+            )
+        setprio_mock.assert_called_with(mock.ANY, 0, 0)
+        report = obj.report()
+        self.assertEqual(report["mode"], "priority")
+        self.assertEqual(report["nice"], 10)
+        self.assertIn("update", report["phases"])
+        self.assertEqual(
+            set(report["phases"]["update"]),
+            {"seconds", "cpu_wait_seconds", "io_delay_seconds"},
+        )
+        self.assertEqual(report["errors"], [])
+
+    @mock.patch("os.setpriority")
+    @mock.patch("os.getpriority", return_value=15)
+    def test_priority_ionice_missing(self, getprio_mock, setprio_mock):
+        obj = governor.ResourceGovernor("priority", nice=10)
+        with mock.patch.object(obj, "_run", side_effect=OSError("no ionice")):
+            with obj.throttled("update"):
+                # an already lower priority is kept
+                setprio_mock.assert_called_once_with(mock.ANY, 0, 15)
+        setprio_mock.assert_called_with(mock.ANY, 0, 15)
+        self.assertEqual(obj.report()["errors"], ["no ionice"])
+
+    @mock.patch("os.getpid", return_value=1234)
+    def test_scope(self, pid_mock):
+        obj = governor.ResourceGovernor("scope", weight=20)
+        with mock.patch.object(obj, "_run") as run_mock:
+            with obj.throttled("update"):
+                cmd = run_mock.call_args[0][0]
+                self.assertEqual(cmd[:2], ["busctl", "call"])
+                self.assertIn("rhos-bootstrap-1234.scope", cmd)
+                self.assertEqual(
+                    cmd[-7:], ["CPUWeight", "t", "20"] + ["IOWeight", "t", "20", "0"]
+                )
+            run_mock.assert_called_with(
+                [
+                    "systemctl",
+                    "set-property",
+                    "--runtime",
+                    "rhos-bootstrap-1234.scope",
+                    "CPUWeight=100",
+                    "IOWeight=100",
+                ]
+            )
+        # the scope is reused by the next runs
+        obj = governor.ResourceGovernor("scope", weight=20)
+        with mock.patch.object(obj, "_run") as run_mock:
+            with obj.throttled("client_install"):
+                self.assertEqual(
+                    run_mock.call_args[0][0][-2:], ["CPUWeight=20", "IOWeight=20"]
+                )
+        report = obj.report()
+        self.assertEqual(report["scope"], "rhos-bootstrap-1234.scope")
+        self.assertEqual(report["weight"], 20)
+
+    def test_scope_failed(self):
+        obj = governor.ResourceGovernor("scope")
+        with mock.patch.object(
+            obj, "_run", side_effect=OSError("no systemd")
+        ) as run_mock:
+            with obj.throttled("update"):
+                pass
+        run_mock.assert_called_once()
+        self.assertIsNone(obj.scope)
+        self.assertEqual(obj.report()["errors"], ["no systemd"])
+
+    def test_bandwidth_only(self):
+        obj = governor.ResourceGovernor(bandwidth=1024 * 1024)
+        with mock.patch.object(obj, "_run") as run_mock:
+            with obj.throttled("update"):
+                pass
+        run_mock.assert_not_called()
+        report = obj.report(download_bytes=10 * 1024 * 1024)
+        self.assertEqual(report["bandwidth"], 1024 * 1024)
+        self.assertEqual(report["min_download_seconds"], 10.0)
+        self.assertEqual(report["phases"], {})
+        # split between 3 parallel downloads
+        obj.use_download_rate(1024 * 1023)
+        report = obj.report(download_bytes=1024 * 1023 * 20)
+        self.assertEqual(report["bandwidth"], 1024 * 1024)
+        self.assertEqual(report["download_rate"], 1024 * 1023)
+        self.assertEqual(report["min_download_seconds"], 20.0)
+
+    def test_thread_delays(self):
+        cpu_wait, io_delay = governor.thread_delays()
+        self.assertGreaterEqual(cpu_wait, 0)
+        self.assertGreaterEqual(io_delay, 0)
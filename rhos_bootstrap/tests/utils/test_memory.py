@@ -0,0 +1,57 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from rhos_bootstrap.utils import memory
+
+STATUS = """Name:	python3
+VmHWM:	  204800 kB
+VmRSS:	  102400 kB
+"""
+
+
+class TestMemory(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.status = os.path.join(tmp.name, "status")
+        with open(self.status, "w", encoding="utf-8") as out:
+            out.write(STATUS)
+        self.clear_refs = os.path.join(tmp.name, "clear_refs")
+
+    def test_rss(self):
+        with mock.patch.object(memory, "PROC_STATUS", self.status):
+            self.assertEqual(memory.rss_mb(), 100.0)
+            self.assertEqual(memory.peak_rss_mb(), 200.0)
+
+    @mock.patch("resource.getrusage")
+    def test_peak_fallback(self, rusage_mock):
+        rusage_mock.return_value.ru_maxrss = 1024 * 300
+        with mock.patch.object(memory, "PROC_STATUS", self.status + ".missing"):
+            self.assertIsNone(memory.rss_mb())
+            self.assertEqual(memory.peak_rss_mb(), 300.0)
+
+    def test_reset_peak_rss(self):
+        with mock.patch.object(memory, "PROC_CLEAR_REFS", self.clear_refs):
+            self.assertTrue(memory.reset_peak_rss())
+        with open(self.clear_refs, "r", encoding="utf-8") as data:
+            self.assertEqual(data.read(), "5")
+        missing = os.path.join(self.clear_refs, "missing")
+        with mock.patch.object(memory, "PROC_CLEAR_REFS", missing):
+            self.assertFalse(memory.reset_peak_rss())
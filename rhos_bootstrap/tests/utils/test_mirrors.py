@@ -0,0 +1,145 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest import mock
+
+from rhos_bootstrap import exceptions
+from rhos_bootstrap.utils import mirrors
+
+DELOREAN_REPO = """[delorean-component-baremetal]
+name=delorean-component-baremetal
+baseurl=https://trunk.rdoproject.org/centos8-master/component/baremetal/abc
+enabled=1
+gpgcheck=0
+priority=1
+
+[delorean-master-build-deps]
+name=master-build-deps
+baseurl=http://mirror.centos.org/centos/8-stream/cloud/x86_64/build-deps/
+mirrorlist=http://mirrorlist.centos.org/?release=8-stream
+enabled=1
+gpgcheck=0
+"""
+
+
+class TestMirrorRule(unittest.TestCase):
+    def test_prefix(self):
+        obj = mirrors.MirrorRule("http://mirror.centos.org/centos/", ["http://a/c/"])
+        self.assertEqual(
+            obj.rewrite("http://mirror.centos.org/centos/8-stream/x/"),
+            ["http://a/c/8-stream/x/", "http://mirror.centos.org/centos/8-stream/x/"],
+        )
+        self.assertIsNone(obj.rewrite("http://mirror.centos.org/centosx/8/"))
+
+    def test_host(self):
+        obj = mirrors.MirrorRule(
+            "trunk.rdoproject.org", ["http://a", "http://b"], keep_upstream=False
+        )
+        self.assertEqual(
+            obj.rewrite("https://trunk.rdoproject.org/centos8/x"),
+            ["http://a/centos8/x", "http://b/centos8/x"],
+        )
+        self.assertIsNone(obj.rewrite("https://other.org/centos8/x"))
+
+    def test_sections(self):
+        obj = mirrors.MirrorRule("foo", ["http://a"], sections=["delorean-*-deps"])
+        self.assertTrue(obj.applies_to("delorean-master-deps"))
+        self.assertFalse(obj.applies_to("delorean"))
+        self.assertTrue(mirrors.MirrorRule("foo", ["http://a"]).applies_to("bar"))
+
+    def test_from_dict(self):
+        obj = mirrors.MirrorRule.from_dict({"match": "foo", "mirrors": ["http://a"]})
+        self.assertEqual(obj.match, "foo")
+        self.assertEqual(obj.mirrors, ["http://a"])
+        for data in (
+            [],
+            {"mirrors": ["http://a"]},
+            {"match": "foo"},
+            {"match": "foo", "mirrors": []},
+            {"match": "foo", "mirrors": ["http://a"], "sections": "bar"},
+            {"match": "foo", "mirrors": ["http://a"], "bar": 1},
+        ):
+            self.assertRaises(
+                exceptions.MirrorConfigInvalid, mirrors.MirrorRule.from_dict, data
+            )
+
+
+class TestMirrorConfig(unittest.TestCase):
+    def test_rewrite(self):
+        obj = mirrors.MirrorConfig.from_dict(
+            {
+                "rules": [
+                    {
+                        "match": "trunk.rdoproject.org",
+                        "mirrors": ["http://rdo.local"],
+                        "keep_upstream": False,
+                    },
+                    {
+                        "match": "http://mirror.centos.org/centos",
+                        "sections": ["*-build-deps"],
+                        "mirrors": ["http://centos.local/", "http://centos2.local"],
+                    },
+                ]
+            }
+        )
+        data = obj.rewrite(DELOREAN_REPO)
+        self.assertIn(
+            "baseurl=http://rdo.local/centos8-master/component/baremetal/abc\n", data
+        )
+        self.assertIn(
+            "baseurl=http://centos.local/8-stream/cloud/x86_64/build-deps/ "
+            "http://centos2.local/8-stream/cloud/x86_64/build-deps/ "
+            "http://mirror.centos.org/centos/8-stream/cloud/x86_64/build-deps/\n",
+            data,
+        )
+        self.assertNotIn("mirrorlist", data)
+        self.assertIn("priority=1\n\n[delorean-master-build-deps]\n", data)
+
+    def test_rewrite_multi_line(self):
+        obj = mirrors.MirrorConfig(
+            rules=[mirrors.MirrorRule("a.org", ["http://local"], keep_upstream=False)]
+        )
+        data = "[foo]\nbaseurl=http://b.org/x\n  http://a.org/y\nenabled=1\n"
+        self.assertEqual(
+            obj.rewrite(data),
+            "[foo]\nbaseurl=http://b.org/x http://local/y\nenabled=1\n",
+        )
+        # unchanged sections are kept as is
+        data = "[foo]\nbaseurl=http://b.org/x\n  http://c.org/y\nmetalink=z\n"
+        self.assertEqual(obj.rewrite(data), data)
+
+    def test_rewrite_no_rules(self):
+        self.assertEqual(mirrors.MirrorConfig().rewrite(DELOREAN_REPO), DELOREAN_REPO)
+        self.assertFalse(mirrors.MirrorConfig())
+
+    def test_mirror(self):
+        obj = mirrors.MirrorConfig.from_dict({"mirror_map": {"rdo": "http://rdo/"}})
+        self.assertTrue(obj)
+        self.assertEqual(obj.mirror("rdo"), "http://rdo")
+        self.assertIsNone(obj.mirror("centos8-stream"))
+
+    def test_from_dict_invalid(self):
+        for data in ([], {"foo": 1}, {"mirror_map": []}, {"rules": {}}):
+            self.assertRaises(
+                exceptions.MirrorConfigInvalid, mirrors.MirrorConfig.from_dict, data
+            )
+
+    def test_from_file(self):
+        data = "rules:\n  - match: foo\n    mirrors: [http://a]\n"
+        with mock.patch("builtins.open", mock.mock_open(read_data=data)):
+            obj = mirrors.MirrorConfig.from_file("/etc/foo.yaml")
+        self.assertEqual(len(obj.rules), 1)
+        with mock.patch("builtins.open", side_effect=FileNotFoundError):
+            self.assertFalse(mirrors.MirrorConfig.from_file("/etc/foo.yaml"))
@@ -0,0 +1,71 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from rhos_bootstrap.utils import pins
+
+
+def _repo(key, resolved=None, pinnable=True):
+    repo = mock.MagicMock()
+    repo.pin_key = key
+    repo.pinnable = pinnable
+    repo.resolve_pin.return_value = resolved
+    return repo
+
+
+class TestDeloreanPins(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.path = os.path.join(tmpdir, "pins.json")
+
+    def test_apply(self):
+        obj = pins.DeloreanPins.load(self.path)
+        current = _repo("centos8-master/current-tripleo", "abcd1234")
+        deps = _repo("centos8-master/deps", pinnable=False)
+        other = _repo("centos8-master/current", None)
+        used = obj.apply([current, deps, other, mock.MagicMock(spec=[])])
+        self.assertEqual(used, {"centos8-master/current-tripleo": "abcd1234"})
+        current.pin.assert_called_once_with("abcd1234")
+        deps.pin.assert_not_called()
+        other.pin.assert_not_called()
+
+        # later runs use the recorded pin
+        obj = pins.DeloreanPins.load(self.path)
+        self.assertEqual(obj.to_dict(), used)
+        current = _repo("centos8-master/current-tripleo", "ffff0000")
+        self.assertEqual(obj.apply([current]), used)
+        current.resolve_pin.assert_not_called()
+        current.pin.assert_called_once_with("abcd1234")
+
+    def test_apply_no_save(self):
+        obj = pins.DeloreanPins.load(self.path)
+        current = _repo("centos8-master/current-tripleo", "abcd1234")
+        self.assertEqual(
+            obj.apply([current], save=False),
+            {"centos8-master/current-tripleo": "abcd1234"},
+        )
+        current.pin.assert_called_once_with("abcd1234")
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_load_corrupted(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("{")
+        self.assertEqual(pins.DeloreanPins.load(self.path).to_dict(), {})
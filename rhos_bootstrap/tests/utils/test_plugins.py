@@ -0,0 +1,88 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from rhos_bootstrap.utils import plugins
+
+
+class FakePlugin:
+    name = "product-id"
+
+    def __init__(self):
+        self.calls = []
+
+    def config(self):
+        self.calls.append("config")
+
+    def transaction(self):
+        self.calls.append("transaction")
+        return "done"
+
+
+class TestPluginPolicy(unittest.TestCase):
+    def test_allowed(self):
+        obj = plugins.PluginPolicy(deny=["dnf_setup:product-*", "kpatch"])
+        self.assertTrue(obj)
+        self.assertFalse(obj.allowed("product-id", "dnf_setup"))
+        self.assertTrue(obj.allowed("product-id", "update"))
+        self.assertFalse(obj.allowed("kpatch", "update"))
+        self.assertEqual(obj.disabled_glob, ["kpatch"])
+        self.assertEqual(obj.enable_plugins, [])
+
+        obj = plugins.PluginPolicy(allow=["modules:subscription-manager"])
+        self.assertFalse(obj.allowed("product-id", "modules"))
+        self.assertTrue(obj.allowed("subscription-manager", "modules"))
+        self.assertTrue(obj.allowed("product-id", "update"))
+        self.assertEqual(obj.disabled_glob, [])
+
+        obj = plugins.PluginPolicy(allow=["subscription-manager"], deny=["kpatch"])
+        self.assertEqual(obj.disabled_glob, ["*"])
+        self.assertEqual(obj.enable_plugins, ["subscription-manager"])
+        self.assertFalse(plugins.PluginPolicy())
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, plugins.PluginPolicy, deny=["update:"])
+        self.assertRaises(ValueError, plugins.PluginPolicy, allow=[":foo"])
+
+
+class TestPluginProfiler(unittest.TestCase):
+    def test_instrument(self):
+        obj = plugins.PluginProfiler(
+            plugins.PluginPolicy(deny=["dnf_setup:product-id"])
+        )
+        plugin = FakePlugin()
+        obj.instrument([plugin])
+        obj.phase = "dnf_setup"
+        plugin.config()
+        plugin.config()
+        obj.phase = "update"
+        self.assertEqual(plugin.transaction(), "done")
+        self.assertEqual(plugin.calls, ["transaction"])
+        obj.record_init(0.5)
+
+        report = obj.report()
+        self.assertEqual(report["init"], 0.5)
+        self.assertEqual(report["skipped"], {"product-id": ["dnf_setup"]})
+        self.assertEqual(report["plugins"]["product-id"]["transaction"]["calls"], 1)
+        self.assertEqual(obj.costliest()[0][0], "product-id")
+
+        # instrumenting again replaces the previous profiler
+        other = plugins.PluginProfiler()
+        other.instrument([plugin])
+        other.phase = "dnf_setup"
+        plugin.config()
+        self.assertEqual(plugin.calls, ["transaction", "config"])
+        self.assertEqual(other.report()["plugins"]["product-id"]["config"]["calls"], 1)
+        self.assertNotIn("config", obj.report()["plugins"]["product-id"])
@@ -0,0 +1,91 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import tracemalloc
+import unittest
+
+from rhos_bootstrap.utils import profiling
+
+
+def _busy():
+    return [str(i) * 10 for i in range(20000)]
+
+
+class TestPhaseProfiler(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = os.path.join(tmp.name, "profiles")
+
+    def test_profile(self):
+        obj = profiling.PhaseProfiler(self.directory)
+        with obj.profile("repos"):
+            data = _busy()
+        with obj.profile("modules"):
+            pass
+        self.assertEqual(len(data), 20000)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            [
+                "01-repos.json",
+                "01-repos.prof",
+                "01-repos.tracemalloc",
+                "02-modules.json",
+                "02-modules.prof",
+                "02-modules.tracemalloc",
+            ],
+        )
+        with open(os.path.join(self.directory, "01-repos.json"), encoding="utf-8") as f:
+            memory = json.load(f)
+        self.assertEqual(memory["phase"], "repos")
+        self.assertGreater(memory["peak_bytes"], 0)
+        self.assertTrue(memory["top_allocations"])
+
+        summary = profiling.summarize(self.directory, top=3)
+        self.assertEqual([p["phase"] for p in summary], ["repos", "modules"])
+        self.assertLessEqual(len(summary[0]["hotspots"]), 3)
+        self.assertTrue(
+            any("_busy" in spot["function"] for spot in summary[0]["hotspots"])
+        )
+
+        # the next run replaces the profiles
+        obj = profiling.PhaseProfiler(self.directory)
+        with obj.profile("update"):
+            pass
+        self.assertEqual(
+            [p["phase"] for p in profiling.summarize(self.directory)], ["update"]
+        )
+
+    def test_profile_traced(self):
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        with profiling.PhaseProfiler(self.directory).profile("repos"):
+            pass
+        # a trace started by the caller keeps running
+        self.assertTrue(tracemalloc.is_tracing())
+
+    def test_profile_unwritable(self):
+        with open(self.directory, "w", encoding="utf-8"):
+            pass
+        with profiling.PhaseProfiler(self.directory).profile("repos"):
+            pass
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_summarize_empty(self):
+        self.assertEqual(profiling.summarize(self.directory), [])
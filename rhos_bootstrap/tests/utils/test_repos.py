@@ -12,7 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import shutil
+import tempfile
 import unittest
+import requests
 from rhos_bootstrap.utils import repos
 from rhos_bootstrap import exceptions
 from unittest import mock
@@ -30,6 +34,7 @@ class TestRhsmRepos(unittest.TestCase):
     def test_base(self):
         obj = repos.RhsmRepo("foo")
         self.assertEqual(obj.name, "foo")
+        self.assertEqual(obj.repo_ids, ["foo"])
         self.submgr_mock.assert_called_once()
 
     def test_save(self):
@@ -41,11 +46,25 @@ class TestRhsmRepos(unittest.TestCase):
         obj.save()
         repos_mock.assert_called_once_with(enable=["foo"])
 
+    def test_remove(self):
+        obj = repos.RhsmRepo("foo")
+        obj.remove()
+        self.submgr_mock.return_value.repos.assert_called_once_with(disable=["foo"])
+
+    def test_is_configured(self):
+        obj = repos.RhsmRepo("foo")
+        data = "[foo]\nenabled = 1\n[bar]\nenabled = 0\n"
+        with mock.patch("builtins.open", mock.mock_open(read_data=data)):
+            self.assertTrue(obj.is_configured())
+            self.assertFalse(repos.RhsmRepo("bar").is_configured())
+            self.assertFalse(repos.RhsmRepo("baz").is_configured())
+
 
 class TestYumRepos(unittest.TestCase):
     def test_base(self):
         obj = repos.BaseYumRepo("foo", "bar", "url", True, False)
         self.assertEqual(obj.name, "foo")
+        self.assertEqual(obj.repo_ids, ["foo"])
         self.assertEqual(obj.description, "bar")
         self.assertEqual(obj.baseurl, "url")
         self.assertTrue(obj.enabled)
@@ -120,6 +139,26 @@ class TestYumRepos(unittest.TestCase):
         with mock.patch("builtins.open", mock.mock_open()) as file_mock:
             self.assertRaises(PermissionError, obj.save)
 
+    @mock.patch("os.unlink")
+    @mock.patch("os.path.isfile")
+    def test_remove(self, isfile_mock, unlink_mock):
+        obj = repos.BaseYumRepo("foo", "foo", "http://foo", True, False)
+        isfile_mock.return_value = False
+        obj.remove()
+        unlink_mock.assert_not_called()
+        isfile_mock.return_value = True
+        obj.remove()
+        unlink_mock.assert_called_once_with("/etc/yum.repos.d/foo.repo")
+
+    def test_is_configured(self):
+        obj = repos.BaseYumRepo("foo", "foo", "http://foo", True, False)
+        with mock.patch("builtins.open", mock.mock_open(read_data=str(obj))):
+            self.assertTrue(obj.is_configured())
+        with mock.patch("builtins.open", mock.mock_open(read_data="[foo]\n")):
+            self.assertFalse(obj.is_configured())
+        with mock.patch("builtins.open", side_effect=FileNotFoundError):
+            self.assertFalse(obj.is_configured())
+
     def test_ceph(self):
         obj = repos.TripleoCephRepo("centos8-stream", "pacific")
         self.assertEqual(obj.name, "tripleo-centos-ceph-pacific")
@@ -149,19 +188,40 @@ class TestDeloreanRepos(unittest.TestCase):
     def test_base(self):
         self.response_mock.text = "data"
         obj = repos.TripleoDeloreanRepos("centos8", "master", "current-tripleo")
+        # the repo file is only fetched when needed
+        self.requests_mock.assert_not_called()
 
         self.assertEquals(obj.name, "tripleo-delorean-current-tripleo")
         self.assertEquals(obj.repo_data, "data")
         self.assertEquals(str(obj), "data")
         self.requests_mock.assert_called_with(
-            "https://trunk.rdoproject.org/centos8-master/current-tripleo/delorean.repo"
+            "https://trunk.rdoproject.org/centos8-master/current-tripleo/delorean.repo",
+            timeout=repos.HTTP_TIMEOUT,
         )
 
+        config = mock.MagicMock()
+        config.rewrite.return_value = "rewritten"
+        obj = repos.TripleoDeloreanRepos(
+            "centos8", "master", "current", mirror="http://rdo", mirrors=config
+        )
+        self.assertEqual(obj.repo_data, "rewritten")
+        config.rewrite.assert_called_once_with("data")
+        self.requests_mock.assert_called_with(
+            "http://rdo/centos8-master/current/delorean.repo",
+            timeout=repos.HTTP_TIMEOUT,
+        )
+
+        self.response_mock.text = "[delorean]\nname=a\n[delorean-deps]\nname=b\n"
+        obj = repos.TripleoDeloreanRepos("centos8", "master", "deps")
+        self.assertEqual(obj.repo_ids, ["delorean", "delorean-deps"])
+
+        self.response_mock.text = "data"
         obj = repos.TripleoDeloreanRepos("centos8", "master", "deps")
         self.assertEquals(obj.repo_data, "data")
         self.assertEquals(str(obj), "data")
         self.requests_mock.assert_called_with(
-            "https://trunk.rdoproject.org/centos8-master/delorean-deps.repo"
+            "https://trunk.rdoproject.org/centos8-master/delorean-deps.repo",
+            timeout=repos.HTTP_TIMEOUT,
         )
 
     @mock.patch("os.access")
@@ -205,3 +265,152 @@ class TestDeloreanRepos(unittest.TestCase):
         access_mock.side_effect = [True, False]
         with mock.patch("builtins.open", mock.mock_open()) as file_mock:
             self.assertRaises(PermissionError, obj.save)
+
+    @mock.patch("os.unlink")
+    @mock.patch("os.path.isfile")
+    def test_remove(self, isfile_mock, unlink_mock):
+        obj = repos.TripleoDeloreanRepos("centos8", "master", "current-tripleo")
+        isfile_mock.return_value = True
+        obj.remove()
+        unlink_mock.assert_called_once_with(
+            "/etc/yum.repos.d/tripleo-delorean-current-tripleo.repo"
+        )
+        self.requests_mock.assert_not_called()
+
+    def test_is_configured(self):
+        obj = repos.TripleoDeloreanRepos("centos8", "master", "current-tripleo")
+        self.response_mock.text = "new"
+        with mock.patch("builtins.open", mock.mock_open(read_data="old")):
+            # written from an older hash of the symlinked repo
+            self.assertFalse(obj.is_configured())
+            self.requests_mock.assert_called_once()
+        with mock.patch("builtins.open", mock.mock_open(read_data="new")):
+            self.assertTrue(obj.is_configured())
+        self.requests_mock.assert_called_once()
+        with mock.patch("builtins.open", side_effect=FileNotFoundError):
+            self.assertFalse(obj.is_configured())
+
+    def test_pin(self):
+        obj = repos.TripleoDeloreanRepos("centos8", "master", "current-tripleo")
+        self.assertTrue(obj.pinnable)
+        self.assertEqual(obj.pin_key, "centos8-master/current-tripleo")
+        self.response_mock.ok = True
+        self.response_mock.text = "c7d0e5e9abcdef\n"
+        self.assertEqual(obj.resolve_pin(), "c7d0e5e9abcdef")
+        self.requests_mock.assert_called_with(
+            "https://trunk.rdoproject.org/centos8-master/current-tripleo/"
+            "delorean.repo.md5",
+            timeout=repos.HTTP_TIMEOUT,
+        )
+
+        obj.pin("c7d0e5e9abcdef")
+        self.assertEqual(obj.pinned, "c7d0e5e9abcdef")
+        self.response_mock.text = "data"
+        self.assertEqual(obj.repo_data, "data")
+        self.requests_mock.assert_called_with(
+            "https://trunk.rdoproject.org/centos8-master/c7/d0/c7d0e5e9abcdef/"
+            "delorean.repo",
+            timeout=repos.HTTP_TIMEOUT,
+        )
+        self.assertRaises(ValueError, obj.pin, "../current")
+
+        deps = repos.TripleoDeloreanRepos("centos8", "master", "deps")
+        self.assertFalse(deps.pinnable)
+        self.assertIsNone(deps.resolve_pin())
+        self.assertRaises(ValueError, deps.pin, "c7d0e5e9abcdef")
+
+    def test_resolve_pin_from_repo(self):
+        obj = repos.TripleoDeloreanRepos("centos8", "master", "current-tripleo")
+        missing = mock.MagicMock()
+        missing.raise_for_status.side_effect = requests.HTTPError("404")
+        self.requests_mock.side_effect = [missing, self.response_mock]
+        self.response_mock.text = (
+            "[delorean]\nbaseurl=https://trunk.rdoproject.org/centos8-master/"
+            "ab/cd/abcd1234_5678\n"
+        )
+        self.assertEqual(obj.resolve_pin(), "abcd1234_5678")
+        self.requests_mock.side_effect = None
+
+        obj = repos.TripleoDeloreanRepos("centos8", "master", "current-tripleo")
+        self.response_mock.text = (
+            "[a]\nbaseurl=https://x/component/a/ab/cd/abcd1234\n"
+            "[b]\nbaseurl=https://x/component/b/ef/01/ef01ab\n"
+        )
+        self.assertIsNone(obj.resolve_pin())
+
+    def test_unavailable(self):
+        obj = repos.TripleoDeloreanRepos("centos8", "master", "current-tripleo")
+        self.requests_mock.side_effect = requests.Timeout("timed out")
+        self.assertRaises(exceptions.RepositoryUnavailable, obj.resolve_pin)
+        self.assertRaises(exceptions.RepositoryUnavailable, lambda: obj.repo_data)
+        self.response_mock.raise_for_status.side_effect = requests.HTTPError("500")
+        self.requests_mock.side_effect = None
+        self.assertRaises(exceptions.RepositoryUnavailable, lambda: obj.repo_data)
+
+
+class TestRenderRepos(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        submgr_mock = mock.patch(
+            "rhos_bootstrap.utils.rhsm.SubscriptionManager.instance"
+        )
+        self.submgr_mock = submgr_mock.start()
+        self.addCleanup(submgr_mock.stop)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.repo_dir = os.path.join(self.tmpdir, "yum.repos.d")
+        self.target_dir = os.path.join(self.tmpdir, "target")
+        os.mkdir(self.repo_dir)
+        os.mkdir(self.target_dir)
+        for name, data in (
+            ("redhat.repo", "[foo]\nenabled = 1\n[bar]\nenabled = 0\n"),
+            ("old.repo", "[old]\n"),
+            ("other.repo", "[other]\n"),
+        ):
+            with open(os.path.join(self.repo_dir, name), "w", encoding="utf-8") as f:
+                f.write(data)
+
+    def _render(self, repo_list, **kwargs):
+        return repos.render_repos(
+            self.target_dir,
+            repo_list,
+            repo_dir=self.repo_dir,
+            rhsm_repo_file=os.path.join(self.repo_dir, "redhat.repo"),
+            **kwargs,
+        )
+
+    def test_render(self):
+        yum_repo = repos.BaseYumRepo("new", "New", "http://foo", True, False)
+        old = repos.BaseYumRepo("old", "Old", "http://foo", True, False)
+        problems = self._render(
+            [repos.RhsmRepo("bar"), repos.RhsmRepo("baz"), yum_repo],
+            removed=[old],
+            reset_rhsm=True,
+        )
+        self.assertEqual(problems, ["baz is not available from subscription-manager"])
+        self.assertEqual(
+            sorted(os.listdir(self.target_dir)),
+            ["new.repo", "other.repo", "redhat.repo"],
+        )
+        self.assertTrue(yum_repo.is_configured(self.target_dir))
+        self.assertFalse(repos.RhsmRepo("foo").is_configured(self.rhsm_file))
+        self.assertTrue(repos.RhsmRepo("bar").is_configured(self.rhsm_file))
+        # the host configuration is untouched
+        self.assertTrue(
+            repos.RhsmRepo("foo").is_configured(
+                os.path.join(self.repo_dir, "redhat.repo")
+            )
+        )
+
+    def test_render_errors(self):
+        repo = mock.MagicMock()
+        repo.name = "delorean"
+        repo.save.side_effect = OSError("unreachable")
+        problems = self._render([repo], removed=[repos.RhsmRepo("foo")])
+        self.assertEqual(problems, ["Unable to configure delorean: unreachable"])
+        repo.save.assert_called_once_with(self.target_dir)
+        self.assertFalse(repos.RhsmRepo("foo").is_configured(self.rhsm_file))
+
+    @property
+    def rhsm_file(self):
+        return os.path.join(self.target_dir, "redhat.repo")
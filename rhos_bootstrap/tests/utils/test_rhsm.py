@@ -12,12 +12,39 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import sys
 import unittest
 from rhos_bootstrap.utils import rhsm
 from rhos_bootstrap import exceptions
 from unittest import mock
 
 
+class _RhsmService:
+    """Local stand-in of the rhsm D-Bus services"""
+
+    def __init__(self, status=None, error=None):
+        self.status = status or {"status": "Current", "valid": True, "reasons": {}}
+        self.error = error
+        self.calls = []
+
+    def GetStatus(self, on_date, locale, dbus_interface=None):
+        self.calls.append(("GetStatus", dbus_interface))
+        if self.error:
+            raise self.error
+        return json.dumps(self.status)
+
+
+class _Bus:
+    def __init__(self, service):
+        self.service = service
+        self.paths = []
+
+    def get_object(self, bus_name, path):
+        self.paths.append((bus_name, path))
+        return self.service
+
+
 class TestSubscriptionManager(unittest.TestCase):
     def setUp(self):
         # ensure we get a fresh instance for each test
@@ -95,3 +122,64 @@ class TestSubscriptionManager(unittest.TestCase):
 
         run_mock.side_effect = exceptions.SubscriptionManagerFailure("foo")
         self.assertRaises(exceptions.SubscriptionManagerFailure, self.obj.repos)
+
+    def test_dbus_status(self):
+        service = _RhsmService()
+        bus = _Bus(service)
+        self.obj.set_backend("auto", bus=bus)
+        self.obj.run = mock.MagicMock()
+        rc, out, _ = self.obj.status()
+        self.assertEqual(rc, 0)
+        self.assertIn("Current", out)
+        self.obj.run.assert_not_called()
+        self.assertEqual(
+            bus.paths, [("com.redhat.RHSM1", "/com/redhat/RHSM1/Entitlement")]
+        )
+        self.assertEqual(service.calls, [("GetStatus", "com.redhat.RHSM1.Entitlement")])
+        self.assertEqual(self.obj.stats()["dbus"]["status"]["calls"], 1)
+
+        service.status = {"status": "Invalid", "valid": False}
+        self.assertRaises(exceptions.SubscriptionManagerConfigError, self.obj.status)
+        self.obj.run.assert_not_called()
+
+    def test_dbus_fallback(self):
+        service = _RhsmService(error=RuntimeError("no service"))
+        self.obj.set_backend("auto", bus=_Bus(service))
+        self.obj.run = mock.MagicMock(return_value=(0, "cli", ""))
+        self.assertEqual(self.obj.status(), (0, "cli", ""))
+        # the cli is used from now on
+        self.assertEqual(self.obj.status(), (0, "cli", ""))
+        self.assertEqual(len(service.calls), 1)
+
+        self.obj.set_backend("dbus", bus=_Bus(service))
+        self.assertRaises(exceptions.SubscriptionManagerConfigError, self.obj.status)
+
+        with mock.patch.dict(sys.modules, {"dbus": None}):
+            self.obj.set_backend("auto")
+            self.assertEqual(self.obj.status(), (0, "cli", ""))
+            self.obj.set_backend("dbus")
+            self.assertRaises(
+                exceptions.SubscriptionManagerConfigError, self.obj.status
+            )
+
+    def test_cli_backend(self):
+        service = _RhsmService()
+        self.obj.set_backend("cli", bus=_Bus(service))
+        self.obj.run = mock.MagicMock(return_value=(0, "cli", ""))
+        self.assertEqual(self.obj.status(), (0, "cli", ""))
+        self.assertEqual(service.calls, [])
+        self.assertRaises(ValueError, self.obj.set_backend, "foo")
+
+    @mock.patch("subprocess.Popen")
+    def test_run_stats(self, popen_mock):
+        proc_mock = popen_mock.return_value.__enter__.return_value
+        proc_mock.communicate.return_value = ("", "")
+        proc_mock.returncode = 0
+        self.obj._exe = "foo"
+        rhsm.SubscriptionManager.use_backend("cli")
+        self.obj.repos(enable=["foo"])
+        self.obj.repos(enable=["bar"])
+        stats = rhsm.SubscriptionManager.call_stats()
+        self.assertEqual(stats["cli"]["repos"]["calls"], 2)
+        rhsm.SubscriptionManager.use_backend("cli")
+        self.assertEqual(rhsm.SubscriptionManager.call_stats(), {})
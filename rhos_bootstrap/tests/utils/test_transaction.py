@@ -0,0 +1,88 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+from rhos_bootstrap import exceptions
+from rhos_bootstrap.utils import transaction
+
+
+class TestResolvedTransaction(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "state", "staged.json")
+
+    def test_save_load(self):
+        obj = transaction.ResolvedTransaction(
+            "16.2",
+            "rhel8.4",
+            {"install": ["foo"], "upgrade": [], "remove": []},
+            {"install": ["foo-1-1.noarch"], "upgrade": [], "remove": []},
+        )
+        obj.save(self.path)
+        loaded = transaction.ResolvedTransaction.load(self.path)
+        self.assertEqual(loaded.to_dict(), obj.to_dict())
+        self.assertEqual(loaded.version, "16.2")
+        self.assertEqual(loaded.transaction["install"], ["foo-1-1.noarch"])
+
+        transaction.ResolvedTransaction.remove(self.path)
+        self.assertFalse(os.path.exists(self.path))
+        # removing twice is fine
+        transaction.ResolvedTransaction.remove(self.path)
+
+    def test_load_invalid(self):
+        self.assertRaises(
+            exceptions.StagedTransactionInvalid,
+            transaction.ResolvedTransaction.load,
+            self.path,
+        )
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w", encoding="utf-8") as out:
+            out.write('{"version": "16.2"}')
+        self.assertRaises(
+            exceptions.StagedTransactionInvalid,
+            transaction.ResolvedTransaction.load,
+            self.path,
+        )
+
+    def test_incompatibilities(self):
+        state = {
+            "rpmdb": "1:abc",
+            "repos": {"baseos": "123", "appstream": "456"},
+            "modules": {"virt": "av"},
+        }
+        obj = transaction.ResolvedTransaction(
+            "16.2", "rhel8.4", {}, {}, state=dict(state)
+        )
+        self.assertEqual(obj.incompatibilities("16.2", "rhel8.4", state), [])
+
+        other = dict(state, rpmdb="2:def", repos={"baseos": "789"})
+        self.assertEqual(
+            obj.incompatibilities("16.1", "rhel8.2", other),
+            [
+                "resolved for version 16.2",
+                "resolved on rhel8.4",
+                "the installed packages differ",
+                "the appstream repository differs",
+                "the baseos repository differs",
+            ],
+        )
+        self.assertEqual(
+            obj.incompatibilities("16.2", "rhel8.4", dict(state, modules={})),
+            ["the enabled module streams differ"],
+        )
@@ -0,0 +1,248 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import errno
+import fcntl
+import logging
+import os
+import threading
+
+from rhos_bootstrap.constants import DEFAULT_SHARED_CACHE_MAX_MB
+
+LOG = logging.getLogger(__name__)
+
+LOCK_FILE = ".rhos-bootstrap.lock"
+
+
+class SharedCache:
+    """Dnf cache shared between systems
+
+    The cache directory is expected to be on shared storage (e.g. NFS or a
+    bind mounted volume) and is used as dnf's cachedir with keepcache
+    enabled. Systems use POSIX record locks, which work over NFS. The
+    cache lock is shared by every system using the cache and only taken
+    exclusively to evict packages. Each repository has a lock of its own,
+    shared while it is read and exclusive while its metadata or packages
+    are downloaded, so systems only wait for each other on the repositories
+    one of them is fetching. Cached packages are checksum validated before
+    they are reused and the least recently used ones are evicted when the
+    cache grows over its size limit.
+    """
+
+    def __init__(self, path: str, max_size_mb: int = DEFAULT_SHARED_CACHE_MAX_MB):
+        self._path = path
+        self._max_size = max_size_mb * 1024 * 1024
+        # the record locks belong to the process, threads share them
+        self._mutex = threading.Lock()
+        self._locks = {}
+        self.reset_stats()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    def reset_stats(self):
+        self._stats = {
+            "metadata": {"hits": 0, "misses": 0},
+            "packages": {"hits": 0, "misses": 0},
+            "evicted": 0,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "path": self._path,
+            "metadata": dict(self._stats["metadata"]),
+            "packages": dict(self._stats["packages"]),
+            "evicted": self._stats["evicted"],
+        }
+
+    def _state(self, repo_id) -> dict:
+        name = LOCK_FILE if repo_id is None else f".rhos-bootstrap-{repo_id}.lock"
+        with self._mutex:
+            return self._locks.setdefault(
+                name,
+                {
+                    "name": name,
+                    "cond": threading.Condition(),
+                    "file": None,
+                    "mode": None,
+                    "holders": 0,
+                },
+            )
+
+    def _acquire(self, state: dict, mode: int) -> bool:
+        os.makedirs(self._path, exist_ok=True)
+        # pylint: disable=consider-using-with
+        lock_file = open(
+            os.path.join(self._path, state["name"]), "a+", encoding="utf-8"
+        )
+        try:
+            fcntl.lockf(lock_file, mode)
+        except OSError as e:
+            lock_file.close()
+            if mode & fcntl.LOCK_NB and e.errno in (errno.EACCES, errno.EAGAIN):
+                return False
+            raise
+        state["file"] = lock_file
+        state["mode"] = mode & ~fcntl.LOCK_NB
+        return True
+
+    @contextlib.contextmanager
+    def lock(self, repo_id: str = None, shared: bool = False):
+        """Hold the cache lock, or the lock of a repository
+
+        The threads of the process share a lock it already holds, unless it
+        is shared and needed exclusively.
+        """
+        mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        state = self._state(repo_id)
+        with state["cond"]:
+            while state["holders"] and state["mode"] == fcntl.LOCK_SH and not shared:
+                state["cond"].wait()
+            if not state["holders"]:
+                LOG.debug("Waiting for the shared cache lock %s", state["name"])
+                self._acquire(state, mode)
+            state["holders"] += 1
+        try:
+            yield
+        finally:
+            self._release(state)
+
+    def _release(self, state: dict):
+        with state["cond"]:
+            state["holders"] -= 1
+            if not state["holders"]:
+                fcntl.lockf(state["file"], fcntl.LOCK_UN)
+                state["file"].close()
+                state["file"] = None
+                state["cond"].notify_all()
+
+    @contextlib.contextmanager
+    def hold(self, read=(), write=()):
+        """Share the cache lock and hold the locks of the repositories
+
+        The repositories in write are locked exclusively, the ones in read
+        shared. They are always locked in the same order.
+        """
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(self.lock(shared=True))
+            write = set(write)
+            for repo_id in sorted(set(read) | write):
+                stack.enter_context(self.lock(repo_id, shared=repo_id not in write))
+            yield
+
+    def refresh_metadata(self, repos):
+        """Download the expired metadata, one repository at a time"""
+        for repo in repos:
+            # pylint: disable=protected-access
+            if not repo._repo.isExpired():
+                continue
+            with self.hold(write=[repo.id]):
+                repo.load()
+
+    @staticmethod
+    def _repomd_mtime(repo):
+        # pylint: disable=protected-access
+        repomd = os.path.join(repo._repo.getCachedir(), "repodata", "repomd.xml")
+        try:
+            return os.stat(repomd).st_mtime_ns
+        except OSError:
+            return None
+
+    def metadata_snapshot(self, repos) -> dict:
+        return {repo.id: self._repomd_mtime(repo) for repo in repos}
+
+    def record_metadata(self, snapshot: dict, repos):
+        """Count the repositories loaded without downloading their metadata"""
+        for repo in repos:
+            before = snapshot.get(repo.id)
+            if before is not None and before == self._repomd_mtime(repo):
+                self._stats["metadata"]["hits"] += 1
+            else:
+                self._stats["metadata"]["misses"] += 1
+
+    def check_packages(self, pkgs):
+        """Validate the cached packages, removing the corrupted ones"""
+        for pkg in pkgs:
+            path = pkg.localPkg()
+            if not os.path.exists(path):
+                self._stats["packages"]["misses"] += 1
+                continue
+            if not pkg.verifyLocalPkg():
+                LOG.warning("Removing corrupted cached package %s", path)
+                os.unlink(path)
+                self._stats["packages"]["misses"] += 1
+                continue
+            self._stats["packages"]["hits"] += 1
+            # the mtime tracks the last use for the eviction
+            os.utime(path)
+
+    def _usage(self) -> tuple:
+        total = 0
+        packages = []
+        for root, _, files in os.walk(self._path):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                total += stat.st_size
+                if name.endswith(".rpm"):
+                    packages.append((stat.st_mtime_ns, stat.st_size, path))
+        return total, sorted(packages)
+
+    def evict(self, keep: set = None) -> int:
+        """Remove the least recently used packages over the size limit
+
+        The packages are only removed while no other system, or thread,
+        uses the cache. Otherwise the eviction is left to a later run.
+        """
+        if self._usage()[0] <= self._max_size:
+            return 0
+        state = self._state(None)
+        with state["cond"]:
+            if state["holders"] or not self._acquire(
+                state, fcntl.LOCK_EX | fcntl.LOCK_NB
+            ):
+                LOG.info("The shared cache is in use, not evicting packages")
+                return 0
+            state["holders"] += 1
+        try:
+            return self._evict(keep or set())
+        finally:
+            self._release(state)
+
+    def _evict(self, keep: set) -> int:
+        total, packages = self._usage()
+        evicted = 0
+        for _, size, path in packages:
+            if total <= self._max_size:
+                break
+            if path in keep:
+                continue
+            LOG.debug("Evicting %s from the shared cache", path)
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        self._stats["evicted"] += evicted
+        return evicted
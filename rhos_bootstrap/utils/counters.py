@@ -0,0 +1,45 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Process wide counters of the external work of a run"""
+
+import collections
+import threading
+
+# commands run, e.g. subscription-manager
+SUBPROCESSES = "subprocesses"
+# http requests made outside of dnf, e.g. the delorean repo files
+HTTP_REQUESTS = "http_requests"
+# size of the packages dnf downloaded
+DOWNLOAD_BYTES = "download_bytes"
+
+NAMES = (SUBPROCESSES, HTTP_REQUESTS, DOWNLOAD_BYTES)
+
+_LOCK = threading.Lock()
+_COUNTS = collections.Counter()
+
+
+def count(name: str, value: int = 1):
+    with _LOCK:
+        _COUNTS[name] += value
+
+
+def reset():
+    with _LOCK:
+        _COUNTS.clear()
+
+
+def snapshot() -> dict:
+    with _LOCK:
+        return {name: _COUNTS[name] for name in NAMES}
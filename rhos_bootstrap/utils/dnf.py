@@ -12,7 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+# pylint: disable=too-many-lines
+
+import concurrent.futures
+import contextlib
+import fnmatch
+import hashlib
+import json
 import logging
+import multiprocessing
+import os
+import threading
+import time
 import dnf  # pylint: disable=import-error
 import dnf.cli.progress  # pylint: disable=import-error
 import dnf.logging  # pylint: disable=import-error
@@ -21,9 +32,22 @@ import libdnf  # pylint: disable=import-error
 import yaml
 
 from dnf.cli.cli import Cli  # pylint: disable=import-error
+from dnf.exceptions import Error as DnfError  # pylint: disable=import-error
 from dnf.exceptions import MarkingError  # pylint: disable=import-error
 from dnf.yum.rpmtrans import TransactionDisplay  # pylint: disable=import-error
 
+from rhos_bootstrap.constants import DEFAULT_PREFETCH_WORKERS
+from rhos_bootstrap.constants import DEFAULT_UPDATE_BATCH_SIZE
+from rhos_bootstrap.constants import DEFAULT_VERIFY_WORKERS
+from rhos_bootstrap.constants import VERIFIED_PACKAGES_FILE
+from rhos_bootstrap.constants import YUM_REPO_BASE_DIR
+from rhos_bootstrap.exceptions import PackageManifestInvalid
+from rhos_bootstrap.exceptions import StagedTransactionInvalid
+from rhos_bootstrap.utils import counters
+from rhos_bootstrap.utils import memory
+from rhos_bootstrap.utils.plugins import PluginProfiler
+from rhos_bootstrap.utils.transaction import write_json
+
 LOG = logging.getLogger(__name__)
 
 STATE_DEFAULT = libdnf.module.ModulePackageContainer.ModuleState_DEFAULT
@@ -32,6 +56,118 @@ STATE_DISABLED = libdnf.module.ModulePackageContainer.ModuleState_DISABLED
 STATE_UNKNOWN = libdnf.module.ModulePackageContainer.ModuleState_UNKNOWN
 
 
+def installroot_path(installroot: str, path: str) -> str:
+    """path inside installroot, path itself without an installroot"""
+    if not installroot:
+        return path
+    return os.path.join(installroot, path.lstrip(os.sep))
+
+
+# summary entry of the transaction item actions, the packages replaced by
+# an upgrade, a downgrade or a reinstall are left to the rpmdb
+# serializes the metadata downloads of a repository into a cache directory
+_REPO_LOCKS = {}
+_REPO_LOCKS_GUARD = threading.Lock()
+
+
+def _repo_lock(cachedir: str, repo_id: str) -> threading.Lock:
+    with _REPO_LOCKS_GUARD:
+        return _REPO_LOCKS.setdefault((cachedir, repo_id), threading.Lock())
+
+
+def _read_conf(base, installroot=None) -> Cli:
+    """Read the dnf configuration of the host, or of an installroot"""
+    # https://gerrit.ovirt.org/c/otopi/+/112682/9/src/otopi/minidnf.py
+    cli = Cli(base)
+    if installroot:
+        base.conf.installroot = installroot
+        # an empty root has no release package, use the host one
+        cli._read_conf_file("/")  # pylint: disable=protected-access
+        # the repositories are configured once on the host for every root
+        base.conf.reposdir = [YUM_REPO_BASE_DIR]
+    else:
+        cli._read_conf_file()  # pylint: disable=protected-access
+    return cli
+
+
+def _use_throttle(conf, bytes_per_second: int) -> int:
+    """Split a bandwidth cap between the parallel downloads
+
+    librepo throttles every transfer and runs max_parallel_downloads of
+    them. Returns the resulting total rate.
+    """
+    parallel = max(1, int(conf.max_parallel_downloads or 1))
+    per_transfer = max(1, bytes_per_second // parallel) if bytes_per_second else 0
+    conf.throttle = per_transfer
+    return per_transfer * parallel
+
+
+_SUMMARY_ACTIONS = {
+    dnf.transaction.PKG_INSTALL: "install",
+    dnf.transaction.PKG_OBSOLETE: "install",
+    dnf.transaction.PKG_UPGRADE: "upgrade",
+    dnf.transaction.PKG_DOWNGRADE: "upgrade",
+    dnf.transaction.PKG_REINSTALL: "upgrade",
+    dnf.transaction.PKG_REMOVE: "remove",
+    dnf.transaction.PKG_OBSOLETED: "remove",
+}
+
+
+def _transaction_packages(transaction) -> dict:
+    """The packages a resolved transaction installs, upgrades and removes
+
+    Every package is kept, e.g. both arches of a multilib package or a new
+    kernel installed next to an old one being removed.
+    """
+    packages = {"install": [], "upgrade": [], "remove": []}
+    for item in transaction or []:
+        key = _SUMMARY_ACTIONS.get(item.action)
+        if key:
+            packages[key].append(item.pkg)
+    return packages
+
+
+def _transaction_summary(transaction) -> dict:
+    return {
+        key: sorted({str(pkg) for pkg in pkgs})
+        for key, pkgs in _transaction_packages(transaction).items()
+    }
+
+
+def _package_outcome(spec: str, packages: dict) -> str:
+    for key, outcome in (
+        ("upgrade", "upgraded"),
+        ("install", "installed"),
+        ("remove", "removed"),
+    ):
+        if fnmatch.filter({pkg.name for pkg in packages[key]}, spec):
+            return outcome
+    return "unchanged"
+
+
+def _mark_manifest(base, manifest) -> dict:
+    """Mark the intents of a PackageManifest, returns the failed ones outcome"""
+    outcomes = {}
+    base.cmds = []
+    for intent, name in manifest.intents():
+        base.cmds.extend([intent, name])
+        try:
+            if intent == "install":
+                base.install(name)
+                try:
+                    base.upgrade(name)
+                except MarkingError:
+                    LOG.debug("%s being installed, skipping update", name)
+            elif intent == "upgrade":
+                base.upgrade(name)
+            else:
+                base.remove(name)
+        except MarkingError as e:
+            LOG.warning("Unable to %s %s: %s", intent, name, e)
+            outcomes[name] = "not-installed" if intent == "remove" else "not-found"
+    return outcomes
+
+
 class DnfManager:  # pylint: disable=too-many-instance-attributes
     """Dnf management class"""
 
@@ -44,6 +180,22 @@ class DnfManager:  # pylint: disable=too-many-instance-attributes
     default_modules = {}
     disabled_modules = {}
     unknown_modules = {}
+    shared_cache = None
+    _default_cache = None
+    plugin_profiler = None
+    installroot = None
+    # repository ids the sack is limited to, None for every enabled one
+    repo_scope = None
+    skip_filelists = False
+    _default_metadata_types = None
+    # repositories, solvables and load time of the last sack fill
+    sack_stats = None
+    # EventStream of the current run
+    events = None
+    # download bandwidth cap in bytes per second, 0 when unlimited
+    throttle = 0
+    # aggregate rate the per transfer throttle of dnf allows
+    download_rate = 0
 
     class LoggingTransactionDisplay(TransactionDisplay):
         """Display logger
@@ -52,41 +204,193 @@ class DnfManager:  # pylint: disable=too-many-instance-attributes
         to the rhos-bootstrap loggs.
         """
 
-        def __init__(self, logger):
+        def __init__(self, logger, events=None):
             self.log = logger
+            self.events = events
 
         def error(self, message):
             self.log.error(message)
 
+        def progress(
+            self, package, action, ti_done, ti_total, ts_done, ts_total
+        ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+            # pylint: disable=unused-argument
+            if self.events:
+                self.events.progress(
+                    "transaction_progress",
+                    ts_done,
+                    ts_total,
+                    package=str(package),
+                    action=str(dnf.transaction.ACTIONS.get(action, action)),
+                )
+
         def filelog(self, package, action):
             action_str = dnf.transaction.FILE_ACTIONS[action]
             msg = f"{action_str}: {package}"
             self.log.info(msg)
 
     @classmethod
-    def instance(cls):
+    def instance(cls, **kwargs):
+        """The loaded instance, set up with kwargs if there is none
+
+        An instance loaded for another installroot is replaced.
+        """
+        if "installroot" in kwargs and not cls.loaded_for(kwargs["installroot"]):
+            cls.unload()
         if cls._instance is None:
             cls._instance = cls.__new__(cls)
-            cls._instance.setup()
+            cls._instance.setup(**kwargs)
         return cls._instance
 
+    @classmethod
+    def loaded(cls) -> bool:
+        return cls._instance is not None
+
+    @classmethod
+    def loaded_for(cls, installroot: str = None) -> bool:
+        """Whether an instance is loaded for installroot, None for the host"""
+        return cls.loaded() and cls._instance.installroot == installroot
+
+    @classmethod
+    def reset(cls):
+        """Forget the loaded instance, e.g. the one of a parent process"""
+        cls._instance = None
+
+    @classmethod
+    def unload(cls):
+        """Close the loaded instance, the next instance() sets up a new one"""
+        if cls._instance is not None and cls._instance.dnf_base is not None:
+            cls._instance.dnf_base.close()
+        cls._instance = None
+
     def __init__(self):
         raise RuntimeError("Use instance()")
 
-    def setup(self):
+    def setup(
+        self,
+        prefetcher=None,
+        cacheonly=False,
+        shared_cache=None,
+        plugin_profiler=None,
+        installroot=None,
+        repo_scope=None,
+        skip_filelists=False,
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
         self.dnf_base = dnf.Base()
         self.dnf_base.conf.best = True
         self.dnf_base.conf.debuglevel = 0
         self.dnf_base.conf.errorlevel = 2
         self.dnf_base.conf.logfilelevel = 2
-        # https://gerrit.ovirt.org/c/otopi/+/112682/9/src/otopi/minidnf.py
-        self.cli = Cli(self.dnf_base)
-        self.cli._read_conf_file()  # pylint: disable=protected-access
-        self.dnf_base.init_plugins(disabled_glob=[], cli=self.cli)
+        self.cli = _read_conf(self.dnf_base, installroot)
+        self.installroot = installroot
+        self.dnf_base.conf.cacheonly = cacheonly
+        self.use_shared_cache(shared_cache)
+        self.use_repo_scope(repo_scope, skip_filelists)
+        self.plugin_profiler = plugin_profiler or PluginProfiler()
+        policy = self.plugin_profiler.policy
+        start = time.monotonic()
+        self.dnf_base.init_plugins(
+            disabled_glob=policy.disabled_glob,
+            enable_plugins=policy.enable_plugins,
+            cli=self.cli,
+        )
+        self.plugin_profiler.record_init(time.monotonic() - start)
+        self.plugin_profiler.instrument(self._loaded_plugins())
         self.dnf_base.pre_configure_plugins()
         self.dnf_base.read_all_repos()
         self.dnf_base.configure_plugins()
+        self._scope_repos()
         self.module_base = dnf.module.module_base.ModuleBase(self.dnf_base)
+        if prefetcher:
+            # let the background metadata downloads finish before the sack
+            # is filled so they are picked up from the cache
+            prefetcher.wait()
+        self._update_modules()
+
+    def use_shared_cache(self, shared_cache):
+        """Use a SharedCache as the dnf cache, None for the default cache"""
+        conf = self.dnf_base.conf
+        if self._default_cache is None:
+            self._default_cache = (conf.cachedir, conf.system_cachedir, conf.keepcache)
+        self.shared_cache = shared_cache
+        if shared_cache:
+            conf.cachedir = shared_cache.path
+            conf.system_cachedir = shared_cache.path
+            conf.keepcache = True
+        else:
+            conf.cachedir, conf.system_cachedir, conf.keepcache = self._default_cache
+
+    def use_repo_scope(self, repo_ids: list = None, skip_filelists: bool = False):
+        """Limit the sack to repo_ids, None for every enabled repository
+
+        The system repository is always loaded. Without filelists, only the
+        file dependencies on paths listed in the primary metadata (e.g.
+        /etc or bin directories) can be resolved. This takes effect the
+        next time the repositories are read.
+        """
+        self.repo_scope = None if repo_ids is None else set(repo_ids)
+        self.skip_filelists = skip_filelists
+        conf = self.dnf_base.conf
+        types = getattr(conf, "optional_metadata_types", None)
+        if types is None:
+            if skip_filelists:
+                LOG.warning("This dnf version always loads filelists")
+            return
+        if self._default_metadata_types is None:
+            self._default_metadata_types = list(types)
+        conf.optional_metadata_types = [
+            t
+            for t in self._default_metadata_types
+            if not (skip_filelists and t == "filelists")
+        ]
+
+    def _scope_repos(self):
+        if self.repo_scope is None:
+            return
+        for repo in list(self.dnf_base.repos.iter_enabled()):
+            if repo.id not in self.repo_scope:
+                LOG.debug("Not loading %s, it is not used by the run", repo.id)
+                repo.disable()
+
+    def _loaded_plugins(self) -> list:
+        plugins = getattr(self.dnf_base, "_plugins", None)
+        return list(getattr(plugins, "plugins", None) or [])
+
+    def use_throttle(self, bytes_per_second: int):
+        """Cap the download bandwidth of every repository, 0 to lift it
+
+        librepo throttles every transfer and runs max_parallel_downloads
+        of them, the cap is split between them.
+        """
+        self.throttle = bytes_per_second
+        self.download_rate = _use_throttle(self.dnf_base.conf, bytes_per_second)
+
+    def use_plugin_profiler(self, plugin_profiler):
+        """Time and filter the plugin hooks with another PluginProfiler
+
+        The plugins dnf loaded are kept, the policy only skips their hooks.
+        """
+        self.plugin_profiler = plugin_profiler
+        plugin_profiler.instrument(self._loaded_plugins())
+
+    def _cache_lock(self, read=(), write=()):
+        if self.shared_cache:
+            return self.shared_cache.hold(read=read, write=write)
+        return contextlib.ExitStack()
+
+    @property
+    def cacheonly(self) -> bool:
+        return self.dnf_base.conf.cacheonly
+
+    def refresh(self, prefetcher=None, cacheonly=None):
+        """Reload the repository configuration and the sack"""
+        if cacheonly is not None:
+            self.dnf_base.conf.cacheonly = cacheonly
+        self.dnf_base.reset(sack=True, repos=True)
+        self.dnf_base.read_all_repos()
+        self._scope_repos()
+        if prefetcher:
+            prefetcher.wait()
         self._update_modules()
 
     def _build_module_string(self, name, stream=None, profile=None):
@@ -100,7 +404,31 @@ class DnfManager:  # pylint: disable=too-many-instance-attributes
 
     def _update_modules(self):
         self.dnf_base.reset(sack=True)
-        self.dnf_base.fill_sack()
+        repos = list(self.dnf_base.repos.iter_enabled())
+        start = time.monotonic()
+        if self.shared_cache:
+            snapshot = self.shared_cache.metadata_snapshot(repos)
+            if not self.cacheonly:
+                self.shared_cache.refresh_metadata(repos)
+        with self._cache_lock(read=[repo.id for repo in repos]):
+            self.dnf_base.fill_sack()
+        if self.shared_cache:
+            self.shared_cache.record_metadata(snapshot, repos)
+        seconds = round(time.monotonic() - start, 3)
+        types = getattr(self.dnf_base.conf, "optional_metadata_types", None)
+        self.sack_stats = {
+            "scoped": self.repo_scope is not None,
+            "filelists": types is None or "filelists" in types,
+            "repos": len(repos),
+            "solvables": len(self.dnf_base.sack),
+            "seconds": seconds,
+        }
+        LOG.info(
+            "Loaded %d packages from %d repositories in %.3fs",
+            self.sack_stats["solvables"],
+            len(repos),
+            seconds,
+        )
         mods = self.get_all_modules()
         self.all_modules = mods
         self.enabled_modules = {}
@@ -123,30 +451,77 @@ class DnfManager:  # pylint: disable=too-many-instance-attributes
         LOG.debug("Handling package tranaction")
         self.dnf_base.resolve(allow_erasing=True)
         progress = dnf.cli.progress.MultiFileProgressMeter()
-        self.dnf_base.download_packages(self.dnf_base.transaction.install_set, progress)
+        if self.events:
+            progress = DownloadProgressEvents(progress, self.events)
+        install_set = self.dnf_base.transaction.install_set
+        with self._cache_lock():
+            if self.shared_cache:
+                self.shared_cache.check_packages(install_set)
+            missing = [p for p in install_set if not os.path.exists(p.localPkg())]
+            counters.count(
+                counters.DOWNLOAD_BYTES, sum(pkg.downloadsize for pkg in missing)
+            )
+            # only the repositories with packages to download are written
+            with self._cache_lock(write={pkg.repoid for pkg in missing}):
+                self.dnf_base.download_packages(install_set, progress)
+        if self.shared_cache:
+            self.shared_cache.evict(keep={pkg.localPkg() for pkg in install_set})
         if not getattr(self.dnf_base, "package_signature_check", None):
             return
-        for pkg in self.dnf_base.transaction.install_set:
-            res, err = self.dnf_base.package_signature_check(pkg)
-            if res == 1:
+        PackageSignatureVerifier(
+            self.dnf_base,
+            cache_file=installroot_path(self.installroot, VERIFIED_PACKAGES_FILE),
+        ).verify(self.dnf_base.transaction.install_set)
+
+    def transaction_summary(self) -> dict:
+        """Summarize the resolved transaction by package NEVRA"""
+        return _transaction_summary(self.dnf_base.transaction)
+
+    @staticmethod
+    def _repo_checksum(repo) -> str:
+        # pylint: disable=protected-access
+        repomd = os.path.join(repo._repo.getCachedir(), "repodata", "repomd.xml")
+        try:
+            with open(repomd, "rb") as data:
+                return hashlib.sha256(data.read()).hexdigest()
+        except OSError:
+            LOG.debug("Unable to read %s", repomd)
+            return None
+
+    def system_state(self) -> dict:
+        """State a transaction is resolved against
 
-                def _ask(data):
-                    LOG.info("Importing GPG %s-%s", data["userid"], data["hexkeyid"])
-                    return True
+        The rpmdb version, the checksum of the metadata of every enabled
+        repository and the enabled module streams.
+        """
+        return {
+            "rpmdb": self.dnf_base.sack._rpmdb_version(),  # pylint: disable=protected-access
+            "repos": {
+                repo.id: self._repo_checksum(repo)
+                for repo in self.dnf_base.repos.iter_enabled()
+            },
+            "modules": {
+                name: mod["stream"] for name, mod in self.enabled_modules.items()
+            },
+        }
 
-                self.dnf_base.package_import_key(pkg, fullaskcb=_ask)
-            elif res != 0:
-                raise RuntimeError(err)
+    def _commit(self, refresh: bool = True) -> dict:
+        """Commit the resolved transaction
 
-    def _commit(self):
+        Without refresh, the sack still has the installed packages from
+        before the transaction.
+        """
         LOG.warning("Committing changes. This can take a while and ^C may be disabled.")
+        summary = self.transaction_summary()
         try:
-            display = [self.LoggingTransactionDisplay(LOG)]
+            display = [self.LoggingTransactionDisplay(LOG, self.events)]
             self.dnf_base.do_transaction(display)
         except RuntimeError:
             LOG.error("Runtime error, please run as root")
             raise
-        self._update_modules()
+        if refresh:
+            self._update_modules()
+        return summary
 
     def get_all_modules(self):
         # returns a list of libdnf.module.ModulePackage. See docs
@@ -207,12 +582,13 @@ class DnfManager:  # pylint: disable=too-many-instance-attributes
             if stream and stream in self.enabled_modules[name]["stream"]:
                 # already enabled, noop
                 LOG.debug("already enabled")
-                return
+                return False
             self.disable_module(name, self.enabled_modules[name]["stream"])
 
         LOG.debug("calling enable")
         self.module_base.enable([self._build_module_string(name, stream, profile)])
         self._commit()
+        return True
 
     def reset_module(self, name, stream=None, profile=None):
         LOG.debug("calling reset")
@@ -240,16 +616,141 @@ class DnfManager:  # pylint: disable=too-many-instance-attributes
         self.dnf_base.cmds = ["install", name]
         self.dnf_base.install(name)
         self._process_packages()
-        self._commit()
+        summary = self._commit()
         self.dnf_base.cmds = None
+        return summary
 
     def update_package(self, name):
         LOG.debug("Updating package")
         self.dnf_base.cmds = ["upgrade", name]
         self.dnf_base.upgrade(name)
         self._process_packages()
-        self._commit()
+        summary = self._commit()
         self.dnf_base.cmds = None
+        return summary
+
+    def _upgrade_batches(self, names: list, exclude: set) -> list:
+        """(repo id, [(package, obsoletes)]) of the pending upgrades and
+        obsoletes, by repository
+        """
+        query = self.dnf_base.sack.query()
+        installed = query.installed()
+        upgrades = query.upgrades()
+        if names:
+            installed = installed.filter(name=list(names))
+            upgrades = upgrades.filter(name=list(names))
+        obsoletes = query.available().filter(obsoletes=installed).latest()
+        by_repo = {}
+        for pkgs, obsoleting in ((obsoletes, True), (upgrades.latest(), False)):
+            for pkg in pkgs:
+                if str(pkg) not in exclude:
+                    # an upgrade that also obsoletes is marked as an upgrade
+                    by_repo.setdefault(pkg.reponame, {})[str(pkg)] = (pkg, obsoleting)
+        return [
+            (repo_id, [pkgs[nevra] for nevra in sorted(pkgs)])
+            for repo_id, pkgs in sorted(by_repo.items())
+        ]
+
+    def _commit_batch(self, pkgs: list, changed: set) -> dict:
+        """Mark, resolve and commit a batch of _upgrade_batches() packages
+
+        Returns None when the batch needs a fresh sack: it changes packages
+        in changed, or does not pass the transaction check with changed
+        packages. changed is updated with the packages of the commit.
+        """
+        self.dnf_base.cmds = ["upgrade"] + [str(pkg) for pkg, _ in pkgs]
+        for pkg, obsoleting in pkgs:
+            if obsoleting:
+                self.dnf_base.package_install(pkg)
+            else:
+                self.dnf_base.package_upgrade(pkg)
+        summary = None
+        try:
+            self._process_packages()
+            touched = self._changed_packages()
+            if not changed & touched:
+                summary = self._commit(refresh=False)
+                changed |= touched
+        except DnfError:
+            if not changed:
+                raise
+        finally:
+            self.dnf_base.reset(goal=True)
+            self.dnf_base.cmds = None
+        return summary
+
+    def _changed_packages(self) -> set:
+        """name.arch of the packages the resolved transaction changes"""
+        transaction = self.dnf_base.transaction
+        return {
+            f"{pkg.name}.{pkg.arch}"
+            for pkg in list(transaction.install_set) + list(transaction.remove_set)
+        }
+
+    def update_batched(
+        self,
+        memory_budget_mb: int,
+        names: list = None,
+        batch_size: int = DEFAULT_UPDATE_BATCH_SIZE,
+    ) -> list:
+        """Update the system in batches of packages from the same repository
+
+        Every batch is resolved, with the dependencies it needs, and
+        committed before the next one is computed. The batches include the
+        packages obsoleting installed ones. The sack is reused between
+        batches and only reloaded when a batch changes packages a previous
+        batch already changed, or does not pass the transaction check
+        against the stale installed packages. When a batch peaks over the
+        memory budget the following batches are halved. names limits the
+        update to some packages. Returns the repository, packages, peak RSS
+        and transaction summary of each batch.
+        """
+        current = memory.rss_mb()
+        if current and current > memory_budget_mb:
+            LOG.warning(
+                "Already using %sMB, over the %sMB update budget",
+                current,
+                memory_budget_mb,
+            )
+        batches = []
+        attempted = set()
+        # name.arch changed since the sack was filled
+        changed = set()
+        while True:
+            pending = self._upgrade_batches(names, attempted)
+            if not pending:
+                break
+            repo_id, pkgs = pending[0]
+            batch = [str(pkg) for pkg, _ in pkgs[:batch_size]]
+            LOG.info("Updating %d packages from %s", len(batch), repo_id)
+            memory.reset_peak_rss()
+            summary = self._commit_batch(pkgs[:batch_size], changed)
+            if summary is None:
+                LOG.info("Reloading the packages changed by the previous batches")
+                self._update_modules()
+                changed.clear()
+                continue
+            attempted.update(batch)
+            peak = memory.peak_rss_mb()
+            LOG.info("Batch peak RSS: %sMB", peak)
+            batches.append(
+                {
+                    "repo": repo_id,
+                    "packages": batch,
+                    "peak_rss_mb": peak,
+                    "transaction": summary,
+                }
+            )
+            if peak > memory_budget_mb and batch_size > 1:
+                batch_size = max(1, batch_size // 2)
+                LOG.warning(
+                    "Over the %sMB budget, reducing batches to %d packages",
+                    memory_budget_mb,
+                    batch_size,
+                )
+        if changed:
+            self._update_modules()
+        return batches
 
     def install_update_package(self, name):
         LOG.debug("Attempting package install/update")
@@ -261,16 +762,515 @@ class DnfManager:  # pylint: disable=too-many-instance-attributes
         except MarkingError:
             LOG.debug("Packaging being installed, skipping update")
         self._process_packages()
-        self._commit()
+        summary = self._commit()
+        self.dnf_base.cmds = None
+        return summary
+
+    def is_installed(self, name: str) -> bool:
+        return bool(self.dnf_base.sack.query().installed().filter(name=name))
+
+    def upgradable_packages(self, repo_ids: list) -> list:
+        """Names of the installed packages with an upgrade in repo_ids"""
+        query = self.dnf_base.sack.query()
+        upgrades = query.available().filter(reponame=list(repo_ids)).upgrades()
+        return sorted({pkg.name for pkg in upgrades})
+
+    def apply_manifest(
+        self, manifest, download_only: bool = False, expected: dict = None
+    ) -> dict:
+        """Process all the intents of a PackageManifest in one transaction
+
+        Returns the transaction summary and the outcome for each requested
+        package: installed, upgraded, removed, unchanged, not-found or
+        not-installed. With download_only, the packages are downloaded and
+        verified but the transaction is not committed. When expected is
+        provided, the transaction is only committed if it resolves to the
+        same summary.
+        """
+        LOG.debug("Processing package manifest")
+        outcomes = _mark_manifest(self.dnf_base, manifest)
+        self._process_packages()
+        packages = _transaction_packages(self.dnf_base.transaction)
+        for _, name in manifest.intents():
+            if name not in outcomes:
+                outcomes[name] = _package_outcome(name, packages)
+        summary = self.transaction_summary()
+        if expected is not None and summary != expected:
+            self.dnf_base.reset(goal=True)
+            self.dnf_base.cmds = None
+            raise StagedTransactionInvalid("the resolved transaction changed")
+        if download_only:
+            LOG.info("Packages downloaded, not committing the transaction")
+            self.dnf_base.reset(goal=True)
+        elif any(summary.values()):
+            summary = self._commit()
+        else:
+            LOG.info("Nothing to do for the package manifest")
+        self.dnf_base.cmds = None
+        return {"packages": outcomes, "transaction": summary}
+
+    def apply_resolved(self, transaction: dict) -> dict:
+        """Replay a transaction summary by marking its exact packages
+
+        The solver only has to confirm the pinned package set. Raises
+        StagedTransactionInvalid when a package can not be marked or the
+        transaction resolves differently.
+        """
+        LOG.debug("Replaying resolved transaction")
+        self.dnf_base.cmds = ["replay"]
+        try:
+            # installing an exact newer NEVRA upgrades the installed package
+            for nevra in transaction.get("install", []) + transaction.get(
+                "upgrade", []
+            ):
+                self.dnf_base.install(nevra, strict=True)
+            for nevra in transaction.get("remove", []):
+                self.dnf_base.remove(nevra)
+        except MarkingError as e:
+            self.dnf_base.reset(goal=True)
+            self.dnf_base.cmds = None
+            raise StagedTransactionInvalid(str(e)) from e
+        self._process_packages()
+        summary = self.transaction_summary()
+        if summary != transaction:
+            self.dnf_base.reset(goal=True)
+            self.dnf_base.cmds = None
+            raise StagedTransactionInvalid("the resolved transaction changed")
+        if any(summary.values()):
+            summary = self._commit()
         self.dnf_base.cmds = None
+        return summary
 
     def remove_package(self, name):
         LOG.debug("Removing package")
         self.dnf_base.cmds = ["remove", name]
         self.dnf_base.remove(name)
         self._process_packages()
-        self._commit()
+        summary = self._commit()
         self.dnf_base.cmds = None
+        return summary
+
+
+class DownloadProgressEvents:
+    """Emit download progress events next to a dnf progress meter"""
+
+    def __init__(self, meter, events):
+        self._meter = meter
+        self._events = events
+        self._total_files = 0
+        self._total_size = 0
+        self._files = 0
+        self._done = {}
+
+    def start(self, total_files, total_size, total_drpms=0):
+        self._total_files = total_files
+        self._total_size = total_size
+        self._meter.start(total_files, total_size, total_drpms)
+
+    def _emit(self):
+        self._events.progress(
+            "download",
+            sum(self._done.values()),
+            self._total_size,
+            files=self._files,
+            total_files=self._total_files,
+        )
+
+    def progress(self, payload, done):
+        self._meter.progress(payload, done)
+        self._done[id(payload)] = done
+        self._emit()
+
+    def end(self, payload, status, msg):
+        self._meter.end(payload, status, msg)
+        self._files += 1
+        self._done[id(payload)] = payload.download_size
+        self._emit()
+
+
+class PackageManifest:
+    """Package manifest
+
+    Lists the packages to install (or update if already installed), upgrade
+    and remove so they can be handled in a single transaction.
+    """
+
+    INTENTS = ("install", "upgrade", "remove")
+
+    def __init__(self, install: list = None, upgrade: list = None, remove: list = None):
+        self._packages = {
+            "install": list(install or []),
+            "upgrade": list(upgrade or []),
+            "remove": list(remove or []),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        data = data or {}
+        if not isinstance(data, dict):
+            raise PackageManifestInvalid("expected a mapping of intents")
+        unknown = set(data) - set(cls.INTENTS)
+        if unknown:
+            raise PackageManifestInvalid(
+                f"unknown intents {', '.join(sorted(unknown))}"
+            )
+        for intent, names in data.items():
+            if names and not isinstance(names, list):
+                raise PackageManifestInvalid(f"{intent} must be a list")
+        return cls(**{k: [str(n) for n in v or []] for k, v in data.items()})
+
+    @classmethod
+    def from_file(cls, path: str):
+        with open(path, "r", encoding="utf-8") as data:
+            manifest = yaml.safe_load(data.read()) or {}
+        if isinstance(manifest, dict) and "packages" in manifest:
+            manifest = manifest["packages"]
+        return cls.from_dict(manifest)
+
+    @property
+    def install(self) -> list:
+        return self._packages["install"]
+
+    @property
+    def upgrade(self) -> list:
+        return self._packages["upgrade"]
+
+    @property
+    def remove(self) -> list:
+        return self._packages["remove"]
+
+    def __bool__(self):
+        return any(self._packages.values())
+
+    def intents(self) -> list:
+        return [
+            (intent, name) for intent in self.INTENTS for name in self._packages[intent]
+        ]
+
+    def merge(self, other):
+        merged = PackageManifest(**self._packages)
+        for intent, name in other.intents():
+            # pylint: disable=protected-access
+            if name not in merged._packages[intent]:
+                merged._packages[intent].append(name)
+        return merged
+
+    def to_dict(self) -> dict:
+        return {k: list(v) for k, v in self._packages.items()}
+
+
+class DnfMetadataPrefetcher:
+    """Dnf metadata prefetcher
+
+    This class warms the dnf metadata cache for repositories in a bounded
+    pool of worker threads. Repositories can be submitted as soon as their
+    configuration has been written so the metadata downloads overlap the
+    rest of the bootstrap. The later sack fill then loads from the cache.
+
+    The worker bases read the same configuration as the DnfManager, for
+    the same installroot and with the same bandwidth cap. Downloads of a
+    repository into a cache directory are serialized.
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_PREFETCH_WORKERS,
+        shared_cache=None,
+        installroot=None,
+        throttle: int = 0,
+    ):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self._futures = {}
+        self._shared_cache = shared_cache
+        self._installroot = installroot
+        self._throttle = throttle
+
+    def submit(self, repo_ids: list):
+        for repo_id in repo_ids:
+            if repo_id in self._futures:
+                continue
+            LOG.debug("Prefetching metadata for %s", repo_id)
+            self._futures[repo_id] = self._executor.submit(self._fetch, repo_id)
+
+    def _fetch(self, repo_id) -> bool:
+        # each worker gets its own base, they are not safe to share between
+        # threads. The cache directory is shared with the main base.
+        base = dnf.Base()
+        try:
+            _read_conf(base, self._installroot)
+            if self._shared_cache:
+                base.conf.cachedir = self._shared_cache.path
+                base.conf.system_cachedir = self._shared_cache.path
+            if self._throttle:
+                _use_throttle(base.conf, self._throttle)
+            base.read_all_repos()
+            repo = base.repos.get(repo_id)
+            if repo is None:
+                LOG.debug("%s is not a configured repository", repo_id)
+                return False
+            with _repo_lock(base.conf.cachedir, repo_id):
+                if self._shared_cache:
+                    self._shared_cache.refresh_metadata([repo])
+                else:
+                    repo.load()
+            return True
+        finally:
+            base.close()
+
+    def wait(self) -> dict:
+        results = {}
+        for repo_id, future in self._futures.items():
+            try:
+                results[repo_id] = future.result()
+            except Exception as e:  # pylint: disable=broad-except
+                # not fatal, the sack fill will retry the download
+                LOG.warning("Unable to prefetch metadata for %s: %s", repo_id, e)
+                results[repo_id] = False
+        self.close()
+        return results
+
+    def close(self):
+        """Drop the pending prefetches and stop the worker threads"""
+        for future in self._futures.values():
+            future.cancel()
+        self._executor.shutdown(wait=True)
+
+
+class DryRunResolver:
+    """Resolve a whole run against a scratch repository configuration
+
+    A separate dnf base, without plugins, reads the repositories from
+    reposdir. Module streams are switched in memory and the package goals
+    are resolved in one transaction that is neither downloaded nor
+    committed, so the system is left untouched. Problems are collected
+    instead of raised.
+    """
+
+    def __init__(self, reposdir: str, shared_cache=None):
+        self._reposdir = reposdir
+        self._shared_cache = shared_cache
+        self.dnf_base = None
+        self.module_base = None
+        self.problems = []
+
+    def setup(self) -> bool:
+        self.dnf_base = dnf.Base()
+        try:
+            Cli(self.dnf_base)._read_conf_file()  # pylint: disable=protected-access
+            conf = self.dnf_base.conf
+            conf.reposdir = [self._reposdir]
+            if self._shared_cache:
+                conf.cachedir = self._shared_cache.path
+                conf.system_cachedir = self._shared_cache.path
+            self.dnf_base.read_all_repos()
+            if self._shared_cache:
+                repos = list(self.dnf_base.repos.iter_enabled())
+                self._shared_cache.refresh_metadata(repos)
+                with self._shared_cache.hold(read=[repo.id for repo in repos]):
+                    self.dnf_base.fill_sack()
+            else:
+                self.dnf_base.fill_sack()
+        except DnfError as e:
+            self.problems.append(f"Unable to load the repositories: {e}")
+            return False
+        self.module_base = dnf.module.module_base.ModuleBase(self.dnf_base)
+        return True
+
+    def switch_modules(self, modules: list, disable: list = None):
+        """Disable and enable DnfModules in memory"""
+        for mod in disable or []:
+            try:
+                self.module_base.disable([mod.name])
+            except DnfError as e:
+                self.problems.append(f"Unable to disable {mod.name}: {e}")
+        for mod in modules:
+            spec = f"{mod.name}:{mod.stream}"
+            try:
+                # enabling another stream of an enabled module fails
+                self.module_base.reset([mod.name])
+                self.module_base.enable([spec])
+            except DnfError as e:
+                self.problems.append(f"Unable to enable {spec}: {e}")
+
+    def upgradable_packages(self, repo_ids: list) -> list:
+        query = self.dnf_base.sack.query()
+        upgrades = query.available().filter(reponame=list(repo_ids)).upgrades()
+        return sorted({pkg.name for pkg in upgrades})
+
+    def resolve(self, manifest) -> dict:
+        """Predicted transaction, package outcomes and download size"""
+        outcomes = _mark_manifest(self.dnf_base, manifest)
+        for intent, name in manifest.intents():
+            if intent == "install" and outcomes.get(name) == "not-found":
+                self.problems.append(f"No package {name} available")
+        try:
+            self.dnf_base.resolve(allow_erasing=True)
+        except DnfError as e:
+            self.problems.append(f"Unable to resolve the transaction: {e}")
+            return {"transaction": None, "packages": outcomes, "download_size": 0}
+        transaction = self.dnf_base.transaction
+        packages = _transaction_packages(transaction)
+        for _, name in manifest.intents():
+            if name not in outcomes:
+                outcomes[name] = _package_outcome(name, packages)
+        return {
+            "transaction": _transaction_summary(transaction),
+            "packages": outcomes,
+            # already cached packages are not downloaded again
+            "download_size": sum(
+                pkg.downloadsize
+                for pkg in transaction.install_set
+                if not os.path.exists(pkg.localPkg())
+            ),
+        }
+
+    def close(self):
+        if self.dnf_base is not None:
+            self.dnf_base.close()
+            self.dnf_base = None
+
+
+def _check_signature(installroot: str, path: str) -> int:
+    """rpm signature check of a package file, run in a worker process"""
+    transaction = dnf.rpm.transaction.initReadOnlyTransaction(installroot)
+    try:
+        return dnf.rpm.miscutils.checkSig(transaction, path)
+    finally:
+        transaction.close()
+
+
+class PackageSignatureVerifier:  # pylint: disable=too-few-public-methods
+    """Package signature verifier
+
+    This class verifies the signatures of downloaded packages in a pool of
+    worker processes, the same way dnf's package_signature_check() does.
+    The missing GPG keys are imported in one batch, once per repository,
+    before the affected packages are verified again. Packages that did not
+    change since they were last verified, e.g. by a download-only run, are
+    skipped. All failures are reported together, in package order.
+    """
+
+    def __init__(
+        self,
+        dnf_base,
+        workers: int = DEFAULT_VERIFY_WORKERS,
+        cache_file: str = VERIFIED_PACKAGES_FILE,
+    ):
+        self._base = dnf_base
+        self._workers = workers
+        self._cache_file = cache_file
+
+    def _policy(self, pkg) -> tuple:
+        """(gpgcheck, has gpg keys) for the package's repository"""
+        # pylint: disable=protected-access
+        if pkg._from_cmdline:
+            return self._base.conf.localpkg_gpgcheck, False
+        repo = self._base.repos[pkg.repoid]
+        return repo.gpgcheck, bool(repo.gpgkey)
+
+    def _result(self, pkg, sigresult: int) -> tuple:
+        # same mapping as dnf.Base._sig_check_pkg()
+        _, has_key = self._policy(pkg)
+        name = os.path.basename(pkg.localPkg())
+        if sigresult == 0:
+            return 0, ""
+        if sigresult == 1:
+            return (1 if has_key else 2), f"Public key for {name} is not installed"
+        if sigresult == 3:
+            return (1 if has_key else 2), f"Public key for {name} is not trusted"
+        if sigresult == 4:
+            return 2, f"Package {name} is not signed"
+        return 2, f"Problem opening package {name}"
+
+    @staticmethod
+    def _file_key(pkg) -> list:
+        """Cheap key of the package file, None when it is missing
+
+        The repository checksum tells apart another build of the package
+        at the same path of a shared cache, the size and mtime a file
+        rewritten since.
+        """
+        try:
+            stat = os.stat(pkg.localPkg())
+        except OSError:
+            return None
+        return [":".join(pkg.returnIdSum()), stat.st_size, stat.st_mtime_ns]
+
+    def _load_cache(self) -> dict:
+        try:
+            with open(self._cache_file, "r", encoding="utf-8") as cache:
+                return json.load(cache)
+        except (OSError, ValueError) as e:
+            LOG.debug("Verified packages cache not used: %s", e)
+            return {}
+
+    def _save_cache(self, cache: dict):
+        # forget the packages dnf already cleaned up
+        cache = {p: k for p, k in cache.items() if os.path.exists(p)}
+        try:
+            write_json(self._cache_file, cache)
+        except OSError as e:
+            LOG.debug("Unable to write %s: %s", self._cache_file, e)
+
+    def _check(self, pkgs: list) -> dict:
+        root = self._base.conf.installroot
+        paths = [pkg.localPkg() for pkg in pkgs]
+        # daemonic processes, e.g. the installroot workers of a batch, can
+        # not start a pool of their own
+        parallel = not multiprocessing.current_process().daemon
+        if parallel and self._workers > 1 and len(paths) > 1:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(self._workers, len(paths))
+            ) as executor:
+                results = list(
+                    executor.map(_check_signature, [root] * len(paths), paths)
+                )
+        else:
+            results = [_check_signature(root, path) for path in paths]
+        return dict(zip(pkgs, results))
+
+    def _import_keys(self, pkgs: list):
+        def _ask(data):
+            LOG.info("Importing GPG %s-%s", data["userid"], data["hexkeyid"])
+            return True
+
+        # importing the keys of one package imports all its repository keys
+        by_repo = {}
+        for pkg in pkgs:
+            by_repo.setdefault(pkg.repoid, pkg)
+        for repo_id in sorted(by_repo):
+            LOG.info("Importing GPG keys for %s", repo_id)
+            self._base.package_import_key(by_repo[repo_id], fullaskcb=_ask)
+
+    def verify(self, pkgs):
+        cache = self._load_cache()
+        pending = []
+        for pkg in sorted(pkgs, key=str):
+            if not self._policy(pkg)[0]:
+                continue
+            path = pkg.localPkg()
+            if path in cache and cache[path] == self._file_key(pkg):
+                LOG.debug("%s already verified", pkg)
+                continue
+            pending.append(pkg)
+        LOG.info("Verifying %d package signatures", len(pending))
+        results = self._check(pending)
+        missing_keys = [
+            pkg for pkg in pending if self._result(pkg, results[pkg])[0] == 1
+        ]
+        if missing_keys:
+            self._import_keys(missing_keys)
+            results.update(self._check(missing_keys))
+        errors = []
+        for pkg in pending:
+            res, err = self._result(pkg, results[pkg])
+            if res == 0:
+                cache[pkg.localPkg()] = self._file_key(pkg)
+            else:
+                errors.append(err)
+        self._save_cache(cache)
+        if errors:
+            raise RuntimeError("\n".join(errors))
 
 
 class DnfModule:
@@ -0,0 +1,285 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Resource governor
+
+Package downloads and rpm transactions on a running controller compete with
+the services of the node (e.g. Galera or RabbitMQ). The governor lowers the
+priority of the package phases, either with nice and ionice or by moving
+the process to a transient systemd scope with low CPU and IO weights, and
+reports how long the phases waited for CPU and block IO.
+"""
+
+import contextlib
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+
+from rhos_bootstrap.constants import DEFAULT_GOVERNOR_NICE
+from rhos_bootstrap.constants import DEFAULT_GOVERNOR_WEIGHT
+from rhos_bootstrap.utils import counters
+
+LOG = logging.getLogger(__name__)
+
+GOVERNORS = ("priority", "scope")
+
+# best-effort class, lowest priority
+IONICE_CLASS = 2
+IONICE_LEVEL = 7
+IONICE_CLASSES = {"none": 0, "realtime": 1, "best-effort": 2, "idle": 3}
+
+# cgroup v2 weight of the units that do not set one
+DEFAULT_CGROUP_WEIGHT = 100
+
+# {pid: transient scope} the processes were moved to, kept for later runs
+_SCOPES = {}
+
+_RATE = re.compile(r"^\s*(\d+)\s*([kmg]?)\s*$", re.IGNORECASE)
+_RATE_UNITS = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+
+
+def parse_rate(value) -> int:
+    """Bytes per second of a rate such as 512k or 10M, 0 is unlimited"""
+    if value is None:
+        return 0
+    match = _RATE.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid bandwidth {value}, expected e.g. 512k or 10M")
+    return int(match.group(1)) * _RATE_UNITS[match.group(2).lower()]
+
+
+def _thread_id() -> int:
+    # nice and ionice apply to the calling thread, e.g. in the daemon
+    if hasattr(threading, "get_native_id"):
+        return threading.get_native_id()
+    # python < 3.8, the main thread
+    return os.getpid()
+
+
+def thread_delays() -> tuple:
+    """Seconds the thread waited for a CPU and for block IO
+
+    The block IO delay is only accounted with delayacct enabled.
+    """
+    cpu_wait = io_delay = 0.0
+    try:
+        with open("/proc/thread-self/schedstat", "r", encoding="utf-8") as data:
+            cpu_wait = int(data.read().split()[1]) / 1e9
+        with open("/proc/thread-self/stat", "r", encoding="utf-8") as data:
+            # the fields after the command name start with the state, field 3
+            fields = data.read().rsplit(")", 1)[1].split()
+            io_delay = int(fields[42 - 3]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        pass
+    return cpu_wait, io_delay
+
+
+class ResourceGovernor:  # pylint: disable=too-many-instance-attributes
+    """Lower the priority of the package phases of a run"""
+
+    def __init__(
+        self,
+        mode: str = None,
+        nice: int = DEFAULT_GOVERNOR_NICE,
+        weight: int = DEFAULT_GOVERNOR_WEIGHT,
+        bandwidth: int = 0,
+    ):
+        if mode not in GOVERNORS + (None,):
+            raise ValueError(f"Unknown governor {mode}")
+        self._mode = mode
+        self._nice = nice
+        self._weight = weight
+        self._bandwidth = bandwidth
+        # aggregate rate the downloads are held to, see use_download_rate()
+        self._download_rate = bandwidth
+        self._phases = {}
+        self._errors = []
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def bandwidth(self):
+        return self._bandwidth
+
+    def use_download_rate(self, rate: int):
+        """The aggregate rate the bandwidth cap is enforced as, e.g. split
+        between parallel downloads
+        """
+        self._download_rate = rate
+
+    @property
+    def scope(self):
+        return _SCOPES.get(os.getpid())
+
+    def _run(self, cmd: list) -> str:
+        counters.count(counters.SUBPROCESSES)
+        proc = subprocess.run(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=False,
+        )
+        if proc.returncode != 0:
+            raise OSError(f"{' '.join(cmd)} failed: {proc.stderr.strip()}")
+        return proc.stdout
+
+    def _ionice(self, tid: int) -> list:
+        """The ionice arguments that restore the current priority"""
+        # e.g. "best-effort: prio 4", "none: prio 4" or "idle"
+        current = self._run(["ionice", "-p", str(tid)]).strip()
+        name, _, prio = current.partition(": prio ")
+        args = ["-c", str(IONICE_CLASSES.get(name, 0))]
+        if prio and name in ("realtime", "best-effort"):
+            args += ["-n", prio]
+        return args
+
+    @contextlib.contextmanager
+    def _priority(self):
+        tid = _thread_id()
+        old_nice = os.getpriority(os.PRIO_PROCESS, 0)
+        os.setpriority(os.PRIO_PROCESS, 0, max(old_nice, self._nice))
+        old_ionice = None
+        try:
+            old_ionice = self._ionice(tid)
+            self._run(
+                ["ionice", "-c", str(IONICE_CLASS), "-n", str(IONICE_LEVEL)]
+                + ["-p", str(tid)]
+            )
+        except OSError as e:
+            LOG.warning("Unable to lower the IO priority: %s", e)
+            self._errors.append(str(e))
+        try:
+            yield
+        finally:
+            os.setpriority(os.PRIO_PROCESS, 0, old_nice)
+            if old_ionice:
+                try:
+                    self._run(["ionice"] + old_ionice + ["-p", str(tid)])
+                except OSError as e:
+                    LOG.warning("Unable to restore the IO priority: %s", e)
+                    self._errors.append(str(e))
+
+    def _set_weight(self, weight: int):
+        if self.scope is None:
+            name = f"rhos-bootstrap-{os.getpid()}.scope"
+            # move the process to a new scope, it goes away when we exit
+            self._run(
+                [
+                    "busctl",
+                    "call",
+                    "org.freedesktop.systemd1",
+                    "/org/freedesktop/systemd1",
+                    "org.freedesktop.systemd1.Manager",
+                    "StartTransientUnit",
+                    "ssa(sv)a(sa(sv))",
+                    name,
+                    "fail",
+                    "3",
+                    "PIDs",
+                    "au",
+                    "1",
+                    str(os.getpid()),
+                    "CPUWeight",
+                    "t",
+                    str(weight),
+                    "IOWeight",
+                    "t",
+                    str(weight),
+                    "0",
+                ]
+            )
+            _SCOPES[os.getpid()] = name
+            return
+        self._run(
+            [
+                "systemctl",
+                "set-property",
+                "--runtime",
+                self.scope,
+                f"CPUWeight={weight}",
+                f"IOWeight={weight}",
+            ]
+        )
+
+    @contextlib.contextmanager
+    def _cgroup(self):
+        try:
+            self._set_weight(self._weight)
+        except OSError as e:
+            LOG.warning("Unable to lower the CPU and IO weights: %s", e)
+            self._errors.append(str(e))
+            yield
+            return
+        try:
+            yield
+        finally:
+            try:
+                self._set_weight(DEFAULT_CGROUP_WEIGHT)
+            except OSError as e:
+                LOG.warning("Unable to restore the CPU and IO weights: %s", e)
+                self._errors.append(str(e))
+
+    @contextlib.contextmanager
+    def throttled(self, phase: str):
+        """Run a package phase with the lowered priority"""
+        if self._mode is None:
+            yield
+            return
+        LOG.info("Running %s with a lowered %s", phase, self._mode)
+        start = time.monotonic()
+        cpu_wait, io_delay = thread_delays()
+        governed = self._priority() if self._mode == "priority" else self._cgroup()
+        try:
+            with governed:
+                yield
+        finally:
+            end_cpu_wait, end_io_delay = thread_delays()
+            data = self._phases.setdefault(
+                phase,
+                {"seconds": 0.0, "cpu_wait_seconds": 0.0, "io_delay_seconds": 0.0},
+            )
+            for key, value in (
+                ("seconds", time.monotonic() - start),
+                ("cpu_wait_seconds", end_cpu_wait - cpu_wait),
+                ("io_delay_seconds", end_io_delay - io_delay),
+            ):
+                data[key] = round(data[key] + value, 3)
+
+    def report(self, download_bytes: int = 0) -> dict:
+        """The settings and how long the governed phases were held back
+
+        min_download_seconds is the least time the enforced download rate
+        allowed the downloaded packages to take.
+        """
+        rate = self._download_rate if self._bandwidth else 0
+        report = {
+            "mode": self._mode,
+            "phases": {name: dict(data) for name, data in self._phases.items()},
+            "bandwidth": self._bandwidth or None,
+            "download_rate": rate or None,
+            "download_bytes": download_bytes,
+            "min_download_seconds": (round(download_bytes / rate, 3) if rate else None),
+            "errors": list(self._errors),
+        }
+        if self._mode == "priority":
+            report.update(nice=self._nice, ionice=f"best-effort:{IONICE_LEVEL}")
+        elif self._mode == "scope":
+            report.update(scope=self.scope, weight=self._weight)
+        return report
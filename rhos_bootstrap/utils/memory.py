@@ -0,0 +1,60 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Process memory usage from /proc/self"""
+
+import logging
+import resource
+
+LOG = logging.getLogger(__name__)
+
+PROC_STATUS = "/proc/self/status"
+PROC_CLEAR_REFS = "/proc/self/clear_refs"
+
+
+def _status_mb(field: str) -> float:
+    try:
+        with open(PROC_STATUS, "r", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith(f"{field}:"):
+                    # e.g. "VmHWM:	  123456 kB"
+                    return round(int(line.split()[1]) / 1024, 1)
+    except (OSError, ValueError, IndexError) as e:
+        LOG.debug("Unable to read %s from %s: %s", field, PROC_STATUS, e)
+    return None
+
+
+def rss_mb() -> float:
+    """Current resident set size"""
+    return _status_mb("VmRSS")
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size since the last reset_peak_rss()"""
+    peak = _status_mb("VmHWM")
+    if peak is None:
+        # lifetime peak, ru_maxrss is in kB on Linux
+        peak = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return peak
+
+
+def reset_peak_rss() -> bool:
+    try:
+        with open(PROC_CLEAR_REFS, "w", encoding="utf-8") as clear_refs:
+            # 5 resets the peak RSS, linux 4.0+
+            clear_refs.write("5")
+        return True
+    except OSError as e:
+        LOG.debug("Unable to reset the peak RSS: %s", e)
+        return False
@@ -0,0 +1,252 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fnmatch
+import logging
+import urllib.parse
+import yaml
+
+from rhos_bootstrap.exceptions import MirrorConfigInvalid
+
+LOG = logging.getLogger(__name__)
+
+# a rewritten baseurl makes these ignored otherwise
+_MIRROR_KEYS = ("mirrorlist", "metalink")
+
+
+class MirrorRule:
+    """Replace a baseurl host or prefix with local mirrors
+
+    A match containing ``://`` is a url prefix, otherwise it is a host and
+    the scheme and host of the url are replaced. The mirrors are used in
+    order, dnf moves on to the next one when a mirror fails. The original
+    url is kept last unless keep_upstream is disabled. When sections is
+    set, the rule only applies to the repo sections matching one of its
+    glob patterns.
+    """
+
+    def __init__(
+        self,
+        match: str,
+        mirrors: list,
+        sections: list = None,
+        keep_upstream: bool = True,
+    ):
+        self._match = match.rstrip("/")
+        self._mirrors = [m.rstrip("/") for m in mirrors]
+        self._sections = list(sections or [])
+        self._keep_upstream = keep_upstream
+
+    @property
+    def match(self):
+        return self._match
+
+    @property
+    def mirrors(self) -> list:
+        return self._mirrors
+
+    @property
+    def sections(self) -> list:
+        return self._sections
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        if not isinstance(data, dict):
+            raise MirrorConfigInvalid("rules must be mappings")
+        unknown = set(data) - {"match", "mirrors", "sections", "keep_upstream"}
+        if unknown:
+            raise MirrorConfigInvalid(f"unknown rule keys {', '.join(sorted(unknown))}")
+        if not isinstance(data.get("match"), str) or not data["match"]:
+            raise MirrorConfigInvalid("rules need a match")
+        mirrors = data.get("mirrors")
+        if not isinstance(mirrors, list) or not mirrors:
+            raise MirrorConfigInvalid(f"{data['match']} needs a list of mirrors")
+        sections = data.get("sections")
+        if sections is not None and not isinstance(sections, list):
+            raise MirrorConfigInvalid(f"{data['match']} sections must be a list")
+        return cls(
+            data["match"],
+            [str(m) for m in mirrors],
+            sections,
+            bool(data.get("keep_upstream", True)),
+        )
+
+    def applies_to(self, section: str) -> bool:
+        if not self._sections:
+            return True
+        return any(fnmatch.fnmatch(section, pattern) for pattern in self._sections)
+
+    def _suffix(self, url: str) -> str:
+        """The url past the matched part, None if it does not match"""
+        if "://" in self._match:
+            if url == self._match or url.startswith(f"{self._match}/"):
+                return url[len(self._match) :]
+            return None
+        parts = urllib.parse.urlsplit(url)
+        if parts.hostname != self._match:
+            return None
+        return urllib.parse.urlunsplit(("", "", parts.path, parts.query, ""))
+
+    def rewrite(self, url: str) -> list:
+        """The urls to use instead of url, None if the rule does not match"""
+        suffix = self._suffix(url)
+        if suffix is None:
+            return None
+        urls = [f"{mirror}{suffix}" for mirror in self._mirrors]
+        if self._keep_upstream:
+            urls.append(url)
+        return urls
+
+
+class MirrorConfig:
+    """Local mirror configuration
+
+    Loaded from a yaml file such as::
+
+        mirror_map:
+          rdo: http://mirror.example.com/rdo
+        rules:
+          - match: trunk.rdoproject.org
+            mirrors:
+              - http://mirror.example.com/rdo
+              - http://mirror2.example.com/rdo
+          - match: http://mirror.centos.org/centos
+            sections: ["delorean-*-deps", "*-appstream"]
+            mirrors:
+              - http://mirror.example.com/centos
+            keep_upstream: false
+
+    The mirror_map entries override DEFAULT_MIRROR_MAP, which the generated
+    repositories and the delorean repo file downloads are built from. The
+    rules rewrite the baseurl of the sections of fetched repo files, the
+    first rule matching a url is used.
+    """
+
+    def __init__(self, mirror_map: dict = None, rules: list = None):
+        self._mirror_map = dict(mirror_map or {})
+        self._rules = list(rules or [])
+
+    @property
+    def mirror_map(self) -> dict:
+        return self._mirror_map
+
+    @property
+    def rules(self) -> list:
+        return self._rules
+
+    def __bool__(self):
+        return bool(self._mirror_map or self._rules)
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        if data is None:
+            data = {}
+        if not isinstance(data, dict):
+            raise MirrorConfigInvalid("expected a mapping")
+        unknown = set(data) - {"mirror_map", "rules"}
+        if unknown:
+            raise MirrorConfigInvalid(f"unknown keys {', '.join(sorted(unknown))}")
+        mirror_map = data.get("mirror_map")
+        if mirror_map is None:
+            mirror_map = {}
+        if not isinstance(mirror_map, dict):
+            raise MirrorConfigInvalid("mirror_map must be a mapping")
+        rules = data.get("rules")
+        if rules is None:
+            rules = []
+        if not isinstance(rules, list):
+            raise MirrorConfigInvalid("rules must be a list")
+        return cls(
+            {str(k): str(v).rstrip("/") for k, v in mirror_map.items()},
+            [MirrorRule.from_dict(rule) for rule in rules],
+        )
+
+    @classmethod
+    def from_file(cls, path: str):
+        """The configuration in path, empty when it does not exist"""
+        try:
+            with open(path, "r", encoding="utf-8") as data:
+                config = yaml.safe_load(data.read())
+        except FileNotFoundError:
+            LOG.debug("%s does not exist", path)
+            return cls()
+        LOG.debug("Loaded mirror configuration from %s", path)
+        return cls.from_dict(config)
+
+    def mirror(self, key: str) -> str:
+        """The mirror_map override for key, None to use the default"""
+        return self._mirror_map.get(key)
+
+    def rewrite_urls(self, section: str, urls: list) -> list:
+        rewritten = []
+        for url in urls:
+            for rule in self._rules:
+                if not rule.applies_to(section):
+                    continue
+                new_urls = rule.rewrite(url)
+                if new_urls is not None:
+                    LOG.debug("Rewriting %s in [%s] to %s", url, section, new_urls)
+                    rewritten.extend(u for u in new_urls if u not in rewritten)
+                    break
+            else:
+                if url not in rewritten:
+                    rewritten.append(url)
+        return rewritten
+
+    def rewrite(self, data: str) -> str:
+        """Rewrite the baseurl of the sections of a repo file
+
+        Everything but the baseurl lines is kept as is. Sections with a
+        rewritten baseurl lose their mirrorlist and metalink, which dnf
+        would use instead of the baseurl.
+        """
+        if not self._rules:
+            return data
+        lines = data.splitlines(keepends=True)
+        out = []
+        rewritten = set()
+        section = None
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            i += 1
+            stripped = line.strip()
+            if stripped.startswith("[") and stripped.endswith("]"):
+                section = stripped[1:-1].strip()
+            key, sep, value = line.partition("=")
+            if section is None or not sep or line[:1].isspace():
+                out.append((section, line))
+                continue
+            if key.strip() != "baseurl":
+                out.append((section, line))
+                continue
+            urls = value.replace(",", " ").split()
+            raw = [line]
+            # multi-line values continue on indented lines
+            while i < len(lines) and lines[i][:1].isspace() and lines[i].strip():
+                urls.extend(lines[i].replace(",", " ").split())
+                raw.append(lines[i])
+                i += 1
+            new_urls = self.rewrite_urls(section, urls)
+            if new_urls == urls:
+                out.extend((section, r) for r in raw)
+                continue
+            rewritten.add(section)
+            out.append((section, f"baseurl={' '.join(new_urls)}\n"))
+        return "".join(
+            line
+            for section, line in out
+            if section not in rewritten
+            or line.partition("=")[0].strip() not in _MIRROR_KEYS
+        )
@@ -0,0 +1,92 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import time
+
+from rhos_bootstrap.constants import DELOREAN_PINS_FILE
+from rhos_bootstrap.utils.transaction import write_json
+
+LOG = logging.getLogger(__name__)
+
+
+class DeloreanPins:
+    """Hashes the symlinked delorean repos are pinned to
+
+    The first run resolves e.g. current-tripleo to the hash it points to
+    and records it. Runs using the same pins file, which can be copied to
+    or shared with the other systems, use the same immutable repo.
+    """
+
+    def __init__(self, path: str = DELOREAN_PINS_FILE, pins: dict = None):
+        self._path = path
+        self._pins = dict(pins or {})
+
+    @property
+    def path(self):
+        return self._path
+
+    @classmethod
+    def load(cls, path: str = DELOREAN_PINS_FILE):
+        try:
+            with open(path, "r", encoding="utf-8") as data:
+                pins = json.load(data)
+        except FileNotFoundError:
+            return cls(path)
+        except ValueError as e:
+            LOG.warning("Ignoring corrupted %s: %s", path, e)
+            return cls(path)
+        return cls(path, pins if isinstance(pins, dict) else {})
+
+    def get(self, key: str) -> str:
+        pin = self._pins.get(key)
+        return pin["hash"] if pin else None
+
+    def set(self, key: str, repo_hash: str):
+        self._pins[key] = {"hash": repo_hash, "pinned": time.time()}
+
+    def to_dict(self) -> dict:
+        return {key: pin["hash"] for key, pin in sorted(self._pins.items())}
+
+    def save(self):
+        write_json(self._path, self._pins)
+
+    def apply(self, repos: list, save: bool = True) -> dict:
+        """Pin the pinnable repos, resolving and recording the new pins
+
+        Returns the {pin key: hash} used for the repos. Without save the
+        new pins are used but not recorded.
+        """
+        used = {}
+        changed = False
+        for repo in repos:
+            if not getattr(repo, "pinnable", False):
+                continue
+            repo_hash = self.get(repo.pin_key)
+            if repo_hash is None:
+                repo_hash = repo.resolve_pin()
+                if repo_hash is None:
+                    LOG.warning("Unable to pin %s, using it as is", repo.pin_key)
+                    continue
+                LOG.info("Pinned %s to %s", repo.pin_key, repo_hash)
+                self.set(repo.pin_key, repo_hash)
+                changed = True
+            else:
+                LOG.info("Using %s pinned to %s", repo.pin_key, repo_hash)
+            repo.pin(repo_hash)
+            used[repo.pin_key] = repo_hash
+        if changed and save:
+            self.save()
+        return used
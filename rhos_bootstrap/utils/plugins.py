@@ -0,0 +1,151 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fnmatch
+import functools
+import logging
+import time
+
+LOG = logging.getLogger(__name__)
+
+# dnf.Plugin hooks, called by dnf for every loaded plugin
+HOOKS = ("pre_config", "config", "sack", "resolved", "pre_transaction", "transaction")
+
+
+def _plugin_name(plugin) -> str:
+    return getattr(plugin, "name", None) or type(plugin).__name__
+
+
+class PluginPolicy:
+    """Which dnf plugins run in which bootstrap phase
+
+    Rules are ``[PHASE:]GLOB`` strings matched against the plugin names.
+    Without a phase a rule applies to every phase and also decides which
+    plugins dnf loads at all. A plugin matching a deny rule does not run,
+    and when allow rules apply to a phase only the plugins matching one of
+    them run in it.
+    """
+
+    def __init__(self, allow: list = None, deny: list = None):
+        self._allow = [self._parse(rule) for rule in allow or []]
+        self._deny = [self._parse(rule) for rule in deny or []]
+
+    @staticmethod
+    def _parse(rule: str) -> tuple:
+        phase, sep, glob = rule.rpartition(":")
+        if not glob or (sep and not phase):
+            raise ValueError(f"Invalid plugin rule {rule}, expected [PHASE:]GLOB")
+        return (phase or None, glob)
+
+    def __bool__(self):
+        return bool(self._allow or self._deny)
+
+    @staticmethod
+    def _globs(rules: list, phase: str = None) -> list:
+        return [glob for rule_phase, glob in rules if rule_phase in (None, phase)]
+
+    @property
+    def disabled_glob(self) -> list:
+        """Plugins dnf should not load"""
+        if self._globs(self._allow):
+            return ["*"]
+        return self._globs(self._deny)
+
+    @property
+    def enable_plugins(self) -> list:
+        """Plugins dnf should load even when disabled by its configuration"""
+        return self._globs(self._allow)
+
+    def allowed(self, name: str, phase: str) -> bool:
+        if any(fnmatch.fnmatch(name, g) for g in self._globs(self._deny, phase)):
+            return False
+        allow = self._globs(self._allow, phase)
+        return not allow or any(fnmatch.fnmatch(name, g) for g in allow)
+
+
+class PluginProfiler:
+    """Time the dnf plugin hooks and skip the ones a policy denies
+
+    The hooks of the loaded plugin instances are wrapped. The time spent
+    in each hook of each plugin is recorded along with the phase it ran
+    in, the phase is set by the caller as it moves on.
+    """
+
+    def __init__(self, policy: PluginPolicy = None):
+        self._policy = policy or PluginPolicy()
+        self.phase = None
+        self._init = 0.0
+        self._timings = {}
+        self._skipped = {}
+
+    @property
+    def policy(self) -> PluginPolicy:
+        return self._policy
+
+    def record_init(self, seconds: float):
+        # dnf instantiates the plugins in a single pass
+        self._init += seconds
+
+    def _record(self, name: str, hook: str, seconds: float):
+        hooks = self._timings.setdefault(name, {})
+        timing = hooks.setdefault(hook, {"calls": 0, "seconds": 0.0})
+        timing["calls"] += 1
+        timing["seconds"] += seconds
+
+    def _wrap(self, plugin, hook: str):
+        # bound to the class method so instrumenting again does not nest
+        original = functools.partial(getattr(type(plugin), hook), plugin)
+        name = _plugin_name(plugin)
+
+        def _hook():
+            if not self._policy.allowed(name, self.phase):
+                skipped = self._skipped.setdefault(name, [])
+                if self.phase not in skipped:
+                    LOG.debug("Skipping dnf plugin %s in %s", name, self.phase)
+                    skipped.append(self.phase)
+                return None
+            start = time.monotonic()
+            try:
+                return original()
+            finally:
+                self._record(name, hook, time.monotonic() - start)
+
+        return _hook
+
+    def instrument(self, plugins: list):
+        for plugin in plugins:
+            for hook in HOOKS:
+                if hasattr(type(plugin), hook):
+                    setattr(plugin, hook, self._wrap(plugin, hook))
+
+    def report(self) -> dict:
+        plugins = {}
+        for name, hooks in sorted(self._timings.items()):
+            plugins[name] = {
+                hook: {"calls": t["calls"], "seconds": round(t["seconds"], 3)}
+                for hook, t in hooks.items()
+            }
+        return {
+            "init": round(self._init, 3),
+            "plugins": plugins,
+            "skipped": {name: list(p) for name, p in sorted(self._skipped.items())},
+        }
+
+    def costliest(self, count: int = 3) -> list:
+        """(name, seconds) of the plugins that took the most time"""
+        totals = [
+            (name, sum(t["seconds"] for t in hooks.values()))
+            for name, hooks in self._timings.items()
+        ]
+        return sorted(totals, key=lambda t: t[1], reverse=True)[:count]
@@ -0,0 +1,157 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""CPU and memory profiles of the phases of a run
+
+Every phase is run under cProfile and tracemalloc. The profile of a phase
+is written as NN-<phase>.prof (pstats), NN-<phase>.tracemalloc (a
+tracemalloc snapshot) and NN-<phase>.json with the peak memory and the top
+allocations, NN being the order of the phase in the run.
+"""
+
+import contextlib
+import cProfile
+import glob
+import json
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+
+from rhos_bootstrap.utils.transaction import write_json
+
+LOG = logging.getLogger(__name__)
+
+# frames kept per allocation
+TRACEMALLOC_FRAMES = 10
+# allocations recorded per phase
+TOP_ALLOCATIONS = 25
+
+_IGNORED_ALLOCATIONS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class PhaseProfiler:
+    """Write a CPU and a memory profile for every phase of a run"""
+
+    def __init__(self, directory: str):
+        self._directory = directory
+        self._count = 0
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def _remove_previous(self):
+        """Remove the profiles of a previous run in the directory"""
+        for ext in ("prof", "tracemalloc", "json"):
+            pattern = os.path.join(self._directory, f"[0-9][0-9]-*.{ext}")
+            for path in glob.glob(pattern):
+                os.unlink(path)
+
+    def _write(self, base: str, profile, snapshot, memory: dict):
+        os.makedirs(self._directory, exist_ok=True)
+        profile.dump_stats(f"{base}.prof")
+        snapshot.dump(f"{base}.tracemalloc")
+        top = snapshot.filter_traces(_IGNORED_ALLOCATIONS).statistics("lineno")
+        memory["top_allocations"] = [
+            {
+                "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "bytes": stat.size,
+                "count": stat.count,
+            }
+            for stat in top[:TOP_ALLOCATIONS]
+        ]
+        write_json(f"{base}.json", memory)
+
+    @contextlib.contextmanager
+    def profile(self, phase: str):
+        self._count += 1
+        if self._count == 1:
+            with contextlib.suppress(OSError):
+                self._remove_previous()
+        base = os.path.join(self._directory, f"{self._count:02d}-{phase}")
+        # leave a trace started by the caller running
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        elif hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        profile = cProfile.Profile()
+        start = time.monotonic()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            memory = {"phase": phase, "seconds": round(time.monotonic() - start, 3)}
+            memory["current_bytes"], memory["peak_bytes"] = (
+                tracemalloc.get_traced_memory()
+            )
+            snapshot = tracemalloc.take_snapshot()
+            if started:
+                tracemalloc.stop()
+            try:
+                self._write(base, profile, snapshot, memory)
+                LOG.debug("Wrote the %s profile to %s.*", phase, base)
+            except OSError as e:
+                LOG.warning("Unable to write the %s profile: %s", phase, e)
+
+
+def _hotspots(path: str, top: int) -> list:
+    stats = pstats.Stats(path)
+    # {(file, line, function): (primitive calls, calls, own, cumulative, callers)}
+    functions = sorted(
+        stats.stats.items(),  # pylint: disable=no-member
+        key=lambda item: item[1][2],
+        reverse=True,
+    )
+    return [
+        {
+            "function": f"{func} ({filename}:{line})",
+            "calls": calls,
+            "seconds": round(own, 6),
+            "cumulative_seconds": round(cumulative, 6),
+        }
+        for (filename, line, func), (_, calls, own, cumulative, _) in functions[:top]
+    ]
+
+
+def summarize(directory: str, top: int = 10) -> list:
+    """The phases profiled in directory with their top hotspots
+
+    Hotspots are the functions with the most time spent in their own code,
+    allocations the source lines holding the most memory at the end of the
+    phase.
+    """
+    phases = []
+    for path in sorted(glob.glob(os.path.join(directory, "[0-9][0-9]-*.json"))):
+        with open(path, "r", encoding="utf-8") as data:
+            memory = json.load(data)
+        base = path[: -len(".json")]
+        summary = {
+            "phase": memory["phase"],
+            "seconds": memory["seconds"],
+            "peak_bytes": memory["peak_bytes"],
+            "hotspots": [],
+            "allocations": memory["top_allocations"][:top],
+        }
+        if os.path.exists(f"{base}.prof"):
+            summary["hotspots"] = _hotspots(f"{base}.prof", top)
+        phases.append(summary)
+    return phases
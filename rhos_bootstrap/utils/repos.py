@@ -12,16 +12,45 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import configparser
+import logging
 import os
+import re
+import shutil
 import requests
 
+from rhos_bootstrap.utils import counters
 from rhos_bootstrap.utils.rhsm import SubscriptionManager
 from rhos_bootstrap.constants import DEFAULT_MIRROR_MAP
 from rhos_bootstrap.constants import CENTOS_RELEASE_MAP
 from rhos_bootstrap.constants import CENTOS_REPO_MAP
 from rhos_bootstrap.constants import CENTOS_SIG_LIST
+from rhos_bootstrap.constants import HTTP_TIMEOUT
+from rhos_bootstrap.constants import RHSM_REPO_FILE
 from rhos_bootstrap.constants import YUM_REPO_BASE_DIR
 from rhos_bootstrap.exceptions import DistroNotSupported, RepositoryNotSupported
+from rhos_bootstrap.exceptions import RepositoryUnavailable
+from rhos_bootstrap.utils.mirrors import MirrorConfig
+
+LOG = logging.getLogger(__name__)
+
+# commit hashes, or the aggregate hash of component repos
+_DELOREAN_HASH = re.compile(r"^[0-9a-f]{4}[0-9a-f_]*$")
+_DELOREAN_HASH_PATH = re.compile(r"/([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f_]{5,})")
+
+
+def _remove_repo_file(repo_dir: str, name: str):
+    repo_path = os.path.join(repo_dir, f"{name}.repo")
+    if os.path.isfile(repo_path):
+        os.unlink(repo_path)
+
+
+def _read_repo_file(repo_dir: str, name: str) -> str:
+    try:
+        with open(os.path.join(repo_dir, f"{name}.repo"), "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
 
 
 class RhsmRepo:  # pylint: disable=too-few-public-methods
@@ -35,9 +64,25 @@ class RhsmRepo:  # pylint: disable=too-few-public-methods
     def name(self):
         return self._name
 
+    @property
+    def repo_ids(self) -> list:
+        return [self._name]
+
     def save(self):
         self._rhsm.repos(enable=[self._name])
 
+    def remove(self):
+        self._rhsm.repos(disable=[self._name])
+
+    def is_configured(self, repo_file: str = RHSM_REPO_FILE) -> bool:
+        # subscription-manager keeps redhat.repo in sync with the enabled repos
+        parser = configparser.ConfigParser(interpolation=None, strict=False)
+        try:
+            parser.read(repo_file, encoding="utf-8")
+        except configparser.Error:
+            return False
+        return parser.get(self._name, "enabled", fallback="0") == "1"
+
 
 class BaseYumRepo:  # pylint: disable=too-many-instance-attributes
     """Base repo object for yum"""
@@ -66,6 +111,10 @@ class BaseYumRepo:  # pylint: disable=too-many-instance-attributes
     def name(self):
         return self._name
 
+    @property
+    def repo_ids(self) -> list:
+        return [self._name]
+
     @property
     def description(self):
         return self._description
@@ -137,6 +186,12 @@ class BaseYumRepo:  # pylint: disable=too-many-instance-attributes
         with open(repo_path, "w", encoding="utf-8") as f:
             f.write(str(self))
 
+    def remove(self, repo_dir: str = YUM_REPO_BASE_DIR):
+        _remove_repo_file(repo_dir, self.name)
+
+    def is_configured(self, repo_dir: str = YUM_REPO_BASE_DIR) -> bool:
+        return _read_repo_file(repo_dir, self.name) == str(self)
+
 
 class TripleoCephRepo(BaseYumRepo):
     """Upstream Ceph Repo"""
@@ -195,7 +250,7 @@ class TripleoCentosRepo(BaseYumRepo):
         )
 
 
-class TripleoDeloreanRepos:
+class TripleoDeloreanRepos:  # pylint: disable=too-many-instance-attributes
     """Upstream RDO Repo"""
 
     def __init__(
@@ -203,15 +258,24 @@ class TripleoDeloreanRepos:
         distro: str,
         version: str,
         repo: str,
-        mirror: str = DEFAULT_MIRROR_MAP["rdo"],
+        mirror: str = None,
+        mirrors: MirrorConfig = None,
     ) -> None:
+        if mirror is None:
+            mirror = DEFAULT_MIRROR_MAP["rdo"]
+        self._mirrors = mirrors
         self._base_uri = f"{mirror}/{distro}-{version}"
         if repo == "deps":
             uri = f"{self._base_uri}/delorean-deps.repo"
         else:
             uri = f"{self._base_uri}/{repo}/delorean.repo"
         self._name = f"tripleo-delorean-{repo}"
-        self._repo_data = self._get_repo(uri)
+        self._uri = uri
+        self._repo_data = None
+        self._pin_key = f"{distro}-{version}/{repo}"
+        # delorean-deps.repo is not a symlinked repo
+        self._pinnable = repo != "deps"
+        self._pinned = None
 
     @property
     def name(self) -> str:
@@ -219,14 +283,85 @@ class TripleoDeloreanRepos:
 
     @property
     def repo_data(self) -> str:
+        # only fetched when needed, removing the repo does not need it
+        if self._repo_data is None:
+            self._repo_data = self._get_repo(self._uri)
         return self._repo_data
 
-    def _get_repo(self, uri) -> str:
-        r = requests.get(uri)
-        r.raise_for_status()
-        # NOTE(mwhahaha): May want to inject mirror here
+    @property
+    def repo_ids(self) -> list:
+        # the fetched repo file may define multiple repositories
+        parser = configparser.ConfigParser(interpolation=None, strict=False)
+        parser.read_string(self.repo_data)
+        return parser.sections()
+
+    @property
+    def pin_key(self) -> str:
+        return self._pin_key
+
+    @property
+    def pinnable(self) -> bool:
+        return self._pinnable
+
+    @property
+    def pinned(self) -> str:
+        """The hash the repo is pinned to, None when it is not"""
+        return self._pinned
+
+    def resolve_pin(self) -> str:
+        """The immutable hash the symlinked repo currently points to
+
+        The hash is read from delorean.repo.md5. If it is not available, it
+        is taken from the repo file when all its baseurls share one hash.
+        """
+        if not self._pinnable:
+            return None
+        try:
+            repo_hash = self._get(f"{self._uri}.md5").strip()
+        except RepositoryUnavailable as e:
+            if not isinstance(e.__cause__, requests.HTTPError):
+                raise
+            repo_hash = None
+        if repo_hash and _DELOREAN_HASH.match(repo_hash):
+            return repo_hash
+        LOG.debug("No usable %s.md5, looking for the hash in the repo", self._uri)
+        hashes = set()
+        for match in _DELOREAN_HASH_PATH.finditer(self.repo_data):
+            if match.group(3).startswith(match.group(1) + match.group(2)):
+                hashes.add(match.group(3))
+        if len(hashes) == 1:
+            return hashes.pop()
+        return None
+
+    def pin(self, repo_hash: str):
+        """Use the immutable hashed repo instead of the symlink"""
+        if not self._pinnable:
+            raise ValueError(f"{self._pin_key} can not be pinned")
+        if not _DELOREAN_HASH.match(repo_hash):
+            raise ValueError(f"Invalid delorean hash {repo_hash}")
+        self._uri = (
+            f"{self._base_uri}/{repo_hash[:2]}/{repo_hash[2:4]}/{repo_hash}"
+            "/delorean.repo"
+        )
+        self._pinned = repo_hash
+        self._repo_data = None
+
+    @staticmethod
+    def _get(uri) -> str:
+        counters.count(counters.HTTP_REQUESTS)
+        try:
+            r = requests.get(uri, timeout=HTTP_TIMEOUT)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            raise RepositoryUnavailable(uri, str(e)) from e
         return r.text
 
+    def _get_repo(self, uri) -> str:
+        text = self._get(uri)
+        if self._mirrors:
+            return self._mirrors.rewrite(text)
+        return text
+
     def __str__(self) -> str:
         return self.repo_data
 
@@ -240,3 +375,86 @@ class TripleoDeloreanRepos:
             raise PermissionError(f"{repo_path} is not writable")
         with open(repo_path, "w", encoding="utf-8") as f:
             f.write(str(self))
+
+    def remove(self, repo_dir: str = YUM_REPO_BASE_DIR):
+        _remove_repo_file(repo_dir, self.name)
+
+    def is_configured(self, repo_dir: str = YUM_REPO_BASE_DIR) -> bool:
+        data = _read_repo_file(repo_dir, self.name)
+        if data is None:
+            return False
+        # a symlinked repo moves on, the file may point to an older hash
+        return data == self.repo_data
+
+
+def _render_rhsm_repos(
+    target_dir: str, repos: list, removed: list, reset_rhsm: bool, rhsm_repo_file: str
+) -> list:
+    problems = []
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    try:
+        parser.read(rhsm_repo_file, encoding="utf-8")
+    except configparser.Error as e:
+        problems.append(f"Unable to read {rhsm_repo_file}: {e}")
+    if reset_rhsm:
+        for section in parser.sections():
+            parser.set(section, "enabled", "0")
+    for repo in removed:
+        if isinstance(repo, RhsmRepo) and parser.has_section(repo.name):
+            parser.set(repo.name, "enabled", "0")
+    for repo in repos:
+        if not isinstance(repo, RhsmRepo):
+            continue
+        if parser.has_section(repo.name):
+            parser.set(repo.name, "enabled", "1")
+        else:
+            problems.append(f"{repo.name} is not available from subscription-manager")
+    if parser.sections():
+        rhsm_file_name = os.path.basename(rhsm_repo_file)
+        with open(
+            os.path.join(target_dir, rhsm_file_name), "w", encoding="utf-8"
+        ) as out:
+            parser.write(out)
+    return problems
+
+
+def render_repos(
+    target_dir: str,
+    repos: list,
+    *,
+    removed: list = None,
+    reset_rhsm: bool = False,
+    repo_dir: str = YUM_REPO_BASE_DIR,
+    rhsm_repo_file: str = RHSM_REPO_FILE,
+) -> list:
+    """Write the repository configuration a run would produce to target_dir
+
+    The existing repository files are copied, the removed repositories are
+    left out and the new ones are saved. subscription-manager is not run,
+    the RHSM repositories are enabled or disabled in a copy of redhat.repo.
+    Returns the problems found, e.g. a repository that is not available.
+    """
+    removed = removed or []
+    skipped = {os.path.basename(rhsm_repo_file)}
+    skipped.update(
+        f"{repo.name}.repo" for repo in removed if not isinstance(repo, RhsmRepo)
+    )
+    try:
+        names = sorted(os.listdir(repo_dir))
+    except OSError:
+        names = []
+    for name in names:
+        if name.endswith(".repo") and name not in skipped:
+            shutil.copy(os.path.join(repo_dir, name), target_dir)
+    problems = _render_rhsm_repos(
+        target_dir, repos, removed, reset_rhsm, rhsm_repo_file
+    )
+    for repo in repos:
+        if isinstance(repo, RhsmRepo):
+            continue
+        try:
+            repo.save(target_dir)
+        except Exception as e:  # pylint: disable=broad-except
+            # e.g. a delorean repo that can not be fetched
+            problems.append(f"Unable to configure {repo.name}: {e}")
+    return problems
@@ -12,9 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
+import json
 import logging
 import shutil
 import subprocess
+import time
+
+from rhos_bootstrap.utils import counters
 
 from rhos_bootstrap.exceptions import (
     SubscriptionManagerConfigError,
@@ -23,12 +28,55 @@ from rhos_bootstrap.exceptions import (
 
 LOG = logging.getLogger(__name__)
 
+BACKENDS = ("auto", "dbus", "cli")
+
+RHSM_BUS_NAME = "com.redhat.RHSM1"
+# (object path, interface) of the rhsm D-Bus service
+ENTITLEMENT_SERVICE = ("/com/redhat/RHSM1/Entitlement", "com.redhat.RHSM1.Entitlement")
+
+
+class DbusTransport:  # pylint: disable=too-few-public-methods
+    """Client of the rhsm D-Bus API
+
+    The rhsm service answers from the already running rhsm daemon, without
+    starting an interpreter and loading the configuration for every call.
+    Only the entitlement status is read from it, the release and the
+    repositories are managed by the subscription-manager cli.
+    """
+
+    def __init__(self, bus=None):
+        if bus is None:
+            import dbus  # pylint: disable=import-outside-toplevel,import-error
+
+            bus = dbus.SystemBus()
+        self._bus = bus
+
+    def _call(self, service: tuple, method: str, *args):
+        path, interface = service
+        proxy = self._bus.get_object(RHSM_BUS_NAME, path)
+        return getattr(proxy, method)(*args, dbus_interface=interface)
+
+    def status(self) -> dict:
+        """{"status": ..., "valid": ..., "reasons": ...}"""
+        return json.loads(str(self._call(ENTITLEMENT_SERVICE, "GetStatus", "", "")))
+
 
 class SubscriptionManager:
-    """Subscription manager interactions"""
+    """Subscription manager interactions
+
+    The status is read over the rhsm D-Bus API when it is available, the
+    subscription-manager cli is used for everything else and as the
+    fallback. The latency of the calls is recorded per backend.
+    """
 
     _instance = None
     _exe = None
+    _backend = "auto"
+    # injected D-Bus bus, the system bus when None
+    _bus = None
+    # DbusTransport, None until connected and False when not available
+    _dbus = None
+    _stats = None
 
     def __init__(self):
         raise RuntimeError("Use instance()")
@@ -37,6 +85,7 @@ class SubscriptionManager:
     def instance(cls):
         if cls._instance is None:
             cls._instance = cls.__new__(cls)
+            cls._instance.set_backend("auto")
         return cls._instance
 
     @property
@@ -47,9 +96,73 @@ class SubscriptionManager:
                 raise Exception("subscription-manager not available in PATH")
         return self._exe
 
+    @property
+    def backend(self) -> str:
+        return self._backend
+
+    def set_backend(self, backend: str, bus=None):
+        """Use the dbus or cli backend, auto uses dbus when available
+
+        bus replaces the D-Bus system bus, e.g. with a stand-in for tests.
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown rhsm backend {backend}")
+        self._backend = backend
+        self._bus = bus
+        self._dbus = None
+        self.reset_stats()
+
+    @classmethod
+    def use_backend(cls, backend: str):
+        """Select the backend of a run, keeping an already connected one"""
+        obj = cls.instance()
+        if obj.backend != backend:
+            obj.set_backend(backend)
+        obj.reset_stats()
+
+    @classmethod
+    def call_stats(cls) -> dict:
+        return cls._instance.stats() if cls._instance else {}
+
+    def reset_stats(self):
+        self._stats = {}
+
+    def stats(self) -> dict:
+        """{backend: {method: {"calls": count, "seconds": total}}}"""
+        return {
+            backend: {method: dict(data) for method, data in methods.items()}
+            for backend, methods in self._stats.items()
+        }
+
+    @contextlib.contextmanager
+    def _timed(self, backend: str, method: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            data = self._stats.setdefault(backend, {}).setdefault(
+                method, {"calls": 0, "seconds": 0.0}
+            )
+            data["calls"] += 1
+            data["seconds"] = round(data["seconds"] + time.monotonic() - start, 6)
+
+    def _get_dbus(self) -> DbusTransport:
+        if self._backend == "cli":
+            return None
+        if self._dbus is None:
+            try:
+                self._dbus = DbusTransport(self._bus)
+            except Exception as e:  # pylint: disable=broad-except
+                if self._backend == "dbus":
+                    raise SubscriptionManagerFailure("D-Bus API") from e
+                LOG.debug("rhsm D-Bus API not available, using the cli: %s", e)
+                self._dbus = False
+        return self._dbus or None
+
     def run(self, args: list) -> (int, str, str):
         cmd = [self.exe] + args
-        with subprocess.Popen(
+        counters.count(counters.SUBPROCESSES)
+        with self._timed("cli", args[0]), subprocess.Popen(
             cmd, stdout=subprocess.PIPE, universal_newlines=True
         ) as proc:
             out, err = proc.communicate()
@@ -59,9 +172,27 @@ class SubscriptionManager:
                 raise SubscriptionManagerFailure(" ".join(cmd))
             return rc, out, err
 
+    def _dbus_status(self, transport: DbusTransport) -> (int, str, str):
+        """The status over D-Bus, None when the call failed in auto mode"""
+        try:
+            with self._timed("dbus", "status"):
+                status = transport.status()
+        except Exception as e:  # pylint: disable=broad-except
+            if self._backend == "dbus":
+                raise SubscriptionManagerFailure("status") from e
+            LOG.debug("rhsm D-Bus status failed, using the cli: %s", e)
+            self._dbus = False
+            return None
+        if not status.get("valid"):
+            LOG.debug("rhsm status: %s", status)
+            raise SubscriptionManagerFailure("status")
+        return 0, f"Overall Status: {status.get('status')}\n", ""
+
     def status(self):
         try:
-            return self.run(["status"])
+            transport = self._get_dbus()
+            result = self._dbus_status(transport) if transport else None
+            return result or self.run(["status"])
         except SubscriptionManagerFailure as e:
             raise SubscriptionManagerConfigError from e
 
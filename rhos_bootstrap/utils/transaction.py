@@ -0,0 +1,142 @@
+# Copyright 2020 Red Hat, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+import tempfile
+import time
+
+from rhos_bootstrap.constants import STAGED_TRANSACTION_FILE
+from rhos_bootstrap.exceptions import StagedTransactionInvalid
+
+LOG = logging.getLogger(__name__)
+
+
+def write_json(path: str, data: dict):
+    """Atomically replace path with data"""
+    target_dir = os.path.dirname(path)
+    os.makedirs(target_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", dir=target_dir, delete=False, encoding="utf-8"
+    ) as out:
+        json.dump(data, out, indent=2, sort_keys=True)
+    os.replace(out.name, path)
+
+
+class ResolvedTransaction:  # pylint: disable=too-many-instance-attributes
+    """Resolved package transaction
+
+    Records the package manifest, the resolved transaction and the state of
+    the system it was resolved against: the rpmdb version, the enabled
+    repositories metadata checksums and the enabled module streams. It is
+    used to stage downloaded packages and to replay the same transaction on
+    identical systems.
+    """
+
+    def __init__(
+        self,
+        version: str,
+        distro: str,
+        manifest: dict,
+        transaction: dict,
+        *,
+        state: dict = None,
+        created: float = None,
+    ):
+        self._version = version
+        self._distro = distro
+        self._manifest = manifest
+        self._transaction = transaction
+        self._state = state or {}
+        self._created = created or time.time()
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def distro(self):
+        return self._distro
+
+    @property
+    def manifest(self) -> dict:
+        return self._manifest
+
+    @property
+    def transaction(self) -> dict:
+        return self._transaction
+
+    @property
+    def state(self) -> dict:
+        return self._state
+
+    @property
+    def created(self):
+        return self._created
+
+    @classmethod
+    def load(cls, path: str = STAGED_TRANSACTION_FILE):
+        try:
+            with open(path, "r", encoding="utf-8") as data:
+                resolved = json.load(data)
+            return cls(
+                resolved["version"],
+                resolved["distro"],
+                resolved["manifest"],
+                resolved["transaction"],
+                state=resolved.get("state"),
+                created=resolved["created"],
+            )
+        except OSError as e:
+            raise StagedTransactionInvalid(f"{path} not found") from e
+        except (ValueError, KeyError, TypeError) as e:
+            raise StagedTransactionInvalid(f"{path} is corrupted") from e
+
+    def save(self, path: str = STAGED_TRANSACTION_FILE):
+        LOG.debug("Recording resolved transaction in %s", path)
+        write_json(path, self.to_dict())
+
+    @staticmethod
+    def remove(path: str = STAGED_TRANSACTION_FILE):
+        if os.path.exists(path):
+            os.unlink(path)
+
+    def incompatibilities(self, version: str, distro: str, state: dict) -> list:
+        """Reasons this transaction can not be replayed on a system"""
+        reasons = []
+        if version != self._version:
+            reasons.append(f"resolved for version {self._version}")
+        if distro != self._distro:
+            reasons.append(f"resolved on {self._distro}")
+        if state.get("rpmdb") != self._state.get("rpmdb"):
+            reasons.append("the installed packages differ")
+        repos = self._state.get("repos", {})
+        current = state.get("repos", {})
+        for repo_id in sorted(set(repos) | set(current)):
+            if repos.get(repo_id) != current.get(repo_id):
+                reasons.append(f"the {repo_id} repository differs")
+        if state.get("modules") != self._state.get("modules"):
+            reasons.append("the enabled module streams differ")
+        return reasons
+
+    def to_dict(self) -> dict:
+        return {
+            "version": self._version,
+            "distro": self._distro,
+            "manifest": self._manifest,
+            "transaction": self._transaction,
+            "state": self._state,
+            "created": self._created,
+        }